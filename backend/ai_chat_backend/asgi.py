@@ -3,6 +3,10 @@ ASGI config for ai_chat_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn ai_chat_backend.asgi:application``)
+so Server-Sent Events endpoints such as /api/rag/chat/stream/ forward LLM
+tokens as they arrive; under WSGI a streamed response is sent in one piece.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -222,6 +222,131 @@ CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
 
 # Vector Store Settings
 FAISS_INDEX_PATH = BASE_DIR / 'vector_store'
-EMBEDDING_MODEL = 'all-MiniLM-L6-v2'  # sentence-transformers model
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+# sentence-transformers model. Prefix with 'onnx-int8:' (or 'onnx:' for float32) to run it through
+# ONNX Runtime instead of PyTorch, after exporting it with `manage.py export_onnx_model`; check
+# parity and speed with `manage.py benchmark_embeddings`.
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+# Chunk size and overlap in tokens of the embedding model's tokenizer. The size is capped at
+# the model's max sequence length (256 for all-MiniLM-L6-v2), past which the encoder truncates.
+CHUNK_SIZE = 256
+CHUNK_OVERLAP = 32
+
+# ANN index settings
+# FAISS_INDEX_TYPE: 'flat' (exact), 'ivf_flat', 'hnsw' or 'ivf_pq'.
+# IVF types stay flat until FAISS_MIN_TRAINING_VECTORS (default 39 * centroids) exist, then migrate.
+# It is raised to what training needs at least: nlist for IVF, 2^nbits (256) for PQ.
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+FAISS_MIN_TRAINING_VECTORS = None
+FAISS_IVF_NLIST = 256
+FAISS_IVF_NPROBE = 16
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_CONSTRUCTION = 80
+FAISS_HNSW_EF_SEARCH = 64
+FAISS_PQ_M = 96  # sub-quantizers, must divide the embedding dimension (384)
+
+# Compressed vector storage: 'float' (uncompressed), 'sq8' (4x smaller) or 'pq' (16x smaller with 96 sub-quantizers).
+# Compressed indices over-fetch k * FAISS_RESCORE_FACTOR candidates and re-score them with the float32 vectors on disk.
+FAISS_STORAGE_MODE = os.getenv('FAISS_STORAGE_MODE', 'float')
+FAISS_RESCORE_FACTOR = 4
+
+# Open the saved index and chunk text read-only through mmap, so every worker shares one
+# page-cache copy (flat codes are mapped in place from faiss-cpu 1.11). Read-only workers reload
+# when the writer saves; uploads need a writable process.
+FAISS_MMAP_READONLY = os.getenv('FAISS_MMAP_READONLY', 'False') == 'True'
+
+# Uploads append vectors and chunks to on-disk logs; the full index snapshot is rewritten in the
+# background once this many vectors have been appended since the last one.
+FAISS_SNAPSHOT_INTERVAL = 10000
+
+# Deleted chunks are tombstoned and skipped at query time; the index and raw vectors are
+# compacted in the background once this fraction of the vectors is deleted.
+FAISS_TOMBSTONE_COMPACTION_RATIO = 0.2
+
+# Number of FAISS shards. Documents are assigned to a shard by a hash of their path; each shard
+# is an independent index under FAISS_INDEX_PATH/shard_NN, persisted and compacted on its own.
+# Changing the count requires re-uploading the documents.
+FAISS_NUM_SHARDS = int(os.getenv('FAISS_NUM_SHARDS', '1'))
+
+# Filtered searches matching at most this many chunks score them exactly from the raw vectors;
+# larger selections are passed to the FAISS index search as an IDSelector.
+FAISS_FILTER_EXACT_THRESHOLD = 20000
+
+# Query embedding cache: an in-process LRU of this many entries, optionally backed by a shared
+# cache from CACHES (e.g. 'query_embeddings') so all worker processes reuse each other's work.
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+QUERY_EMBEDDING_SHARED_CACHE = os.getenv('QUERY_EMBEDDING_SHARED_CACHE', '')
+
+# Query embeddings missing from the cache are micro-batched across concurrent requests: the
+# first request waits up to EMBEDDING_BATCH_MAX_WAIT_MS for others, and up to
+# EMBEDDING_BATCH_MAX_SIZE texts are encoded in one forward pass.
+EMBEDDING_BATCHER_ENABLED = os.getenv('EMBEDDING_BATCHER_ENABLED', 'True') == 'True'
+EMBEDDING_BATCH_MAX_SIZE = 32
+EMBEDDING_BATCH_MAX_WAIT_MS = 5
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'query_embeddings': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'query_embeddings',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# Semantic answer cache for rag_chat: a question whose embedding has at least this cosine
+# similarity to one answered before (same filters, same index version) reuses that answer.
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'True') == 'True'
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 3600  # seconds
+ANSWER_CACHE_MAX_SIZE = 1000
+
+# Persistent chunk embedding cache keyed by (model, sha256 of the chunk text), so re-uploads and
+# revisions only embed changed chunks. Least recently used entries are evicted past the limit.
+CHUNK_EMBEDDING_CACHE_PATH = BASE_DIR / 'cache' / 'chunk_embeddings.sqlite3'
+CHUNK_EMBEDDING_CACHE_MAX_ENTRIES = 200000
+
+# Background ingestion: uploads return 202 and are processed by a pool of worker threads that
+# claim jobs from the IngestionJob table, after requeueing jobs interrupted by a restart. Only one
+# process may write the index (a file lock next to FAISS_INDEX_PATH), so the pool runs in one
+# `manage.py run_ingestion_worker` process, which opens the index writable unless
+# INGESTION_WORKER_MMAP_READONLY is set; give the web workers FAISS_MMAP_READONLY True. A single
+# web process can run the pool itself instead: start it with INGESTION_AUTOSTART=True (e.g.
+# `INGESTION_AUTOSTART=True python manage.py runserver`; not with gunicorn --preload, whose
+# forked workers do not inherit the threads). INGESTION_ASYNC False processes uploads inline.
+INGESTION_ASYNC = os.getenv('INGESTION_ASYNC', 'True') == 'True'
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '2'))
+INGESTION_AUTOSTART = os.getenv('INGESTION_AUTOSTART', 'False') == 'True'
+INGESTION_WORKER_MMAP_READONLY = os.getenv('INGESTION_WORKER_MMAP_READONLY', 'False') == 'True'
+INGESTION_POLL_INTERVAL = 5  # seconds between queue checks when idle
+
+# PDF text extraction runs page ranges of this many pages on a pool of worker processes
+# (default: one per CPU); PDFs no longer than one range are extracted in-process.
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', '0')) or None
+PDF_EXTRACTION_PAGES_PER_TASK = 20
+
+# Uploads are extracted, chunked and embedded as a stream of batches of this many chunks,
+# so memory stays flat regardless of file size and large uploads are accepted.
+EMBEDDING_BATCH_SIZE = 64
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(200 * 1024 * 1024)))  # bytes
+
+# Hybrid search (mode 'hybrid' on /api/rag/search/) fuses this many vector hits and BM25 keyword
+# hits per query with reciprocal-rank fusion, 1 / (HYBRID_RRF_K + rank) summed over both rankings.
+HYBRID_SEARCH_CANDIDATES = 50
+HYBRID_RRF_K = 60
+
+# Optional cross-encoder re-ranking of RAG context (per request with "rerank": true, or for every
+# request with RERANK_BY_DEFAULT). As many candidates as the measured cost per pair allows in
+# RERANK_TIME_BUDGET_MS (at most RERANK_MAX_CANDIDATES) are fetched and scored in batches; if a
+# batch would overrun the budget, the vector order is used. An empty RERANKER_MODEL disables it.
+# The model is loaded in the background when the server starts (RERANKER_PRELOAD, which defaults
+# to RERANK_BY_DEFAULT) or on the first re-ranked request; until it is ready, or for
+# RERANKER_RETRY_INTERVAL seconds after a failed load, requests keep the vector order.
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_BY_DEFAULT = os.getenv('RERANK_BY_DEFAULT', 'False') == 'True'
+RERANKER_PRELOAD = os.getenv('RERANKER_PRELOAD', str(RERANK_BY_DEFAULT)) == 'True'
+RERANKER_RETRY_INTERVAL = 300
+RERANK_TIME_BUDGET_MS = 250
+RERANK_MAX_CANDIDATES = 20
+RERANK_BATCH_SIZE = 8
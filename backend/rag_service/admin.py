@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Document, DocumentChunk, VectorStore
+from .models import Document, DocumentChunk, VectorStore, IngestionJob
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
@@ -15,6 +15,13 @@ class DocumentChunkAdmin(admin.ModelAdmin):
     search_fields = ['content', 'document__filename']
     readonly_fields = ['id', 'created_at']
 
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['document', 'status', 'attempts', 'worker', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['document__filename']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
 @admin.register(VectorStore)
 class VectorStoreAdmin(admin.ModelAdmin):
     list_display = ['name', 'embedding_model', 'total_vectors', 'dimension', 'updated_at']
@@ -0,0 +1,143 @@
+"""
+Semantic Answer Cache
+Reuses rag_chat answers for questions whose embedding is close enough to one
+answered before. Entries are tied to the vector store version they were
+computed against, so any upload or delete invalidates them.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    """Answers keyed by query embedding, matched by cosine similarity, evicted least recently used first"""
+
+    def __init__(self, max_size: int = 1000, ttl: int = 3600, similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._version = None
+        self._embeddings = None  # (n, d) unit vectors, row i belongs to the entry with id self._ids[i]
+        self._ids = []
+        self._entries = OrderedDict()  # entry id -> (scope, created_at, answer), least recently used first
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def scope_key(**scope) -> str:
+        """Request parameters that must match exactly for an answer to be reused"""
+        return json.dumps(scope, sort_keys=True, default=str)
+
+    def _check_version(self, version):
+        """Drop every entry once the vector store changed"""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._version = version
+            self._reset()
+
+    def _reset(self):
+        self._embeddings = None
+        self._ids = []
+        self._entries = OrderedDict()
+
+    def _keep_rows(self, keep: List[int]):
+        """Keep the given rows of the embedding matrix and drop the other entries"""
+        kept_ids = [self._ids[i] for i in keep]
+        for entry_id in set(self._ids).difference(kept_ids):
+            del self._entries[entry_id]
+        self._ids = kept_ids
+        self._embeddings = self._embeddings[keep] if keep else None
+
+    def _drop_expired(self, now: float):
+        keep = [i for i, entry_id in enumerate(self._ids) if now - self._entries[entry_id][1] < self.ttl]
+        if len(keep) < len(self._ids):
+            self._keep_rows(keep)
+
+    def get(self, query_embedding: 'np.ndarray', scope: str, version) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Cached (answer, similarity) for the closest earlier question, or None"""
+        query = np.asarray(query_embedding, dtype='float32')
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version(version)
+            self._drop_expired(time.time())
+            if self._embeddings is not None:
+                similarities = self._embeddings @ query
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.similarity_threshold:
+                        break
+                    entry_id = self._ids[i]
+                    if self._entries[entry_id][0] == scope:
+                        self.hits += 1
+                        self._entries.move_to_end(entry_id)
+                        return self._entries[entry_id][2], float(similarities[i])
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: 'np.ndarray', scope: str, version, answer: Dict[str, Any]):
+        """Store an answer computed against the given vector store version"""
+        query = np.asarray(query_embedding, dtype='float32')
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            if version != self._version:
+                return  # The store changed while the answer was being generated
+            self._entries[self._next_id] = (scope, time.time(), answer)
+            self._ids.append(self._next_id)
+            self._next_id += 1
+            if self._embeddings is None:
+                self._embeddings = query[None, :]
+            else:
+                self._embeddings = np.vstack([self._embeddings, query])
+            if len(self._entries) > self.max_size:
+                # Entries not hit for the longest time first
+                evicted = set(islice(self._entries, len(self._entries) - self.max_size))
+                self._keep_rows([i for i, entry_id in enumerate(self._ids) if entry_id not in evicted])
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': True,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl,
+            'similarity_threshold': self.similarity_threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations
+        }
+
+# Global instance (singleton pattern)
+_answer_cache = None
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Get or create the answer cache, None when ANSWER_CACHE_ENABLED is off"""
+    global _answer_cache
+    if not getattr(settings, 'ANSWER_CACHE_ENABLED', True):
+        return None
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache(
+            max_size=getattr(settings, 'ANSWER_CACHE_MAX_SIZE', 1000),
+            ttl=getattr(settings, 'ANSWER_CACHE_TTL', 3600),
+            similarity_threshold=getattr(settings, 'ANSWER_CACHE_SIMILARITY_THRESHOLD', 0.95)
+        )
+    return _answer_cache
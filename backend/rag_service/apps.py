@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RagServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_service'
+
+    def ready(self):
+        from .ingestion import start_ingestion_on_startup
+        from .reranker import start_reranker_on_startup
+        start_ingestion_on_startup()
+        start_reranker_on_startup()
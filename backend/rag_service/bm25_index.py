@@ -0,0 +1,166 @@
+"""
+BM25 Keyword Index
+Compact in-memory inverted index over chunk text, keyed by the same
+positions as the FAISS index, so exact identifiers and acronyms that dense
+embeddings miss can be found. Scored with Okapi BM25 and combined with the
+vector hits by reciprocal-rank fusion.
+"""
+import re
+import math
+import pickle
+import logging
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import id_bitmap
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; an identifier like 'POL-2231' becomes 'pol' and '2231'"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """Append-only postings per term: uint32 positions and uint16 term frequencies in typed arrays.
+
+    Deleted positions keep their postings but get length 0, which excludes them from
+    scoring and from the collection statistics.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = np.zeros(1024, dtype='uint32')  # tokens per position, grown by doubling
+        self._size = 0
+        self._live = 0
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """One past the highest position added"""
+        return self._size
+
+    def add(self, positions: Iterable[int], texts: Iterable[str]):
+        """Index chunk texts at new positions"""
+        with self._lock:
+            for position, text in zip(positions, texts):
+                if position >= len(self._lengths):
+                    grown = np.zeros(max(position + 1, 2 * len(self._lengths)), dtype='uint32')
+                    grown[:len(self._lengths)] = self._lengths
+                    self._lengths = grown
+                self._size = max(self._size, position + 1)
+
+                counts = Counter(tokenize(text))
+                for term, frequency in counts.items():
+                    entry = self._postings.get(term)
+                    if entry is None:
+                        entry = self._postings[term] = (array('I'), array('H'))
+                    entry[0].append(position)
+                    entry[1].append(min(frequency, 0xFFFF))
+
+                length = sum(counts.values())
+                if length and not self._lengths[position]:
+                    self._live += 1
+                    self._total_length += length
+                self._lengths[position] = length
+
+    def remove(self, positions: Iterable[int]):
+        """Stop matching the chunks at these positions"""
+        with self._lock:
+            for position in positions:
+                if position < self._size and self._lengths[position]:
+                    self._live -= 1
+                    self._total_length -= int(self._lengths[position])
+                    self._lengths[position] = 0
+
+    def search(self, query: str, k: int,
+               allowed: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Best k (BM25 scores, positions) for query, best first, limited to the allowed bitmap if given"""
+        terms = Counter(tokenize(query))
+        with self._lock:
+            postings = [
+                (np.array(entry[0], dtype='int64'), np.array(entry[1], dtype='float32'), query_frequency)
+                for term, query_frequency in terms.items()
+                for entry in [self._postings.get(term)] if entry is not None
+            ]
+            lengths = [self._lengths[positions] for positions, _, _ in postings]
+            live, total_length = self._live, self._total_length
+
+        empty = (np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64'))
+        if not postings or not live:
+            return empty
+
+        average_length = total_length / live
+        all_positions, all_scores = [], []
+        for (positions, frequencies, query_frequency), doc_lengths in zip(postings, lengths):
+            present = doc_lengths > 0
+            positions, frequencies, doc_lengths = positions[present], frequencies[present], doc_lengths[present]
+            if len(positions) == 0:
+                continue
+            idf = math.log(1 + (live - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths / average_length)
+            all_positions.append(positions)
+            all_scores.append(query_frequency * idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not all_positions:
+            return empty
+
+        positions = np.concatenate(all_positions)
+        scores = np.concatenate(all_scores)
+        if allowed is not None:
+            keep = id_bitmap.contains(allowed, positions)
+            positions, scores = positions[keep], scores[keep]
+
+        # Sum the per-term contributions of each chunk
+        positions, inverse = np.unique(positions, return_inverse=True)
+        scores = np.bincount(inverse, weights=scores).astype('float32')
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            positions, scores = positions[top], scores[top]
+        order = np.lexsort((positions, -scores))
+        return scores[order], positions[order]
+
+    def stats(self) -> dict:
+        return {
+            'terms': len(self._postings),
+            'postings': sum(len(entry[0]) for entry in self._postings.values()),
+            'indexed_chunks': self._live,
+            'average_chunk_tokens': round(self._total_length / self._live, 1) if self._live else None
+        }
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            return pickle.dumps({
+                'k1': self.k1, 'b': self.b, 'postings': self._postings, 'lengths': self._lengths[:self._size].copy(),
+                'live': self._live, 'total_length': self._total_length
+            })
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BM25Index':
+        state = pickle.loads(data)
+        index = cls(state['k1'], state['b'])
+        index._postings = state['postings']
+        index._size = len(state['lengths'])
+        index._lengths = np.zeros(max(1024, index._size), dtype='uint32')
+        index._lengths[:index._size] = state['lengths']
+        index._live = state['live']
+        index._total_length = state['total_length']
+        return index
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Items of several best-first rankings, ordered by the sum of 1 / (k + rank) over the rankings"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,141 @@
+"""
+Columnar Chunk Store
+Keeps chunk metadata on disk as fixed-width numeric columns plus a UTF-8
+text blob, keyed by FAISS id. Appends only write the new chunks and reads
+decode just the rows a search returns.
+"""
+import os
+import logging
+from typing import Any, Dict, Iterator, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# One fixed-width row per chunk; text_end is the end offset of the chunk text in the blob
+ROW_DTYPE = [
+    ('document_id', '<i8'),
+    ('chunk_index', '<i8'),
+    ('start_char', '<i8'),
+    ('end_char', '<i8'),
+    ('text_end', '<i8'),
+]
+
+class ChunkStore:
+    """Append-only chunk metadata store, row number == FAISS id"""
+
+    def __init__(self, base_path: str, read_only: bool = False):
+        self.rows_path = f"{base_path}_chunks.rows"
+        self.text_path = f"{base_path}_chunks.text"
+        self.read_only = read_only
+        self._dtype = np.dtype(ROW_DTYPE)
+        self._rows = None
+
+    @classmethod
+    def exists(cls, base_path: str) -> bool:
+        """Whether a chunk store has been written at base_path"""
+        store = cls(base_path)
+        return os.path.exists(store.rows_path) and os.path.exists(store.text_path)
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.rows_path):
+            return 0
+        return os.path.getsize(self.rows_path) // self._dtype.itemsize
+
+    def _columns(self) -> 'np.ndarray':
+        """Memory-mapped view of the fixed-width rows"""
+        count = len(self)
+        if count == 0:
+            return np.zeros(0, dtype=self._dtype)
+        if self._rows is None or len(self._rows) != count:
+            self._rows = np.memmap(self.rows_path, dtype=self._dtype, mode='r', shape=(count,))
+        return self._rows
+
+    def _read_text(self, start: int, end: int) -> str:
+        with open(self.text_path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start).decode('utf-8')
+
+    def __getitem__(self, chunk_id: int) -> Dict[str, Any]:
+        rows = self._columns()
+        if chunk_id < 0:
+            chunk_id += len(rows)
+        if not 0 <= chunk_id < len(rows):
+            raise IndexError(chunk_id)
+
+        row = rows[chunk_id]
+        text_start = int(rows[chunk_id - 1]['text_end']) if chunk_id > 0 else 0
+        return {
+            'id': chunk_id,
+            'document_id': int(row['document_id']),
+            'chunk_index': int(row['chunk_index']),
+            'content': self._read_text(text_start, int(row['text_end'])),
+            'start_char': int(row['start_char']),
+            'end_char': int(row['end_char'])
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for chunk_id in range(len(self)):
+            yield self[chunk_id]
+
+    def column(self, name: str) -> 'np.ndarray':
+        """Read one numeric column for every chunk"""
+        return np.array(self._columns()[name])
+
+    def append(self, chunks: List[Dict[str, Any]]) -> int:
+        """Append chunks and return the id of the first one"""
+        if self.read_only:
+            raise RuntimeError("Chunk store is opened read-only")
+
+        first_id = len(self)
+        rows = self._columns()
+        text_end = int(rows[-1]['text_end']) if len(rows) else 0
+
+        new_rows = np.zeros(len(chunks), dtype=self._dtype)
+        os.makedirs(os.path.dirname(self.text_path) or '.', exist_ok=True)
+        mode = 'r+b' if os.path.exists(self.text_path) else 'wb'
+        with open(self.text_path, mode) as f:
+            # Start at the last committed offset so text from an interrupted append is overwritten
+            f.seek(text_end)
+            for row, chunk in zip(new_rows, chunks):
+                data = chunk['content'].encode('utf-8')
+                f.write(data)
+                text_end += len(data)
+                row['document_id'] = chunk['document_id']
+                row['chunk_index'] = chunk['chunk_index']
+                row['start_char'] = chunk['start_char']
+                row['end_char'] = chunk['end_char']
+                row['text_end'] = text_end
+            f.truncate()
+
+        # Rows are written last, a chunk only exists once its row is on disk
+        with open(self.rows_path, 'ab') as f:
+            f.write(new_rows.tobytes())
+        self._rows = None
+        return first_id
+
+    def truncate(self, count: int):
+        """Drop every chunk after the first count"""
+        if self.read_only:
+            raise RuntimeError("Chunk store is opened read-only")
+        if count >= len(self):
+            return
+
+        text_end = int(self._columns()[count - 1]['text_end']) if count > 0 else 0
+        self._rows = None
+        with open(self.rows_path, 'r+b') as f:
+            f.truncate(count * self._dtype.itemsize)
+        with open(self.text_path, 'r+b') as f:
+            f.truncate(text_end)
+
+    def clear(self):
+        """Remove all chunks"""
+        if self.read_only:
+            raise RuntimeError("Chunk store is opened read-only")
+        self._rows = None
+        for path in (self.rows_path, self.text_path):
+            if os.path.exists(path):
+                os.remove(path)
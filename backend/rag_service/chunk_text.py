@@ -0,0 +1,182 @@
+"""
+Chunk Text Docstore
+LangChain docstore for FAISS shards that keeps chunk metadata in memory and
+chunk text in an append-only file next to the snapshot. Snapshots only
+pickle metadata and byte spans; text is read through mmap for the chunks a
+search returns, so read-only workers share one page-cache copy of it.
+Purging deleted chunks rewrites the live text into the next generation of
+the file.
+"""
+import os
+import mmap
+import logging
+from typing import Dict, List, Tuple, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+TEXT_FILENAME = 'chunks.text'
+
+def text_filename(generation: int) -> str:
+    """Name of a generation of the chunk text file"""
+    return TEXT_FILENAME if generation == 0 else f'chunks.{generation}.text'
+
+# A chunk's text: a (start, end) byte span in the text file, or the text itself until it is written
+TextRef = Union[Tuple[int, int], str]
+
+class ChunkTextDocstore(Docstore, AddableMixin):
+    """Docstore entries are (metadata, text span) pairs keyed by docstore id"""
+
+    def __init__(self):
+        self._dict: Dict[str, Tuple[Dict, TextRef]] = {}
+        # End of the committed text; bytes after it belong to an upload that never got its log record
+        self.text_end = 0
+        self.generation = 0
+        self.path = None
+        self.read_only = True
+        self._map = None
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Document]) -> 'ChunkTextDocstore':
+        """Convert an in-memory docstore, e.g. from a snapshot saved before the text file existed"""
+        docstore = cls()
+        docstore.add(documents)
+        return docstore
+
+    def __getstate__(self):
+        return {'_dict': self._dict, 'text_end': self.text_end, 'generation': self.generation}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._dict = state['_dict']
+        self.text_end = state['text_end']
+        self.generation = state.get('generation', 0)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._dict
+
+    def __len__(self) -> int:
+        return len(self._dict)
+
+    def open(self, directory: str, read_only: bool = False):
+        """Read (and, unless read_only, append) text in the shard directory's text file"""
+        self.path = os.path.join(directory, text_filename(self.generation))
+        self.read_only = read_only
+        self._map = None
+
+    def write(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Append texts to the file and return their spans; they are committed once logged"""
+        if self.read_only:
+            raise RuntimeError("Chunk text is opened read-only")
+        spans = []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as f:
+            # Start at the committed end so text from an interrupted upload is overwritten
+            f.seek(self.text_end)
+            offset = self.text_end
+            for text in texts:
+                data = text.encode('utf-8')
+                f.write(data)
+                spans.append((offset, offset + len(data)))
+                offset += len(data)
+            f.truncate()
+        return spans
+
+    def write_pending(self) -> int:
+        """Move text held in memory (converted or old-format entries) into the file"""
+        pending = [doc_id for doc_id, (_, text) in self._dict.items() if isinstance(text, str)]
+        if pending:
+            spans = self.write([self._dict[doc_id][1] for doc_id in pending])
+            for doc_id, span in zip(pending, spans):
+                self._dict[doc_id] = (self._dict[doc_id][0], span)
+            self.text_end = spans[-1][1]
+        return len(pending)
+
+    def truncate(self):
+        """Drop text after the committed end"""
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.text_end:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.text_end)
+            self._map = None
+
+    def compact(self):
+        """Rewrite the text of the live chunks into the next generation of the file.
+
+        The current file stays for read-only workers that have not reloaded yet;
+        older generations are removed.
+        """
+        if self.read_only:
+            raise RuntimeError("Chunk text is opened read-only")
+        directory = os.path.dirname(self.path)
+        generation = self.generation + 1
+        path = os.path.join(directory, text_filename(generation))
+        entries = {}
+        offset = 0
+        with open(path, 'wb') as f:
+            for doc_id, (metadata, ref) in self._dict.items():
+                data = self.text(ref).encode('utf-8')
+                f.write(data)
+                entries[doc_id] = (metadata, (offset, offset + len(data)))
+                offset += len(data)
+
+        reclaimed = self.size() - offset
+        keep = {os.path.basename(self.path), os.path.basename(path)}
+        self._dict = entries
+        self.text_end = offset
+        self.generation = generation
+        self.path = path
+        self._map = None
+        for name in os.listdir(directory):
+            if name.startswith('chunks.') and name.endswith('.text') and name not in keep:
+                os.remove(os.path.join(directory, name))
+        logger.info(f"Rewrote chunk text into {path}, reclaiming {reclaimed} bytes of deleted chunks")
+
+    def size(self) -> int:
+        """Bytes of text on disk"""
+        return os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0
+
+    def add_entries(self, ids: List[str], texts: List[TextRef], metadatas: List[Dict]):
+        """Register chunks by their text span (or text)"""
+        overlapping = set(ids).intersection(self._dict)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self._dict[doc_id] = (metadata, text)
+            if not isinstance(text, str):
+                self.text_end = max(self.text_end, text[1])
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        self.add_entries(list(texts), [document.page_content for document in texts.values()],
+                         [document.metadata for document in texts.values()])
+
+    def delete(self, ids: List) -> None:
+        # Deleted text stays in the file until compact(), the committed end does not move back
+        for doc_id in ids:
+            self._dict.pop(doc_id, None)
+
+    def metadata(self, doc_id: str) -> Dict:
+        """Metadata of a chunk, without reading its text"""
+        return self._dict[doc_id][0]
+
+    def text(self, ref: TextRef) -> str:
+        if isinstance(ref, str):
+            return ref
+        start, end = ref
+        if start == end:
+            return ''
+        text_map = self._map
+        if text_map is None or len(text_map) < end:
+            with open(self.path, 'rb') as f:
+                text_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map = text_map
+        return text_map[start:end].decode('utf-8')
+
+    def search(self, search: str) -> Union[str, Document]:
+        entry = self._dict.get(search)
+        if entry is None:
+            return f"ID {search} not found."
+        metadata, text = entry
+        return Document(id=search, page_content=self.text(text), metadata=metadata)
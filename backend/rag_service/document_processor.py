@@ -1,10 +1,21 @@
 """
 Document Processing Utilities
-Handles text extraction from various file formats
+Handles text extraction from various file formats. Extraction can also be
+streamed page by page (or block by block) into an incremental chunker, so
+memory stays flat regardless of the file size.
 """
 import os
+import re
+import bisect
+import codecs
+import copy
 import logging
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from pathlib import Path
 
 try:
@@ -14,28 +25,142 @@ except ImportError:
     PyPDF2 = None
     DocxDocument = None
 
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
 logger = logging.getLogger(__name__)
 
+def _pdf_reader(file):
+    """PdfReader from pypdf, or from PyPDF2 when only the older package is installed"""
+    if pypdf is not None:
+        return pypdf.PdfReader(file)
+    if PyPDF2 is not None:
+        return PyPDF2.PdfReader(file)
+    raise ImportError("pypdf or PyPDF2 is required for PDF processing")
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end) of a PDF; runs in the extraction worker processes"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = _pdf_reader(file)
+        return [pdf_reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+# Process pool shared by all PDF extractions (spawned, not forked: the parent runs threads)
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pdf_pool
+
+def iter_pdf_pages(file_path: str, workers: Optional[int] = None, pages_per_task: int = 20) -> Iterator[str]:
+    """Yield the text of every page of a PDF, in page order.
+    
+    Page ranges of pages_per_task pages are extracted in parallel on a process
+    pool of workers processes (default: one per CPU), with at most one range
+    per worker in flight so memory stays bounded; short documents and
+    single-worker setups are extracted in this process.
+    """
+    with open(file_path, 'rb') as file:
+        page_count = len(_pdf_reader(file).pages)
+    
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or page_count <= pages_per_task:
+        with open(file_path, 'rb') as file:
+            pdf_reader = _pdf_reader(file)
+            for page in pdf_reader.pages:
+                yield page.extract_text() or ''
+        return
+    
+    pool = _get_pdf_pool(workers)
+    starts = iter(range(0, page_count, pages_per_task))
+    pending = deque()
+    for start in starts:
+        pending.append(pool.submit(_extract_pdf_page_range, file_path, start, min(start + pages_per_task, page_count)))
+        if len(pending) >= workers:
+            break
+    while pending:
+        pages = pending.popleft().result()
+        start = next(starts, None)
+        if start is not None:
+            pending.append(pool.submit(_extract_pdf_page_range, file_path, start, min(start + pages_per_task, page_count)))
+        yield from pages
+
+def extract_pdf_pages(file_path: str, workers: Optional[int] = None, pages_per_task: int = 20) -> List[str]:
+    """Text of every page of a PDF, in page order"""
+    return list(iter_pdf_pages(file_path, workers, pages_per_task))
+
+def _text_file_encoding(file_path: str, block_size: int = 1 << 20) -> str:
+    """utf-8 if the whole file decodes as such, latin-1 otherwise; reads in blocks"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def iter_text_file(file_path: str, block_size: int = 64 * 1024) -> Iterator[str]:
+    """Yield the decoded text of a plain text file in blocks of block_size characters"""
+    with open(file_path, 'r', encoding=_text_file_encoding(file_path)) as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            yield block
+
 class DocumentProcessor:
     """Handles document loading and text extraction"""
     
     SUPPORTED_FORMATS = ['.pdf', '.txt', '.md', '.docx']
     
-    def __init__(self):
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+    def __init__(self, pdf_workers: Optional[int] = None, pdf_pages_per_task: int = 20,
+                 tokenizer=None, chunk_size: int = 1000, chunk_overlap: int = 200):
+        # Sizes count words, or tokens of the tokenizer when one is given
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.pdf_workers = pdf_workers
+        self.pdf_pages_per_task = pdf_pages_per_task
+    
+    @classmethod
+    def for_model(cls, model, chunk_size: int, chunk_overlap: int, **kwargs) -> 'DocumentProcessor':
+        """Processor chunking by tokens of a sentence-transformers model.
+        
+        chunk_size is capped at the model's max sequence length less its special
+        tokens, so the encoder never truncates a chunk.
+        """
+        tokenizer = getattr(model, 'tokenizer', None)
+        if tokenizer is None or not getattr(tokenizer, 'is_fast', False):
+            logger.warning("Embedding model has no fast tokenizer, chunking by words")
+            return cls(**kwargs)
+        
+        max_tokens = model.max_seq_length - tokenizer.num_special_tokens_to_add(pair=False)
+        if chunk_size > max_tokens:
+            chunk_size = max_tokens
+        # The model truncates while encoding and chunking must not; a fast tokenizer
+        # shared between threads fails with "Already borrowed" when those settings flip
+        tokenizer = copy.deepcopy(tokenizer)
+        return cls(tokenizer=tokenizer, chunk_size=chunk_size, chunk_overlap=min(chunk_overlap, chunk_size - 1), **kwargs)
     
     def extract_text(self, file_path: str) -> str:
         """Extract text from a document file"""
+        return self.extract_text_with_pages(file_path)[0]
+    
+    def extract_text_with_pages(self, file_path: str) -> Tuple[str, Optional[List[int]]]:
+        """Extract text from a document file, with the start offset of each page for PDFs"""
         try:
             file_extension = Path(file_path).suffix.lower()
             
             if file_extension == '.pdf':
                 return self._extract_pdf_text(file_path)
             elif file_extension == '.docx':
-                return self._extract_docx_text(file_path)
+                return self._extract_docx_text(file_path), None
             elif file_extension in ['.txt', '.md']:
-                return self._extract_text_file(file_path)
+                return self._extract_text_file(file_path), None
             else:
                 raise ValueError(f"Unsupported file format: {file_extension}")
         
@@ -43,22 +168,31 @@ class DocumentProcessor:
             logger.error(f"Error extracting text from {file_path}: {str(e)}")
             raise
     
-    def _extract_pdf_text(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        if PyPDF2 is None:
-            raise ImportError("PyPDF2 is required for PDF processing")
-        
-        text = ""
+    def _extract_pdf_text(self, file_path: str) -> Tuple[str, List[int]]:
+        """Extract text from PDF file, with the offset in it where each page starts"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+            pages = extract_pdf_pages(file_path, self.pdf_workers, self.pdf_pages_per_task)
         except Exception as e:
             logger.error(f"Error reading PDF {file_path}: {str(e)}")
             raise
         
-        return text.strip()
+        # Pages joined by newlines, offsets shifted by the leading whitespace strip() removes
+        text = "\n".join(pages)
+        stripped = text.strip()
+        leading = len(text) - len(text.lstrip())
+        page_starts = []
+        offset = 0
+        for page in pages:
+            page_starts.append(max(offset - leading, 0))
+            offset += len(page) + 1
+        return stripped, page_starts
+    
+    @staticmethod
+    def page_number(page_starts: Optional[List[int]], char_offset: int) -> Optional[int]:
+        """1-based page containing char_offset, None for documents without pages"""
+        if not page_starts:
+            return None
+        return bisect.bisect_right(page_starts, char_offset)
     
     def _extract_docx_text(self, file_path: str) -> str:
         """Extract text from DOCX file"""
@@ -91,61 +225,177 @@ class DocumentProcessor:
             raise
     
     def chunk_text(self, text: str) -> List[Dict[str, Any]]:
-        """Split text into overlapping chunks"""
-        if not text:
-            return []
+        """Split text into overlapping chunks whose content is text[start_char:end_char]"""
+        return [
+            {key: value for key, value in chunk.items() if key != 'page_number'}
+            for chunk in self.iter_chunks([(text, None)])
+        ]
+    
+    def iter_segments(self, file_path: str) -> Iterator[Tuple[str, Optional[int]]]:
+        """Yield the text of a document piece by piece with its 1-based page (None without pages).
         
-        chunks = []
-        words = text.split()
+        Concatenated, the pieces are the document text.
+        """
+        file_extension = Path(file_path).suffix.lower()
         
-        if len(words) <= self.chunk_size:
-            return [{
-                'content': text,
-                'start_char': 0,
-                'end_char': len(text),
-                'chunk_index': 0
-            }]
+        if file_extension == '.pdf':
+            pages = iter_pdf_pages(file_path, self.pdf_workers, self.pdf_pages_per_task)
+            for page_number, page in enumerate(pages, 1):
+                yield page + "\n", page_number
+        elif file_extension == '.docx':
+            if DocxDocument is None:
+                raise ImportError("python-docx is required for DOCX processing")
+            for paragraph in DocxDocument(file_path).paragraphs:
+                yield paragraph.text + "\n", None
+        elif file_extension in ['.txt', '.md']:
+            for block in iter_text_file(file_path):
+                yield block, None
+        else:
+            raise ValueError(f"Unsupported file format: {file_extension}")
+    
+    def _word_spans(self, segments: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Tuple[int, int, Optional[int], int]]:
+        """(start_char, end_char, page_number, 1) of every whitespace-separated word"""
+        offset = 0
+        tail = None  # Last word of the previous segment, which may continue in this one
+        for text, page_number in segments:
+            for match in re.finditer(r'\S+', text):
+                word = (offset + match.start(), offset + match.end(), page_number)
+                if tail is not None:
+                    if match.start() == 0:
+                        word = (tail[0], word[1], tail[2])
+                    else:
+                        yield tail + (1,)
+                    tail = None
+                if match.end() == len(text):
+                    tail = word
+                else:
+                    yield word + (1,)
+            if tail is not None and text and text[-1].isspace():
+                yield tail + (1,)
+                tail = None
+            offset += len(text)
         
-        chunk_index = 0
-        start_word = 0
+        if tail is not None:
+            yield tail + (1,)
+    
+    def _token_spans(self, segments: Iterable[Tuple[str, Optional[int]]],
+                     batch_size: int = 16) -> Iterator[Tuple[int, int, Optional[int], int]]:
+        """(start_char, end_char, page_number, token count) of every word the tokenizer pre-splits.
         
-        while start_word < len(words):
-            end_word = min(start_word + self.chunk_size, len(words))
-            chunk_words = words[start_word:end_word]
-            chunk_text = ' '.join(chunk_words)
-            
-            # Calculate character positions
-            start_char = len(' '.join(words[:start_word]))
-            if start_word > 0:
-                start_char += 1  # Account for space
-            
-            end_char = start_char + len(chunk_text)
-            
-            chunks.append({
-                'content': chunk_text,
+        Segments are tokenized batch_size at a time. A word cut off at the end of
+        a segment is carried into the next one, so tokens match those of the
+        whole text; chunks never start inside a word.
+        """
+        pending = []  # (text, start offset, page_number)
+        
+        def tokenize():
+            encoded = self.tokenizer(
+                [text for text, _, _ in pending], add_special_tokens=False,
+                return_offsets_mapping=True, return_attention_mask=False, return_token_type_ids=False,
+                verbose=False  # Segments are longer than the model input; only chunks are encoded
+            )
+            for i, (_, base, page_number) in enumerate(pending):
+                word = None
+                for word_id, (start, end) in zip(encoded.word_ids(i), encoded['offset_mapping'][i]):
+                    if word is not None and word_id == word[3]:
+                        word = (word[0], base + end, page_number, word_id, word[4] + 1)
+                        continue
+                    if word is not None:
+                        yield word[0], word[1], word[2], word[4]
+                    word = (base + start, base + end, page_number, word_id, 1)
+                if word is not None:
+                    yield word[0], word[1], word[2], word[4]
+            pending.clear()
+        
+        offset = 0
+        carry = ''
+        for text, page_number in segments:
+            base = offset - len(carry)
+            offset += len(text)
+            text = carry + text
+            cut = len(text) - len(re.search(r'\S*\Z', text).group())
+            carry = text[cut:]
+            if cut:
+                pending.append((text[:cut], base, page_number))
+            if len(pending) >= batch_size:
+                yield from tokenize()
+        
+        if carry:
+            pending.append((carry, offset - len(carry), page_number))
+        if pending:
+            yield from tokenize()
+    
+    def iter_chunks(self, segments: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Dict[str, Any]]:
+        """Split streamed text into overlapping chunks of chunk_size words, or tokens with a tokenizer.
+        
+        A single pass over the text: unit boundaries are found once and a running
+        offset is kept, so start_char/end_char are exact offsets into the
+        concatenated segments and each chunk's content is that exact span. Only
+        the text of the chunk being built is held, so memory does not grow with
+        the document.
+        """
+        units = deque()  # (start_char, end_char, page_number, words or tokens)
+        window = {'text': '', 'start': 0, 'last_end': 0}  # Text from 'start' to the end of the last segment read
+        
+        def recorded(segments):
+            for text, page_number in segments:
+                # Drop text before the first unit still needed
+                keep_from = units[0][0] if units else window['last_end']
+                if keep_from > window['start']:
+                    window['text'] = window['text'][keep_from - window['start']:]
+                    window['start'] = keep_from
+                window['text'] += text
+                yield text, page_number
+        
+        def make_chunk(chunk_index):
+            start_char, end_char = units[0][0], units[-1][1]
+            return {
+                'content': window['text'][start_char - window['start']:end_char - window['start']],
                 'start_char': start_char,
                 'end_char': end_char,
-                'chunk_index': chunk_index
-            })
-            
-            chunk_index += 1
-            
-            # Move start position considering overlap
-            if end_word >= len(words):
-                break
-            
-            start_word = max(start_word + self.chunk_size - self.chunk_overlap, start_word + 1)
+                'chunk_index': chunk_index,
+                'page_number': units[0][2]
+            }
         
-        return chunks
+        spans = self._token_spans(recorded(segments)) if self.tokenizer is not None else self._word_spans(recorded(segments))
+        chunk_index = 0
+        size = 0  # Words or tokens in units
+        new_units = 0  # Units not yet in an emitted chunk
+        for start_char, end_char, page_number, length in spans:
+            if units and size + length > self.chunk_size:
+                yield make_chunk(chunk_index)
+                chunk_index += 1
+                new_units = 0
+                # Keep at most chunk_overlap of the chunk, and room for the new unit
+                while units and (size > self.chunk_overlap or size + length > self.chunk_size):
+                    size -= units.popleft()[3]
+            units.append((start_char, end_char, page_number, length))
+            window['last_end'] = end_char
+            size += length
+            new_units += 1
+        
+        if units and (new_units or chunk_index == 0):
+            yield make_chunk(chunk_index)
+    
+    def iter_chunk_batches(self, file_path: str, batch_size: int = 64) -> Iterator[List[Dict[str, Any]]]:
+        """Stream a document as lists of at most batch_size chunks, sized for one embedding call"""
+        chunks = self.iter_chunks(self.iter_segments(file_path))
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                return
+            yield batch
     
     def process_document(self, file_path: str) -> Dict[str, Any]:
         """Process a document and return metadata and chunks"""
         try:
             # Extract text
-            text = self.extract_text(file_path)
+            text, page_starts = self.extract_text_with_pages(file_path)
             
             # Create chunks
             chunks = self.chunk_text(text)
+            for chunk in chunks:
+                chunk['page_number'] = self.page_number(page_starts, chunk['start_char'])
             
             # Get file metadata
             file_stats = os.stat(file_path)
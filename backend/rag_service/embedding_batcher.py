@@ -0,0 +1,119 @@
+"""
+Query Embedding Micro-Batcher
+Request threads that need query embeddings at the same time are served by
+one forward pass: requests arriving within EMBEDDING_BATCH_MAX_WAIT_MS of
+the first are gathered, up to EMBEDDING_BATCH_MAX_SIZE texts, encoded
+together by a single worker thread, and each caller gets its own rows back.
+"""
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """Gathers concurrent encode calls for one model into shared batches"""
+
+    def __init__(self, encode: Callable[[List[str]], 'np.ndarray'], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = 'embedding-batcher'):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+
+    def encode(self, texts: List[str]) -> 'np.ndarray':
+        """Embeddings for texts, computed in a batch shared with concurrent callers"""
+        if not texts:
+            return np.asarray(self._encode([]), dtype='float32')
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _gather(self) -> List[tuple]:
+        """Block for one request, then take more until the batch is full or the wait is over"""
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._gather()
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                vectors = np.asarray(self._encode(texts), dtype='float32')
+            except Exception as e:
+                logger.error(f"Batched embedding of {len(texts)} texts failed: {str(e)}")
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            self.requests += len(requests)
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'texts': self.texts,
+            'mean_batch_size': round(self.texts / self.batches, 2) if self.batches else None,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+# Global instances, one per model namespace (singleton pattern)
+_batchers: Dict[str, EmbeddingBatcher] = {}
+_batchers_lock = threading.Lock()
+
+def batched_encoder(namespace: str, encode: Callable[[List[str]], 'np.ndarray']) -> Callable[[List[str]], 'np.ndarray']:
+    """encode routed through the shared batcher for namespace, or encode itself when batching is off.
+
+    namespace identifies the model and its options; the first encode given for it is used.
+    """
+    if not getattr(settings, 'EMBEDDING_BATCHER_ENABLED', True):
+        return encode
+    with _batchers_lock:
+        if namespace not in _batchers:
+            _batchers[namespace] = EmbeddingBatcher(
+                encode,
+                max_batch_size=getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32),
+                max_wait_ms=getattr(settings, 'EMBEDDING_BATCH_MAX_WAIT_MS', 5),
+                name=f'embedding-batcher-{len(_batchers)}'
+            )
+        return _batchers[namespace].encode
+
+def batcher_stats() -> Optional[Dict[str, dict]]:
+    """Stats of every batcher by namespace, None when batching is off"""
+    if not getattr(settings, 'EMBEDDING_BATCHER_ENABLED', True):
+        return None
+    return {namespace: batcher.stats() for namespace, batcher in _batchers.items()}
@@ -0,0 +1,263 @@
+"""
+Embedding Cache
+Caches query embeddings so repeated questions skip the sentence-transformer.
+An in-process LRU sits in front of an optional shared Django cache, so every
+worker process can reuse embeddings computed by the others. Chunk embeddings
+are kept in a persistent SQLite cache keyed by the hash of the chunk text.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a query: NFC normalized, whitespace collapsed.
+
+    Case is kept, since it can change the embedding of cased models.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+class QueryEmbeddingCache:
+    """Bounded LRU of query embeddings with hit/miss counters and an optional shared tier"""
+
+    def __init__(self, max_size: int = 4096, shared_alias: Optional[str] = None):
+        self.max_size = max_size
+        self.shared_alias = shared_alias or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _key(self, namespace: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_query(text).encode('utf-8')).hexdigest()
+        return f"query_embedding:{namespace}:{digest}"
+
+    def _shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def embed(self, namespace: str, queries: List[str],
+              encode: Callable[[List[str]], 'np.ndarray']) -> 'np.ndarray':
+        """Embeddings for queries, calling encode once for all the ones not cached.
+
+        namespace identifies the model (and its options) the embeddings come from.
+        """
+        keys = [self._key(namespace, query) for query in queries]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        shared = self._shared()
+        if missing and shared is not None:
+            try:
+                for key, data in shared.get_many(missing).items():
+                    found[key] = np.frombuffer(data, dtype='float32')
+            except Exception as e:
+                logger.warning(f"Shared query embedding cache unavailable: {str(e)}")
+
+        computed = {}
+        to_encode = [key for key in missing if key not in found]
+        if to_encode:
+            texts = {key: query for key, query in zip(keys, queries)}
+            vectors = np.asarray(encode([texts[key] for key in to_encode]), dtype='float32')
+            computed = dict(zip(to_encode, vectors))
+            if shared is not None:
+                try:
+                    shared.set_many({key: vector.tobytes() for key, vector in computed.items()})
+                except Exception as e:
+                    logger.warning(f"Could not write to the shared query embedding cache: {str(e)}")
+
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.shared_hits += len(missing) - len(to_encode)
+            self.misses += len(to_encode)
+            for key in missing:
+                self._entries[key] = computed[key] if key in computed else found[key]
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        found.update(computed)
+        return np.stack([found[key] for key in keys])
+
+    def clear(self):
+        """Drop the in-process entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'shared_cache': self.shared_alias
+        }
+
+class ChunkEmbeddingCache:
+    """Persistent, size-bounded cache of chunk embeddings keyed by (model, sha256 of the text)"""
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+        # Rows as of the last COUNT(*) plus those this process inserted since; see _evict
+        self._count = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')  # Worker processes share the file
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings '
+                '(model TEXT, text_hash TEXT, vector BLOB, last_used REAL, PRIMARY KEY (model, text_hash))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def embed(self, model: str, texts: List[str], encode: Callable[[List[str]], 'np.ndarray']) -> 'np.ndarray':
+        """Embeddings for texts, calling encode only for text not embedded with this model before"""
+        hashes = [self.text_hash(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+        found = {}
+
+        with self._lock:
+            connection = self._connect()
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch]
+                ).fetchall()
+                found.update((text_hash, np.frombuffer(vector, dtype='float32')) for text_hash, vector in rows)
+
+        hit_hashes = list(found)
+        missing = [text_hash for text_hash in unique_hashes if text_hash not in found]
+        if missing:
+            texts_by_hash = dict(zip(hashes, texts))
+            vectors = np.asarray(encode([texts_by_hash[text_hash] for text_hash in missing]), dtype='float32')
+            found.update(zip(missing, vectors))
+
+        now = time.time()
+        with self._lock:
+            self.hits += len(hashes) - len(missing)
+            self.misses += len(missing)
+            connection = self._connect()
+            with connection:
+                # Hits only touch last_used; vectors are written once, when first embedded
+                for start in range(0, len(hit_hashes), 500):
+                    batch = hit_hashes[start:start + 500]
+                    connection.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? "
+                        f"AND text_hash IN ({','.join('?' * len(batch))})",
+                        [now, model, *batch]
+                    )
+                connection.executemany(
+                    'INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                    [(model, text_hash, found[text_hash].tobytes(), now) for text_hash in missing]
+                )
+            if missing:
+                self._evict(connection, len(missing))
+
+        return np.stack([found[text_hash] for text_hash in hashes]) if hashes else np.zeros((0, 0), dtype='float32')
+
+    def _evict(self, connection: sqlite3.Connection, inserted: int):
+        """Drop the least recently used entries once the cache is 10% over its limit.
+
+        The table is only counted again when this process's estimate crosses the
+        limit, since other worker processes insert into (and evict from) it too.
+        """
+        if self._count is None:
+            (self._count,) = connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+        else:
+            self._count += inserted
+        if self._count <= self.max_entries * 1.1:
+            return
+        (count,) = connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+        self._count = count
+        if count <= self.max_entries * 1.1:
+            return
+        with connection:
+            connection.execute(
+                'DELETE FROM embeddings WHERE rowid IN '
+                '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+                (count - self.max_entries,)
+            )
+        self._count = self.max_entries
+        logger.info(f"Evicted {count - self.max_entries} entries from the chunk embedding cache")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'max_entries': self.max_entries,
+            'path': self.path
+        }
+
+# Global instances (singleton pattern)
+_query_embedding_cache = None
+_chunk_embedding_cache = None
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Get or create the process-wide query embedding cache"""
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        _query_embedding_cache = QueryEmbeddingCache(
+            max_size=getattr(settings, 'QUERY_EMBEDDING_CACHE_SIZE', 4096),
+            shared_alias=getattr(settings, 'QUERY_EMBEDDING_SHARED_CACHE', '')
+        )
+    return _query_embedding_cache
+
+def get_chunk_embedding_cache() -> Optional[ChunkEmbeddingCache]:
+    """Get or create the chunk embedding cache, None when CHUNK_EMBEDDING_CACHE_PATH is unset"""
+    global _chunk_embedding_cache
+    path = getattr(settings, 'CHUNK_EMBEDDING_CACHE_PATH', None)
+    if not path:
+        return None
+    if _chunk_embedding_cache is None:
+        _chunk_embedding_cache = ChunkEmbeddingCache(
+            path, max_entries=getattr(settings, 'CHUNK_EMBEDDING_CACHE_MAX_ENTRIES', 200000)
+        )
+    return _chunk_embedding_cache
+
+def embed_chunks(model: str, texts: List[str], encode: Callable[[List[str]], 'np.ndarray']) -> 'np.ndarray':
+    """Embed chunk texts through the chunk embedding cache when it is enabled"""
+    cache = get_chunk_embedding_cache()
+    if cache is None:
+        return np.asarray(encode(texts), dtype='float32')
+    return cache.embed(model, texts, encode)
@@ -0,0 +1,123 @@
+"""
+Embedding Model Registry
+Loads each sentence-transformers model once per process and shares it
+between the FAISS vector store, VectorStoreService and the RAG chain,
+recording how long each took to load and how much memory it holds. Names
+prefixed 'onnx:' or 'onnx-int8:' load the ONNX Runtime backend instead.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    from langchain_community.embeddings import SentenceTransformerEmbeddings
+except ImportError:
+    SentenceTransformerEmbeddings = None
+
+from django.conf import settings
+
+from .onnx_embeddings import OnnxEmbeddingModel, parse_model_name
+
+logger = logging.getLogger(__name__)
+
+def _resident_bytes() -> Optional[int]:
+    """Resident set size of this process, None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class EmbeddingModelRegistry:
+    """Process-wide cache of loaded embedding models, keyed by model name"""
+
+    def __init__(self, cache_folder: Optional[str] = None):
+        self.cache_folder = cache_folder
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str) -> 'SentenceTransformer':
+        """The loaded model, loading it on first use"""
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self._load(model_name)
+            return self._models[model_name]
+
+    def _load(self, model_name: str) -> 'SentenceTransformer':
+        # Set environment variable for safe deserialization in controlled environment
+        os.environ['SENTENCE_TRANSFORMERS_TRUST_REMOTE_CODE'] = 'True'
+
+        onnx_model = parse_model_name(model_name)
+        if onnx_model is None and SentenceTransformer is None:
+            raise ImportError("sentence-transformers is required for embeddings")
+
+        rss_before = _resident_bytes()
+        start = time.perf_counter()
+        if onnx_model is not None:
+            base_name, quantize = onnx_model
+            model = OnnxEmbeddingModel(base_name, cache_folder=self.cache_folder, quantize=quantize)
+        else:
+            model = SentenceTransformer(
+                model_name,
+                trust_remote_code=True,  # Safe in controlled environment
+                cache_folder=self.cache_folder
+            )
+        load_seconds = time.perf_counter() - start
+        rss_after = _resident_bytes()
+
+        self._stats[model_name] = {
+            'backend': ('onnx-int8' if onnx_model[1] else 'onnx') if onnx_model is not None else 'pytorch',
+            'load_seconds': round(load_seconds, 3),
+            'parameter_bytes': (
+                model.model_bytes if onnx_model is not None
+                else sum(p.numel() * p.element_size() for p in model.parameters())
+            ),
+            'resident_bytes_added': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'dimension': model.get_sentence_embedding_dimension(),
+            'max_seq_length': model.max_seq_length
+        }
+        logger.info(f"Loaded embedding model {model_name} in {load_seconds:.2f}s")
+        return model
+
+    def langchain_embeddings(self, model_name: str) -> 'SentenceTransformerEmbeddings':
+        """LangChain embeddings wrapping the shared model instead of loading another copy"""
+        if SentenceTransformerEmbeddings is None:
+            raise ImportError("langchain-community is required for LangChain embeddings")
+        # construct() skips __init__, which would load the model again
+        return SentenceTransformerEmbeddings.construct(
+            client=self.get(model_name), model_name=model_name, cache_folder=self.cache_folder,
+            model_kwargs={}, encode_kwargs={}, multi_process=False, show_progress=False
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+# Global instance (singleton pattern)
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_embedding_model_registry() -> EmbeddingModelRegistry:
+    """Get or create the process-wide embedding model registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = EmbeddingModelRegistry(cache_folder=os.path.join(settings.BASE_DIR, 'model_cache'))
+    return _registry
+
+def get_embedding_model(model_name: Optional[str] = None) -> 'SentenceTransformer':
+    """The shared sentence-transformers model, EMBEDDING_MODEL by default"""
+    return get_embedding_model_registry().get(model_name or getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+
+def get_langchain_embeddings(model_name: Optional[str] = None) -> 'SentenceTransformerEmbeddings':
+    """LangChain embeddings over the shared model, EMBEDDING_MODEL by default"""
+    return get_embedding_model_registry().langchain_embeddings(
+        model_name or getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    )
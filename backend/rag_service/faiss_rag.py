@@ -2,52 +2,142 @@
 FAISS Vector Store and RAG Implementation
 """
 import os
+import heapq
 import uuid
+import hashlib
+import pickle
+import shutil
+import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple
 from pathlib import Path
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
 from langchain_community.vectorstores import FAISS as LangChainFAISS
-from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 
 from django.conf import settings
 
+from . import id_bitmap
+from .bm25_index import BM25Index, reciprocal_rank_fusion
+from .chunk_text import ChunkTextDocstore
+from .reranker import get_reranker, reranker_unavailable_reason
+from . import document_processor
+from .document_processor import iter_pdf_pages, iter_text_file
+from .embedding_cache import embed_chunks, get_chunk_embedding_cache, get_query_embedding_cache
+from .embedding_batcher import batched_encoder, batcher_stats
+from .ingestion import index_read_only
+from .embedding_models import get_embedding_model_registry, get_langchain_embeddings
+from . import index_factory
+from . import raw_vectors
+from .upload_log import UploadLog
+
 logger = logging.getLogger(__name__)
 
+# Upload log record marking chunks as deleted, followed by their docstore ids
+DELETE_RECORD = 'delete'
+
+# Chunk metadata fields with an id bitmap per value, used to filter searches.
+# upload_date is the day part of the uploaded_at metadata value.
+FILTER_FIELDS = ['document_id', 'filename', 'content_type', 'upload_date']
+
+def embed_queries(embedding_model, queries: List[str]) -> 'np.ndarray':
+    """Embed search queries in one batch, reusing cached embeddings of repeated queries.
+
+    Uncached queries are encoded together with those of concurrent requests.
+    """
+    return get_query_embedding_cache().embed(
+        embedding_model.model_name, queries,
+        batched_encoder(embedding_model.model_name, embedding_model.embed_documents)
+    )
+
 class DocumentProcessor:
     """Handles document loading and text extraction"""
     
-    def __init__(self):
+    def __init__(self, buffer_size: int = 64 * 1024, embedding_model=None):
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
         )
+        self.buffer_size = buffer_size  # Characters of plain text split at a time
+        
+        # With the embedding model's tokenizer, chunks are cut at CHUNK_SIZE tokens instead
+        self.token_chunker = None
+        client = getattr(embedding_model, 'client', None)
+        if client is not None:
+            self.token_chunker = document_processor.DocumentProcessor.for_model(
+                client,
+                chunk_size=getattr(settings, 'CHUNK_SIZE', 256),
+                chunk_overlap=getattr(settings, 'CHUNK_OVERLAP', 32),
+                pdf_workers=getattr(settings, 'PDF_EXTRACTION_WORKERS', None),
+                pdf_pages_per_task=getattr(settings, 'PDF_EXTRACTION_PAGES_PER_TASK', 20)
+            )
+            if self.token_chunker.tokenizer is None:
+                self.token_chunker = None
+    
+    def iter_chunks(self, file_path: str) -> Iterator[Document]:
+        """Stream a document's chunks without loading the whole text"""
+        file_extension = Path(file_path).suffix.lower()
+        
+        if self.token_chunker is not None:
+            for chunk in self.token_chunker.iter_chunks(self.token_chunker.iter_segments(file_path)):
+                metadata = {'source': file_path, 'start_index': chunk['start_char']}
+                if chunk['page_number'] is not None:
+                    metadata['page'] = chunk['page_number'] - 1  # 0-based, as PyPDFLoader numbered pages
+                yield Document(page_content=chunk['content'], metadata=metadata)
+        elif file_extension == '.pdf':
+            # One page at a time, extracted in parallel; chunks keep the page metadata
+            pages = iter_pdf_pages(
+                file_path,
+                workers=getattr(settings, 'PDF_EXTRACTION_WORKERS', None),
+                pages_per_task=getattr(settings, 'PDF_EXTRACTION_PAGES_PER_TASK', 20)
+            )
+            for page, text in enumerate(pages):
+                yield from self.text_splitter.split_documents(
+                    [Document(page_content=text, metadata={'source': file_path, 'page': page})]
+                )
+        elif file_extension in ['.txt', '.md']:
+            # Split buffered blocks, carrying the last chunk's text over so chunks span block boundaries
+            buffer = ''
+            for block in iter_text_file(file_path, self.buffer_size):
+                buffer += block
+                if len(buffer) < self.buffer_size:
+                    continue
+                texts = self.text_splitter.split_text(buffer)
+                for text in texts[:-1]:
+                    yield Document(page_content=text, metadata={'source': file_path})
+                carry_start = buffer.rfind(texts[-1]) if texts else -1
+                buffer = buffer[carry_start:] if carry_start >= 0 else ''
+            for text in self.text_splitter.split_text(buffer):
+                yield Document(page_content=text, metadata={'source': file_path})
+        else:
+            raise ValueError(f"Unsupported file format: {file_extension}")
+    
+    def iter_chunk_batches(self, file_path: str, batch_size: int = 64) -> Iterator[List[Document]]:
+        """Stream a document's chunks in lists of at most batch_size, sized for one embedding call"""
+        chunks = self.iter_chunks(file_path)
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                return
+            yield batch
     
     def load_document(self, file_path: str) -> List[Document]:
         """Load and split a document into chunks"""
         try:
-            file_extension = Path(file_path).suffix.lower()
-            
-            if file_extension == '.pdf':
-                loader = PyPDFLoader(file_path)
-            elif file_extension in ['.txt', '.md']:
-                loader = TextLoader(file_path)
-            else:
-                raise ValueError(f"Unsupported file format: {file_extension}")
-            
-            documents = loader.load()
-            chunks = self.text_splitter.split_documents(documents)
-            
+            chunks = list(self.iter_chunks(file_path))
             logger.info(f"Loaded {len(chunks)} chunks from {file_path}")
             return chunks
             
@@ -55,25 +145,125 @@ class DocumentProcessor:
             logger.error(f"Error loading document {file_path}: {str(e)}")
             raise
 
-class FAISSVectorStore:
-    """FAISS vector store for document embeddings and similarity search"""
+class ReadWriteLock:
+    """Shared lock for searches, exclusive re-entrant lock for writers.
     
-    def __init__(self, index_path: Optional[str] = None):
-        # Set environment variable for safe deserialization in controlled environment
-        os.environ['SENTENCE_TRANSFORMERS_TRUST_REMOTE_CODE'] = 'True'
-        
-        self.embedding_model = SentenceTransformerEmbeddings(
-            model_name="all-MiniLM-L6-v2"
-        )
+    Used as a context manager it takes the exclusive side, like the RLock it
+    replaces; read() takes the shared side. Waiting writers hold back new
+    readers so a steady stream of searches cannot starve uploads.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+    
+    def acquire(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+    
+    def release(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    @contextmanager
+    def read(self):
+        """Hold the shared side; a thread that holds the exclusive side may also read"""
+        if self._writer == threading.get_ident():
+            yield
+            return
+        with self._condition:
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+class FAISSShard:
+    """One FAISS index directory with its own docstore, logs and snapshots"""
+    
+    def __init__(self, index_path: Optional[str] = None, embedding_model=None, seed_sample: bool = True):
+        self.embedding_model = embedding_model or get_langchain_embeddings()
+        self.seed_sample = seed_sample
         self.index_path = index_path or settings.FAISS_INDEX_PATH
         self.vector_store = None
-        self.document_processor = DocumentProcessor()
+        self.document_processor = DocumentProcessor(embedding_model=self.embedding_model)
+        self.embedding_batch_size = getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+        
+        # Full-precision copies of the vectors, used to re-score compressed search results
+        self.raw_vectors = None
+        self.rescore_factor = getattr(settings, 'FAISS_RESCORE_FACTOR', 4)
+        self._recall_cache = None
+        self._migration_retry_ntotal = 0
+        self._migration_lock = threading.Lock()
+        
+        # Worker processes can open the index read-only through mmap and share the page cache
+        self.read_only = index_read_only()
+        self._loaded_mtime = None
+        
+        # Uploads are appended to a log; the index and docstore are only rewritten by snapshots
+        self.upload_log = UploadLog(os.path.join(self.index_path, 'uploads.log'))
+        self.snapshot_interval = getattr(settings, 'FAISS_SNAPSHOT_INTERVAL', 10000)
+        self._log_offset = 0
+        self._log_identity = 0
+        self._snapshot_ntotal = 0
+        self._snapshot_stale = False
+        # Index, docstore and bitmaps change in place: searches share the lock, writers take it alone
+        self._lock = ReadWriteLock()
+        self._compaction_thread = None
+        
+        # Deleted chunks keep their position until compaction; searches skip them through an IDSelector
+        self.tombstone_compaction_ratio = getattr(settings, 'FAISS_TOMBSTONE_COMPACTION_RATIO', 0.2)
+        self._tombstones = id_bitmap.empty(0)
+        self._deleted_count = 0
+        self._next_position = 0
+        self._purge_thread = None
+        
+        # Filters are resolved to position bitmaps; small selections are scored exactly from the raw vectors
+        self.filter_exact_threshold = getattr(settings, 'FAISS_FILTER_EXACT_THRESHOLD', 20000)
+        self._value_bitmaps = {field: {} for field in FILTER_FIELDS}
+        
+        # BM25 index over the chunk text at the same positions, saved with each snapshot
+        self.keyword_index = BM25Index()
+        
+        # Bumped whenever searchable content changes, e.g. to invalidate cached answers
+        self.version = 0
         
         # Initialize or load existing index
         self._initialize_vector_store()
     
     def _initialize_vector_store(self):
         """Initialize or load existing FAISS index"""
+        if self.read_only:
+            self._load_read_only()
+            return
+        
         try:
             # Check if both index.faiss and index.pkl files exist
             index_faiss_path = os.path.join(self.index_path, "index.faiss")
@@ -87,101 +277,893 @@ class FAISSVectorStore:
                     self.embedding_model,
                     allow_dangerous_deserialization=True  # Safe in controlled environment
                 )
+                index_factory.apply_search_params(self.vector_store.index)
+                self._open_chunk_text()
+                self._snapshot_ntotal = self.vector_store.index.ntotal
+                self._sync_raw_vectors()
+                self._rebuild_bitmaps()
+                self._replay_log()
+                # Snapshots saved before the chunk text file existed are saved again without their text
+                converted = self._commit_chunk_text()
+                
+                # Move an existing index (e.g. flat) to the configured type
+                if self._maybe_migrate_index() or converted:
+                    self.save_index()
             else:
                 logger.info("Creating new FAISS index - no existing index found")
-                # Create empty vector store with sample document
-                sample_doc = Document(page_content="Sample document for initialization", metadata={"source": "initialization"})
-                self.vector_store = LangChainFAISS.from_documents(
-                    [sample_doc], 
-                    self.embedding_model
-                )
+                self.vector_store = self._create_store()
+                self._open_chunk_text()
+                self._rebuild_bitmaps()
+                # Uploads logged before the snapshot files went missing are replayed onto the new index
+                logged = self.upload_log.size() > 0
+                self._sync_raw_vectors(rebuild=not logged)
+                if logged:
+                    logger.warning(f"No FAISS snapshot in {self.index_path}, rebuilding it from the upload log")
+                    self._replay_log()
+                self._commit_chunk_text()
+                self._maybe_migrate_index()
                 self.save_index()
         except Exception as e:
-            logger.error(f"Error initializing vector store: {str(e)}")
-            # If loading fails, create a new one
+            # The snapshot and upload log are left untouched so the index can be recovered
+            logger.error(f"Error initializing vector store from {self.index_path}: {str(e)}")
+            raise
+    
+    def _create_store(self) -> LangChainFAISS:
+        """New in-memory store, seeded with a sample document unless this is an extra shard"""
+        if self.seed_sample:
+            # Create empty vector store with sample document
+            sample_doc = Document(page_content="Sample document for initialization", metadata={"source": "initialization"})
+            return LangChainFAISS.from_documents([sample_doc], self.embedding_model)
+        
+        # Same metric LangChain gives the seeded shard, so scores from every shard can be merged
+        dimension = len(self.embedding_model.embed_query("initialization"))
+        return LangChainFAISS(
+            self.embedding_model, index_factory.create_initial_index(dimension, faiss.METRIC_L2), ChunkTextDocstore(), {}
+        )
+    
+    def _open_chunk_text(self):
+        """Keep chunk text in the shard's text file, converting the in-memory docstore of new or older indices"""
+        docstore = self.vector_store.docstore
+        if not isinstance(docstore, ChunkTextDocstore):
+            docstore = ChunkTextDocstore.from_documents(docstore._dict)
+            self.vector_store.docstore = docstore
+        docstore.open(self.index_path, read_only=self.read_only)
+    
+    def _commit_chunk_text(self) -> bool:
+        """Drop text of uploads that were never logged and write text still held in memory; True if any was"""
+        docstore = self.vector_store.docstore
+        docstore.truncate()
+        return docstore.write_pending() > 0
+    
+    def _load_read_only(self):
+        """Open the saved index read-only through mmap so workers share one page-cache copy"""
+        index_faiss_path = os.path.join(self.index_path, "index.faiss")
+        index_pkl_path = os.path.join(self.index_path, "index.pkl")
+        
+        if not (os.path.exists(index_faiss_path) and os.path.exists(index_pkl_path)):
+            logger.warning("No FAISS index to open read-only yet, using an empty in-memory store")
+            self.vector_store = self._create_store()
+            self._open_chunk_text()
+            self._loaded_mtime = None
+            self._rebuild_bitmaps()
+            return
+        
+        # index.pkl is moved into place last by save_index, so its mtime marks a complete save
+        self._loaded_mtime = os.path.getmtime(index_pkl_path)
+        
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+        faiss_index = faiss.read_index(index_faiss_path, flags)
+        index_factory.apply_search_params(faiss_index)
+        
+        with open(index_pkl_path, 'rb') as f:
+            # Safe in controlled environment, same file LangChainFAISS.load_local reads
+            docstore, index_to_docstore_id = pickle.load(f)
+        
+        self.vector_store = LangChainFAISS(self.embedding_model, faiss_index, docstore, index_to_docstore_id)
+        self._open_chunk_text()
+        self.raw_vectors = raw_vectors.RawVectorStore(os.path.join(self.index_path, 'vectors.f32'), faiss_index.d)
+        
+        # Uploads since the snapshot only go into the docstore; their vectors are searched from the raw file
+        self._rebuild_bitmaps()
+        self._log_offset = 0
+        self._replay_log(add_vectors=False)
+        logger.info(f"Opened FAISS index read-only with {faiss_index.ntotal} vectors")
+    
+    def _reload_if_stale(self):
+        """Pick up uploads and snapshots written by the writer process"""
+        try:
+            mtime = os.path.getmtime(os.path.join(self.index_path, "index.pkl"))
+        except OSError:
+            return
+        
+        with self._lock:
+            if mtime != self._loaded_mtime:
+                logger.info("FAISS snapshot changed on disk, reopening read-only copy")
+                self._load_read_only()
+            elif self.upload_log.identity() != self._log_identity or self.upload_log.size() > self._log_offset:
+                self._replay_log(add_vectors=False)
+    
+    def _replay_log(self, add_vectors: bool = True):
+        """Apply uploads logged since the snapshot was written.
+        
+        Each upload appends its raw vectors first and its log record last, so the
+        record marks a committed upload. Records already in the snapshot (the log
+        is trimmed after the snapshot is written) are skipped.
+        """
+        if self.upload_log.identity() != self._log_identity:
+            # Log was compacted, read it again from the start
+            self._log_identity = self.upload_log.identity()
+            self._log_offset = 0
+        
+        known_ids = set(self.vector_store.index_to_docstore_id.values())
+        docstore = self.vector_store.docstore
+        replayed = 0
+        
+        for end_offset, record in self.upload_log.read(self._log_offset):
+            if record[0] == DELETE_RECORD:
+                self._delete_entries(record[1])
+                self._log_offset = end_offset
+                continue
+            
+            # Text spans in the chunk text file; records written before it existed hold the text
+            ids, text_refs, metadatas = record
+            if ids and ids[0] in known_ids:
+                self._log_offset = end_offset
+                continue
+            if len(self.raw_vectors) < self._next_position + len(ids):
+                logger.error("Upload log is ahead of the raw vector file, stopping replay")
+                break
+            if text_refs and not isinstance(text_refs[-1], str) and docstore.size() < text_refs[-1][1]:
+                logger.error("Upload log is ahead of the chunk text file, stopping replay")
+                break
+            
+            vectors = None
+            if add_vectors:
+                vectors = self.raw_vectors.get(np.arange(self._next_position, self._next_position + len(ids)))
+            self._add_entries(ids, [docstore.text(ref) for ref in text_refs], metadatas, vectors, text_refs)
+            known_ids.update(ids)
+            replayed += len(ids)
+            self._log_offset = end_offset
+        
+        if add_vectors:
+            # Drop vectors of an upload that never got its log record
+            self.raw_vectors.truncate(self._next_position)
+        if replayed:
+            logger.info(f"Replayed {replayed} chunks appended since the last snapshot")
+    
+    def _add_entries(self, ids: List[str], texts: List[str], metadatas: List[Dict], vectors=None, text_refs=None):
+        """Register chunks at the next positions, adding their vectors to the index when given.
+        
+        text_refs are the spans the texts were written to in the chunk text file.
+        Positions keep counting past deleted chunks, so LangChain's
+        len(index_to_docstore_id) based numbering cannot be used.
+        """
+        if vectors is not None:
+            self.vector_store.index.add(np.ascontiguousarray(vectors, dtype='float32'))
+        self.vector_store.docstore.add_entries(ids, texts if text_refs is None else text_refs, metadatas)
+        first_position = self._next_position
+        for doc_id in ids:
+            self.vector_store.index_to_docstore_id[self._next_position] = doc_id
+            self._next_position += 1
+        self._index_metadata(range(first_position, self._next_position), metadatas)
+        self.keyword_index.add(range(first_position, self._next_position), texts)
+        self.version += 1
+    
+    def _rebuild_bitmaps(self):
+        """Rebuild the tombstone bitmap (positions with no docstore entry), the metadata bitmaps and the BM25 index"""
+        self._next_position = self.vector_store.index.ntotal
+        live = np.zeros(self._next_position, dtype=bool)
+        positions = np.fromiter(self.vector_store.index_to_docstore_id.keys(), dtype='int64')
+        live[positions[positions < self._next_position]] = True
+        self._tombstones = np.packbits(~live, bitorder='little')
+        self._deleted_count = int((~live).sum())
+        
+        self._value_bitmaps = {field: {} for field in FILTER_FIELDS}
+        self.version += 1
+        mapping = self.vector_store.index_to_docstore_id
+        self._index_metadata(mapping.keys(), [self.vector_store.docstore.metadata(doc_id) for doc_id in mapping.values()])
+        self._load_keyword_index()
+    
+    def _load_keyword_index(self):
+        """Load the BM25 index saved with the snapshot, rebuilding it when it does not cover the same positions"""
+        keyword_path = os.path.join(self.index_path, "bm25.pkl")
+        keyword_index = None
+        if os.path.exists(keyword_path):
             try:
-                logger.info("Creating new FAISS index due to loading error")
-                sample_doc = Document(page_content="Sample document for initialization", metadata={"source": "initialization"})
-                self.vector_store = LangChainFAISS.from_documents(
-                    [sample_doc], 
-                    self.embedding_model
-                )
-                self.save_index()
-            except Exception as creation_error:
-                logger.error(f"Error creating new vector store: {str(creation_error)}")
-                raise
+                with open(keyword_path, 'rb') as f:
+                    keyword_index = BM25Index.from_bytes(f.read())
+            except Exception as e:
+                logger.warning(f"Could not load BM25 index, rebuilding it: {str(e)}")
+        
+        mapping = self.vector_store.index_to_docstore_id
+        if keyword_index is None or keyword_index.size != self._next_position:
+            keyword_index = BM25Index()
+            positions = sorted(mapping)
+            keyword_index.add(positions, [self.vector_store.docstore.search(mapping[position]).page_content for position in positions])
+            logger.info(f"Built BM25 index over {len(positions)} chunks")
+        self.keyword_index = keyword_index
+    
+    def _index_metadata(self, positions, metadatas: List[Dict]):
+        """Add chunk positions to the bitmaps of their metadata values"""
+        groups = {}
+        for position, metadata in zip(positions, metadatas):
+            values = {field: metadata.get(field) for field in FILTER_FIELDS}
+            if metadata.get('uploaded_at'):
+                values['upload_date'] = str(metadata['uploaded_at'])[:10]
+            for field, value in values.items():
+                if value is not None:
+                    groups.setdefault((field, str(value)), []).append(position)
+        
+        for (field, value), value_positions in groups.items():
+            bitmaps = self._value_bitmaps[field]
+            bitmaps[value] = id_bitmap.set_ids(bitmaps.get(value, id_bitmap.empty(0)), value_positions)
     
-    def add_documents(self, file_paths: List[str]) -> Dict[str, Any]:
-        """Add documents to the vector store"""
+    def _filter_bitmap(self, filters: Dict[str, Any], size: int) -> Optional['np.ndarray']:
+        """Positions matching the filters: any listed value within a field, every given field"""
+        selected = None
+        for field in FILTER_FIELDS:
+            bitmaps = self._value_bitmaps[field]
+            if field == 'upload_date':
+                uploaded_from, uploaded_to = filters.get('uploaded_from'), filters.get('uploaded_to')
+                if uploaded_from is None and uploaded_to is None:
+                    continue
+                # ISO dates compare correctly as strings
+                values = [
+                    day for day in bitmaps
+                    if (uploaded_from is None or day >= uploaded_from) and (uploaded_to is None or day <= uploaded_to)
+                ]
+            else:
+                values = filters.get(field)
+                if not values:
+                    continue
+            
+            field_bitmap = id_bitmap.union((bitmaps[str(value)] for value in values if str(value) in bitmaps), size)
+            selected = field_bitmap if selected is None else id_bitmap.intersect(selected, field_bitmap)
+        return selected
+    
+    def _delete_entries(self, docstore_ids: List[str]) -> int:
+        """Drop chunks from the docstore and tombstone their positions"""
+        docstore_ids = set(docstore_ids)
+        positions = [
+            position for position, doc_id in self.vector_store.index_to_docstore_id.items()
+            if doc_id in docstore_ids
+        ]
+        for position in positions:
+            del self.vector_store.index_to_docstore_id[position]
+        self.vector_store.docstore.delete(list(docstore_ids))
+        
+        self._tombstones = id_bitmap.set_ids(self._tombstones, positions)
+        self._deleted_count += len(positions)
+        self.keyword_index.remove(positions)
+        self.version += 1
+        return len(positions)
+    
+    def _allowed_ids(self, filters: Optional[Dict[str, Any]] = None) -> Optional['np.ndarray']:
+        """Bitmap of the searchable positions, None while nothing is deleted or filtered"""
+        size = max(self._next_position, len(self.raw_vectors) if self.raw_vectors is not None else 0)
+        allowed = id_bitmap.invert(self._tombstones, size) if self._deleted_count else None
+        
+        selected = self._filter_bitmap(filters, size) if filters else None
+        if selected is None:
+            return allowed
+        return selected if allowed is None else id_bitmap.intersect(allowed, selected)
+    
+    def _sync_raw_vectors(self, rebuild: bool = False):
+        """Attach the raw vector file, rebuilding it for indices saved before it existed"""
+        faiss_index = self.vector_store.index
+        self.raw_vectors = raw_vectors.RawVectorStore(os.path.join(self.index_path, 'vectors.f32'), faiss_index.d)
+        if not rebuild and len(self.raw_vectors) >= faiss_index.ntotal:
+            return
+        if index_factory.storage_mode_of(faiss_index) == 'float':
+            self.raw_vectors.rewrite(index_factory.reconstruct_vectors(faiss_index))
+        else:
+            logger.warning("Raw vectors do not match the compressed index, exact re-scoring disabled")
+    
+    def _rescore_vectors(self) -> Optional[raw_vectors.RawVectorStore]:
+        """Raw vectors to re-score with, if the index is compressed and they are in sync"""
+        faiss_index = self.vector_store.index
+        if index_factory.storage_mode_of(faiss_index) == 'float':
+            return None
+        if self.raw_vectors is None or len(self.raw_vectors) < faiss_index.ntotal:
+            return None
+        return self.raw_vectors
+    
+    def _index_vectors(self, start: int, end: int) -> 'np.ndarray':
+        """Vectors at positions start..end-1, from the raw vector file when it matches the index"""
+        faiss_index = self.vector_store.index
+        if self.raw_vectors is not None and len(self.raw_vectors) == faiss_index.ntotal:
+            return self.raw_vectors.all()[start:end]
+        return index_factory.reconstruct_vectors(faiss_index, start, end)
+    
+    def _maybe_migrate_index(self) -> bool:
+        """Swap in the configured index type once it can be trained.
+        
+        Training runs without the shard lock so searches and uploads carry on;
+        vectors added in the meantime are added to the new index before it is
+        swapped in. A failed migration is logged and the current index stays in
+        service; it is tried again once the index has doubled in size.
+        """
+        if not self._migration_lock.acquire(blocking=False):
+            return False  # Another upload is already training the new index
+        try:
+            with self._lock:
+                faiss_index = self.vector_store.index
+                ntotal = faiss_index.ntotal
+                if ntotal < self._migration_retry_ntotal:
+                    return False
+                target = index_factory.migration_target(faiss_index)
+                if target is None:
+                    return False
+                vectors = self._index_vectors(0, ntotal)
+            
+            current = index_factory.index_type_of(faiss_index)
+            logger.info(f"Migrating FAISS index from {current} to {target[0]}/{target[1]} ({ntotal} vectors)")
+            try:
+                migrated = index_factory.build_index(vectors, faiss_index.d, target[0], faiss_index.metric_type, target[1])
+            except Exception as e:
+                logger.error(f"Error migrating FAISS index, keeping {current}: {str(e)}")
+                self._migration_retry_ntotal = 2 * ntotal
+                return False
+            
+            with self._lock:
+                if self.vector_store.index is not faiss_index:
+                    # Purged, cleared or reloaded while training, so the positions no longer match
+                    logger.info("FAISS index was replaced during migration, it is tried again on the next upload")
+                    return False
+                if faiss_index.ntotal > ntotal:
+                    migrated.add(np.ascontiguousarray(self._index_vectors(ntotal, faiss_index.ntotal), dtype='float32'))
+                
+                # Vectors keep their positions, so index_to_docstore_id stays valid
+                self.vector_store.index = migrated
+                self._recall_cache = None
+                self._snapshot_stale = True
+            logger.info(f"Migrated FAISS index to {index_factory.index_type_of(migrated)}")
+            return True
+        finally:
+            self._migration_lock.release()
+    
+    def add_documents(self, file_paths: List[str], metadata: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
+        """Add documents to the vector store, merging metadata[file_path] into every chunk"""
         results = {
             'processed_files': [],
             'failed_files': [],
             'total_chunks': 0
         }
         
+        if self.read_only:
+            results['failed_files'] = [
+                {'file': file_path, 'error': 'Vector store is opened read-only (FAISS_MMAP_READONLY / INGESTION_WORKER_MMAP_READONLY)'}
+                for file_path in file_paths
+            ]
+            return results
+        
         for file_path in file_paths:
+            added_ids = []
             try:
-                chunks = self.document_processor.load_document(file_path)
-                
-                # Add chunks to vector store
-                self.vector_store.add_documents(chunks)
+                # Extract, chunk and embed in batches so memory stays flat however big the file is
+                for chunks in self.document_processor.iter_chunk_batches(file_path, self.embedding_batch_size):
+                    for chunk in chunks:
+                        chunk.metadata.update((metadata or {}).get(file_path, {}))
+                    
+                    # Embed once so the same vectors go to the index and the raw vector file
+                    texts = [chunk.page_content for chunk in chunks]
+                    metadatas = [chunk.metadata for chunk in chunks]
+                    ids = [str(uuid.uuid4()) for _ in chunks]
+                    # Chunks whose text was embedded before (e.g. re-uploads, revisions) come from the cache
+                    embeddings = embed_chunks(self.embedding_model.model_name, texts, self.embedding_model.embed_documents)
+                    
+                    with self._lock:
+                        # Persist only this batch: chunk text and raw vectors first, the log record commits it
+                        spans = self.vector_store.docstore.write(texts)
+                        self._add_entries(ids, texts, metadatas, np.array(embeddings, dtype='float32'), spans)
+                        self.raw_vectors.append(np.array(embeddings, dtype='float32'))
+                        self.upload_log.append((ids, spans, metadatas))
+                    added_ids.extend(ids)
                 
                 results['processed_files'].append({
                     'file': file_path,
-                    'chunks': len(chunks)
+                    'chunks': len(added_ids)
                 })
-                results['total_chunks'] += len(chunks)
+                results['total_chunks'] += len(added_ids)
                 
-                logger.info(f"Added {len(chunks)} chunks from {file_path}")
+                logger.info(f"Added {len(added_ids)} chunks from {file_path}")
                 
             except Exception as e:
                 logger.error(f"Failed to process {file_path}: {str(e)}")
+                if added_ids:
+                    # Batches already indexed would leave a partial document searchable
+                    with self._lock:
+                        self._delete_entries(added_ids)
+                        self.upload_log.append((DELETE_RECORD, added_ids))
                 results['failed_files'].append({
                     'file': file_path,
                     'error': str(e)
                 })
         
-        # Save updated index
+        # Snapshot in the background once enough uploads have been logged
         if results['processed_files']:
-            self.save_index()
+            self._maybe_migrate_index()
+            self._maybe_compact()
         
         return results
     
-    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+    def delete_documents(self, file_paths: List[str]) -> Dict[str, Any]:
+        """Remove every chunk loaded from the given files from search results"""
+        if self.read_only:
+            raise RuntimeError("Vector store is opened read-only (FAISS_MMAP_READONLY / INGESTION_WORKER_MMAP_READONLY)")
+        
+        sources = set(file_paths)
+        with self._lock:
+            docstore_ids = [
+                doc_id for doc_id in self.vector_store.index_to_docstore_id.values()
+                if self.vector_store.docstore.metadata(doc_id).get('source') in sources
+            ]
+            deleted = self._delete_entries(docstore_ids)
+            if deleted:
+                self.upload_log.append((DELETE_RECORD, docstore_ids))
+        
+        logger.info(f"Deleted {deleted} chunks from {len(file_paths)} file(s)")
+        if deleted:
+            self._maybe_purge_tombstones()
+        return {'deleted_chunks': deleted}
+    
+    def _maybe_purge_tombstones(self):
+        """Compact the index in the background once enough of it is deleted"""
+        ntotal = self.vector_store.index.ntotal
+        if ntotal == 0 or self._deleted_count / ntotal < self.tombstone_compaction_ratio:
+            return
+        if self._purge_thread is not None and self._purge_thread.is_alive():
+            return
+        
+        self._purge_thread = threading.Thread(target=self._purge_tombstones, name='faiss-purge', daemon=True)
+        self._purge_thread.start()
+    
+    def _purge_tombstones(self):
+        """Remove deleted vectors and chunk text from the index and files on disk and renumber the rest"""
+        try:
+            # Positions change, so uploads and deletes wait for the whole rebuild
+            with self._lock:
+                faiss_index = self.vector_store.index
+                live_mask = ~id_bitmap.to_mask(self._tombstones, faiss_index.ntotal)
+                live = np.flatnonzero(live_mask)
+                
+                in_sync = self.raw_vectors is not None and len(self.raw_vectors) >= faiss_index.ntotal
+                live_vectors = self.raw_vectors.get(live) if in_sync else None
+                compacted = index_factory.compact_index(faiss_index, np.flatnonzero(~live_mask), live_vectors)
+                # Text of the deleted chunks is left out of the next generation of the chunk text file
+                self.vector_store.docstore.compact()
+                
+                if in_sync:
+                    # Rename the new raw file into place so other processes keep their old mapping
+                    new_raw = raw_vectors.RawVectorStore(f"{self.raw_vectors.path}.tmp", faiss_index.d)
+                    new_raw.rewrite(live_vectors)
+                    os.replace(new_raw.path, self.raw_vectors.path)
+                
+                mapping = self.vector_store.index_to_docstore_id
+                self.vector_store.index_to_docstore_id = {
+                    new_position: mapping[int(position)] for new_position, position in enumerate(live)
+                }
+                self.vector_store.index = compacted
+                self._recall_cache = None
+                self._sync_raw_vectors(rebuild=not in_sync)
+                self._rebuild_bitmaps()
+                
+                self._write_snapshot(*self._serialize_snapshot())
+                self._snapshot_stale = False
+            logger.info(f"Purged {faiss_index.ntotal - compacted.ntotal} deleted vectors from the FAISS index")
+        except Exception as e:
+            logger.error(f"Error purging deleted vectors: {str(e)}")
+    
+    def similarity_search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
         """Perform similarity search in the vector store"""
         try:
-            results = self.vector_store.similarity_search(query, k=k)
+            query_embedding = embed_queries(self.embedding_model, [query])
+            results = [document for document, _ in self.search_by_vector(query_embedding, k, filters)]
             logger.info(f"Found {len(results)} similar documents for query")
             return results
         except Exception as e:
             logger.error(f"Error in similarity search: {str(e)}")
             raise
     
+    def search_by_vector(self, query_embedding: 'np.ndarray', k: int = 4,
+                         filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Best k (document, score) pairs for an embedded query, best first"""
+        return self.search_by_vectors(query_embedding, k, filters)[0]
+    
+    def search_by_vectors(self, query_embeddings: 'np.ndarray', k: int = 4,
+                          filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Best k (document, score) pairs for each row of query_embeddings, in one index search"""
+        if self.read_only:
+            self._reload_if_stale()
+        
+        with self._lock.read():
+            allowed = self._allowed_ids(filters)
+            if filters and allowed is not None:
+                candidates = id_bitmap.to_ids(allowed)
+                if len(candidates) == 0:
+                    return [[] for _ in query_embeddings]
+                if len(candidates) <= self.filter_exact_threshold and len(self.raw_vectors) >= self._next_position:
+                    # Few matches: scoring just those rows exactly is cheaper than any index scan
+                    results = []
+                    for query_embedding in query_embeddings:
+                        scores, positions = raw_vectors.rescore(
+                            self.raw_vectors, query_embedding, candidates, k, self.vector_store.index.metric_type
+                        )
+                        results.append(self._documents_at(scores, positions))
+                    return results
+            
+            # Compressed indices over-fetch and re-rank with the exact vectors;
+            # read-only workers also search vectors appended since their snapshot
+            scores, positions = raw_vectors.search_with_tail(
+                self.vector_store.index, self._rescore_vectors(), self.raw_vectors if self.read_only else None,
+                query_embeddings, k, self.rescore_factor, allowed=allowed
+            )
+            return [self._documents_at(row_scores, row_positions) for row_scores, row_positions in zip(scores, positions)]
+    
+    def _documents_at(self, scores, positions) -> List[Tuple[Document, float]]:
+        """Look up the docstore entries for FAISS index positions (call with the lock held)"""
+        documents = []
+        for score, position in zip(scores, positions):
+            if position < 0:
+                continue
+            docstore_id = self.vector_store.index_to_docstore_id.get(int(position))
+            if docstore_id is None:
+                continue  # Upload still being written
+            documents.append((self.vector_store.docstore.search(docstore_id), float(score)))
+        return documents
+    
+    def keyword_search(self, query: str, k: int = 4,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Best k (document, BM25 score) pairs for the query terms, best first"""
+        if self.read_only:
+            self._reload_if_stale()
+        
+        with self._lock.read():
+            scores, positions = self.keyword_index.search(query, k, self._allowed_ids(filters) if filters else None)
+            return self._documents_at(scores, positions)
+    
     def save_index(self):
-        """Save the FAISS index to disk"""
+        """Save a full snapshot of the FAISS index and docstore to disk"""
         try:
-            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-            self.vector_store.save_local(self.index_path)
-            logger.info(f"FAISS index saved to {self.index_path}")
+            with self._lock:
+                self._write_snapshot(*self._serialize_snapshot())
+                self._snapshot_stale = False
         except Exception as e:
             logger.error(f"Error saving index: {str(e)}")
             raise
     
+    def _serialize_snapshot(self):
+        """Serialize the index and docstore in memory (call with the lock held)"""
+        return (
+            faiss.serialize_index(self.vector_store.index),
+            # Same layout LangChainFAISS.save_local / load_local use for index.pkl
+            pickle.dumps((self.vector_store.docstore, self.vector_store.index_to_docstore_id)),
+            self.keyword_index.to_bytes(),
+            self.vector_store.index.ntotal,
+            self.upload_log.size()
+        )
+    
+    def _write_snapshot(self, index_data, docstore_data: bytes, keyword_data: bytes, ntotal: int, log_offset: int):
+        """Write a serialized snapshot and trim the upload records it contains from the log"""
+        # Write to a staging folder, then rename into place so read-only workers never map a partial file
+        staging_path = f"{self.index_path}.tmp"
+        os.makedirs(staging_path, exist_ok=True)
+        index_data.tofile(os.path.join(staging_path, "index.faiss"))
+        with open(os.path.join(staging_path, "index.pkl"), 'wb') as f:
+            f.write(docstore_data)
+        with open(os.path.join(staging_path, "bm25.pkl"), 'wb') as f:
+            f.write(keyword_data)
+        
+        os.makedirs(self.index_path, exist_ok=True)
+        for filename in ("index.faiss", "bm25.pkl", "index.pkl"):
+            os.replace(os.path.join(staging_path, filename), os.path.join(self.index_path, filename))
+        shutil.rmtree(staging_path, ignore_errors=True)
+        
+        with self._lock:
+            self.upload_log.drop_prefix(log_offset)
+            self._snapshot_ntotal = ntotal
+        logger.info(f"FAISS index snapshot with {ntotal} vectors saved to {self.index_path}")
+    
+    def _maybe_compact(self):
+        """Snapshot in the background once enough vectors were logged since the last one"""
+        pending = self.vector_store.index.ntotal - self._snapshot_ntotal
+        if pending < self.snapshot_interval and not self._snapshot_stale:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        
+        self._compaction_thread = threading.Thread(target=self._compact, name='faiss-compaction', daemon=True)
+        self._compaction_thread.start()
+    
+    def _compact(self):
+        """Fold the logged uploads into a new snapshot"""
+        try:
+            # Serializing is a memory copy; only that part has to exclude concurrent uploads
+            with self._lock:
+                faiss_index = self.vector_store.index
+                snapshot = self._serialize_snapshot()
+            self._write_snapshot(*snapshot)
+            with self._lock:
+                if self.vector_store.index is faiss_index:
+                    self._snapshot_stale = False
+        except Exception as e:
+            logger.error(f"Error compacting FAISS index: {str(e)}")
+    
+    def wait_for_background_writes(self):
+        """Let a running snapshot or purge finish, so it cannot write over a cleared index"""
+        for thread in (self._compaction_thread, self._purge_thread):
+            if thread is not None:
+                thread.join()
+    
+    def reset(self):
+        """Start over with an empty index once the shard's files are removed (call with the lock held)"""
+        self._log_offset = 0
+        self._log_identity = 0
+        self._snapshot_ntotal = 0
+        self._snapshot_stale = False
+        self._recall_cache = None
+        self._migration_retry_ntotal = 0
+        # Rebuilding the bitmaps bumps the version, so answers cached for the old content are not reused
+        self._initialize_vector_store()
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get vector store statistics"""
         try:
-            # Access the underlying FAISS index
-            faiss_index = self.vector_store.index
-            return {
-                'total_vectors': faiss_index.ntotal,
-                'dimension': faiss_index.d,
-                'index_type': type(faiss_index).__name__,
-                'is_trained': faiss_index.is_trained if hasattr(faiss_index, 'is_trained') else True
-            }
+            with self._lock.read():
+                # Access the underlying FAISS index
+                faiss_index = self.vector_store.index
+                return {
+                    'total_vectors': faiss_index.ntotal,
+                    'live_vectors': len(self.vector_store.index_to_docstore_id),
+                    'deleted_vectors': self._deleted_count,
+                    'dimension': faiss_index.d,
+                    'index_type': index_factory.index_type_of(faiss_index),
+                    'configured_index_type': index_factory.get_index_type(),
+                    'read_only': self.read_only,
+                    'is_trained': faiss_index.is_trained if hasattr(faiss_index, 'is_trained') else True,
+                    'rescore_factor': self.rescore_factor if self._rescore_vectors() is not None else None,
+                    **index_factory.memory_stats(faiss_index),
+                    **self._recall_stats(),
+                    'keyword_index': self.keyword_index.stats()
+                }
         except Exception as e:
             logger.error(f"Error getting stats: {str(e)}")
             return {'error': str(e)}
 
+    def _recall_stats(self) -> Dict[str, Any]:
+        """Sampled recall of the current index, cached until the index changes"""
+        faiss_index = self.vector_store.index
+        if self._recall_cache is None or self._recall_cache[0] != faiss_index.ntotal:
+            stats = raw_vectors.recall_stats(faiss_index, self.raw_vectors, self.rescore_factor)
+            self._recall_cache = (faiss_index.ntotal, stats)
+        return self._recall_cache[1]
+
+class FAISSVectorStore:
+    """FAISS vector store for document embeddings and similarity search.
+    
+    Vectors are partitioned across FAISS_NUM_SHARDS independent FAISSShard
+    indices by a hash of their source document. Searches fan out to every
+    shard on a thread pool and the per-shard top-k lists are merged.
+    """
+    
+    def __init__(self, index_path: Optional[str] = None):
+        # Shared with VectorStoreService and the RAG chain through the model registry
+        self.embedding_model = get_langchain_embeddings()
+        self.index_path = index_path or settings.FAISS_INDEX_PATH
+        self.num_shards = max(1, int(getattr(settings, 'FAISS_NUM_SHARDS', 1)))
+        self.read_only = index_read_only()
+        
+        # Shard versions restart at 0 in every instance, so a cleared and rebuilt store
+        # could repeat the version of the old one without this
+        self.epoch = uuid.uuid4().hex
+        
+        if self.num_shards == 1:
+            # A single shard lives directly in FAISS_INDEX_PATH, as before sharding
+            shard_paths = [self.index_path]
+        else:
+            self._check_shard_layout()
+            shard_paths = [os.path.join(self.index_path, f'shard_{i:02d}') for i in range(self.num_shards)]
+        
+        # Hybrid searches fuse this many vector and keyword hits by reciprocal rank
+        self.hybrid_candidates = getattr(settings, 'HYBRID_SEARCH_CANDIDATES', 50)
+        self.rrf_k = getattr(settings, 'HYBRID_RRF_K', 60)
+        
+        # FAISS releases the GIL while searching, so shards are searched (and loaded) in parallel
+        self._executor = ThreadPoolExecutor(max_workers=self.num_shards, thread_name_prefix='faiss-shard')
+        self.shards = list(self._executor.map(
+            lambda i: FAISSShard(shard_paths[i], self.embedding_model, seed_sample=(i == 0)),
+            range(self.num_shards)
+        ))
+    
+    def _check_shard_layout(self):
+        """Warn when the index on disk was written with a different shard count"""
+        if os.path.exists(os.path.join(self.index_path, "index.faiss")):
+            logger.warning(f"Ignoring the unsharded FAISS index in {self.index_path}; re-upload documents to shard it")
+        if os.path.isdir(self.index_path):
+            existing = [name for name in os.listdir(self.index_path) if name.startswith('shard_')]
+            if existing and len(existing) != self.num_shards:
+                logger.warning(
+                    f"Found {len(existing)} FAISS shards but FAISS_NUM_SHARDS is {self.num_shards}; "
+                    f"documents in other shards will not be searched"
+                )
+    
+    def shard_for(self, file_path: str) -> FAISSShard:
+        """Shard holding the chunks of a document, chosen by a hash of its path"""
+        digest = hashlib.sha1(str(file_path).encode('utf-8')).hexdigest()
+        return self.shards[int(digest, 16) % self.num_shards]
+    
+    def _group_by_shard(self, file_paths: List[str]) -> List[Tuple[FAISSShard, List[str]]]:
+        """Split file paths into (shard, paths) groups"""
+        groups = {}
+        for file_path in file_paths:
+            shard = self.shard_for(file_path)
+            groups.setdefault(id(shard), (shard, []))[1].append(file_path)
+        return list(groups.values())
+    
+    def add_documents(self, file_paths: List[str], metadata: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
+        """Add documents to their shards; only the shards receiving files are persisted"""
+        results = {
+            'processed_files': [],
+            'failed_files': [],
+            'total_chunks': 0
+        }
+        for shard, shard_files in self._group_by_shard(file_paths):
+            shard_results = shard.add_documents(shard_files, metadata)
+            results['processed_files'].extend(shard_results['processed_files'])
+            results['failed_files'].extend(shard_results['failed_files'])
+            results['total_chunks'] += shard_results['total_chunks']
+        return results
+    
+    def delete_documents(self, file_paths: List[str]) -> Dict[str, Any]:
+        """Remove every chunk loaded from the given files from search results"""
+        deleted = 0
+        for shard, shard_files in self._group_by_shard(file_paths):
+            deleted += shard.delete_documents(shard_files)['deleted_chunks']
+        return {'deleted_chunks': deleted}
+    
+    def similarity_search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None,
+                          mode: str = 'vector') -> List[Document]:
+        """Perform similarity search across all shards.
+        
+        mode is 'vector' (embedding similarity), 'keyword' (BM25) or 'hybrid' (both, fused by rank).
+        """
+        try:
+            if mode == 'keyword':
+                results = [document for document, _ in self.keyword_search(query, k, filters)]
+            elif mode == 'hybrid':
+                results = self.hybrid_search(query, k, filters)
+            elif mode == 'vector':
+                query_embedding = embed_queries(self.embedding_model, [query])
+                results = [document for document, _ in self.search_by_vector(query_embedding, k, filters)]
+            else:
+                raise ValueError(f"Unknown search mode: {mode}")
+            logger.info(f"Found {len(results)} similar documents for query ({mode})")
+            return results
+        except Exception as e:
+            logger.error(f"Error in similarity search: {str(e)}")
+            raise
+    
+    def keyword_search(self, query: str, k: int = 4,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Best k (document, BM25 score) pairs over all shards, best first.
+        
+        Each shard scores with its own term statistics, like any sharded BM25 index.
+        """
+        if self.num_shards == 1:
+            return self.shards[0].keyword_search(query, k, filters)
+        shard_results = self._executor.map(lambda shard: shard.keyword_search(query, k, filters), self.shards)
+        return list(islice(heapq.merge(*shard_results, key=lambda result: -result[1]), k))
+    
+    def hybrid_search(self, query: str, k: int = 4, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Best k chunks by reciprocal-rank fusion of the vector and BM25 rankings"""
+        depth = max(k, self.hybrid_candidates)
+        query_embedding = embed_queries(self.embedding_model, [query])
+        rankings = [self.search_by_vector(query_embedding, depth, filters), self.keyword_search(query, depth, filters)]
+        
+        # Both rankings return the chunk's docstore id, unique across shards
+        documents = {document.id: document for ranking in rankings for document, _ in ranking}
+        fused = reciprocal_rank_fusion([[document.id for document, _ in ranking] for ranking in rankings], self.rrf_k)
+        return [documents[key] for key, _ in fused[:k]]
+    
+    def batch_similarity_search(self, queries: List[str], k: int = 4,
+                                filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Search many queries with one batched encode and one index search per shard"""
+        try:
+            query_embeddings = embed_queries(self.embedding_model, queries)
+            results = self.search_by_vectors(query_embeddings, k, filters)
+            logger.info(f"Batch search for {len(queries)} queries")
+            return results
+        except Exception as e:
+            logger.error(f"Error in batch similarity search: {str(e)}")
+            raise
+    
+    def search_by_vector(self, query_embedding: 'np.ndarray', k: int = 4,
+                         filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Best k (document, score) pairs over all shards, best first"""
+        return self.search_by_vectors(query_embedding, k, filters)[0]
+    
+    def search_by_vectors(self, query_embeddings: 'np.ndarray', k: int = 4,
+                          filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Best k (document, score) pairs over all shards for each row of query_embeddings"""
+        if self.num_shards == 1:
+            return self.shards[0].search_by_vectors(query_embeddings, k, filters)
+        
+        shard_results = list(self._executor.map(
+            lambda shard: shard.search_by_vectors(query_embeddings, k, filters), self.shards
+        ))
+        
+        # Each shard list is already sorted, so a k-way heap merge only looks at the heads
+        if self.shards[0].vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            key = lambda result: -result[1]
+        else:
+            key = lambda result: result[1]
+        return [
+            list(islice(heapq.merge(*query_results, key=key), k))
+            for query_results in zip(*shard_results)
+        ]
+    
+    def index_version(self) -> Tuple[Any, ...]:
+        """Identifies the searchable content; changes on every upload or delete in any shard"""
+        for shard in self.shards:
+            if shard.read_only:
+                shard._reload_if_stale()
+        return (self.epoch,) + tuple(shard.version for shard in self.shards)
+    
+    def clear(self):
+        """Remove every document, on disk and in memory, with all shards locked against searches and uploads"""
+        for shard in self.shards:
+            shard.wait_for_background_writes()
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard._lock)
+            if os.path.exists(self.index_path):
+                shutil.rmtree(self.index_path)
+            for shard in self.shards:
+                shard.reset()
+            self.epoch = uuid.uuid4().hex
+        logger.info(f"Cleared the FAISS index in {self.index_path}")
+    
+    def save_index(self):
+        """Save a full snapshot of every shard"""
+        for shard in self.shards:
+            shard.save_index()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get vector store statistics, summed over the shards"""
+        shard_stats = [shard.get_stats() for shard in self.shards]
+        chunk_cache = get_chunk_embedding_cache()
+        caches = {
+            'query_embedding_cache': get_query_embedding_cache().stats(),
+            'chunk_embedding_cache': chunk_cache.stats() if chunk_cache is not None else None,
+            'embedding_models': get_embedding_model_registry().stats(),
+            'query_embedding_batcher': batcher_stats()
+        }
+        if self.num_shards == 1:
+            return {**shard_stats[0], 'num_shards': 1, **caches}
+        
+        stats = {
+            key: shard_stats[0].get(key)
+            for key in ('dimension', 'index_type', 'configured_index_type', 'read_only', 'storage_mode')
+        }
+        for key in ('total_vectors', 'live_vectors', 'deleted_vectors', 'vector_bytes',
+                    'float32_vector_bytes', 'memory_saved_bytes'):
+            stats[key] = sum(shard.get(key) or 0 for shard in shard_stats)
+        stats['num_shards'] = self.num_shards
+        stats['shards'] = shard_stats
+        stats.update(caches)
+        return stats
+
+class FAISSVectorStoreRetriever(BaseRetriever):
+    """LangChain retriever that goes through FAISSVectorStore.similarity_search"""
+    
+    vector_store: Any
+    k: int = 4
+    filters: Optional[Dict[str, Any]] = None
+    mode: str = 'vector'
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.vector_store.similarity_search(query, k=self.k, filters=self.filters, mode=self.mode)
+
 class RAGChain:
     """RAG (Retrieval-Augmented Generation) chain using LangChain"""
     
@@ -220,49 +1202,103 @@ class RAGChain:
         
         Answer:"""
         
-        prompt = PromptTemplate(
+        self.prompt = PromptTemplate(
             template=template,
             input_variables=["context", "question"]
         )
         
         # Create retrieval chain
-        self.chain = RetrievalQA.from_chain_type(
+        self.chain = self._build_chain(FAISSVectorStoreRetriever(vector_store=self.vector_store, k=4))
+    
+    def _build_chain(self, retriever: BaseRetriever) -> RetrievalQA:
+        """Retrieval chain over the given retriever"""
+        return RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
-            retriever=self.vector_store.vector_store.as_retriever(search_kwargs={"k": 4}),
-            chain_type_kwargs={"prompt": prompt},
+            retriever=retriever,
+            chain_type_kwargs={"prompt": self.prompt},
             return_source_documents=True
         )
     
-    def query(self, question: str) -> Dict[str, Any]:
-        """Query the RAG chain"""
+    def retrieve(self, question: str, k: int = 4, filters: Optional[Dict[str, Any]] = None,
+                 rerank: Optional[bool] = None, time_budget_ms: Optional[float] = None) -> Tuple[List[Document], Dict[str, Any]]:
+        """Context chunks for a question and how they were chosen.
+        
+        With re-ranking (RERANK_BY_DEFAULT unless rerank is given) more candidates are fetched
+        and ordered by the cross-encoder, within time_budget_ms (default RERANK_TIME_BUDGET_MS).
+        """
+        if rerank is None:
+            rerank = getattr(settings, 'RERANK_BY_DEFAULT', False)
+        budget_seconds = (time_budget_ms if time_budget_ms is not None else getattr(settings, 'RERANK_TIME_BUDGET_MS', 250)) / 1000
+        info = {'candidate_depth': k, 'reranked': False, 'timings_ms': {}}
+        
+        reranker = get_reranker() if rerank else None
+        if rerank and reranker is None:
+            # Loading, or failed to load: answer from the vector order rather than wait
+            info['rerank_error'] = reranker_unavailable_reason()
+        if reranker is not None:
+            info['candidate_depth'] = reranker.candidate_depth(k, budget_seconds)
+        
+        start = time.perf_counter()
+        documents = self.vector_store.similarity_search(question, k=info['candidate_depth'], filters=filters)
+        info['timings_ms']['retrieval'] = round((time.perf_counter() - start) * 1000, 1)
+        
+        if reranker is not None:
+            start = time.perf_counter()
+            documents, rerank_info = reranker.rerank(question, documents, k, budget_seconds)
+            info['timings_ms']['rerank'] = round((time.perf_counter() - start) * 1000, 1)
+            info.update(rerank_info)
+        return documents[:k], info
+    
+    def query(self, question: str, k: int = 4, filters: Optional[Dict[str, Any]] = None,
+              rerank: Optional[bool] = None, time_budget_ms: Optional[float] = None) -> Dict[str, Any]:
+        """Query the RAG chain with k context chunks, optionally restricted to chunks matching filters"""
         try:
-            response = self.chain({"query": question})
+            documents, retrieval = self.retrieve(question, k=k, filters=filters, rerank=rerank, time_budget_ms=time_budget_ms)
+            
+            # Same "stuff" step the RetrievalQA chain runs on its retriever's documents
+            start = time.perf_counter()
+            response = self.chain.combine_documents_chain.invoke({'input_documents': documents, 'question': question})
+            retrieval['timings_ms']['generation'] = round((time.perf_counter() - start) * 1000, 1)
             
             return {
-                'answer': response['result'],
+                'answer': response['output_text'],
                 'source_documents': [
                     {
                         'content': doc.page_content,
                         'metadata': doc.metadata
                     }
-                    for doc in response['source_documents']
+                    for doc in documents
                 ],
-                'question': question
+                'question': question,
+                'retrieval': retrieval
             }
         except Exception as e:
             logger.error(f"Error in RAG query: {str(e)}")
             raise
+    
+    async def astream_answer(self, question: str, source_documents: List[Document]) -> AsyncIterator[str]:
+        """Answer tokens as the LLM produces them, for context already retrieved.
+        
+        The prompt is built the way the "stuff" chain builds it, so answers match query().
+        """
+        context = "\n\n".join(doc.page_content for doc in source_documents)
+        async for chunk in self.llm.astream(self.prompt.format(context=context, question=question)):
+            if chunk.content:
+                yield chunk.content
 
 # Global instances (singleton pattern)
 _vector_store = None
 _rag_chain = None
+_vector_store_lock = threading.Lock()
 
 def get_vector_store() -> FAISSVectorStore:
     """Get or create the global vector store instance"""
     global _vector_store
-    if _vector_store is None:
-        _vector_store = FAISSVectorStore()
+    # Ingestion workers and request threads can ask for it at the same time
+    with _vector_store_lock:
+        if _vector_store is None:
+            _vector_store = FAISSVectorStore()
     return _vector_store
 
 def get_rag_chain(llm_provider: str = "openai") -> RAGChain:
@@ -0,0 +1,88 @@
+"""
+ID Bitmaps
+Packed bitmaps over FAISS ids (bit i of byte i // 8, least significant
+bit first), the layout faiss.IDSelectorBitmap reads directly
+"""
+import logging
+from typing import Iterable
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:
+    faiss = None
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def empty(size: int) -> 'np.ndarray':
+    """Bitmap with room for size ids and no bit set"""
+    return np.zeros((size + 7) // 8, dtype='uint8')
+
+def from_ids(ids: Iterable[int], size: int) -> 'np.ndarray':
+    """Bitmap with the given ids set"""
+    return set_ids(empty(size), ids)
+
+def set_ids(bitmap: 'np.ndarray', ids: Iterable[int]) -> 'np.ndarray':
+    """Set the given ids, growing the bitmap if needed; returns the (possibly new) bitmap"""
+    ids = np.fromiter(ids, dtype='int64') if not isinstance(ids, np.ndarray) else ids.astype('int64')
+    if len(ids) == 0:
+        return bitmap
+    needed = int(ids.max()) // 8 + 1
+    if needed > len(bitmap):
+        bitmap = np.concatenate([bitmap, np.zeros(needed - len(bitmap), dtype='uint8')])
+    np.bitwise_or.at(bitmap, ids >> 3, (1 << (ids & 7)).astype('uint8'))
+    return bitmap
+
+def to_mask(bitmap: 'np.ndarray', size: int) -> 'np.ndarray':
+    """Boolean mask of length size; ids past the end of the bitmap are unset"""
+    mask = np.unpackbits(bitmap, bitorder='little')[:size].astype(bool)
+    if len(mask) < size:
+        mask = np.concatenate([mask, np.zeros(size - len(mask), dtype=bool)])
+    return mask
+
+def count(bitmap: 'np.ndarray') -> int:
+    """Number of ids set"""
+    return int(np.unpackbits(bitmap).sum())
+
+def invert(bitmap: 'np.ndarray', size: int) -> 'np.ndarray':
+    """Bitmap of the ids in [0, size) that are not set"""
+    return np.packbits(~to_mask(bitmap, size), bitorder='little')
+
+def selector(bitmap: 'np.ndarray'):
+    """IDSelector accepting exactly the ids set in the bitmap"""
+    bitmap = np.ascontiguousarray(bitmap, dtype='uint8')
+    id_selector = faiss.IDSelectorBitmap(bitmap)
+    id_selector.bitmap_ref = bitmap  # FAISS only keeps a pointer to the bitmap
+    return id_selector
+
+def resize(bitmap: 'np.ndarray', size: int) -> 'np.ndarray':
+    """Bitmap padded with unset bits or cut to hold exactly size ids"""
+    length = (size + 7) // 8
+    if len(bitmap) >= length:
+        return bitmap[:length]
+    return np.concatenate([bitmap, np.zeros(length - len(bitmap), dtype='uint8')])
+
+def union(bitmaps: Iterable['np.ndarray'], size: int) -> 'np.ndarray':
+    """Ids set in any of the bitmaps"""
+    result = empty(size)
+    for bitmap in bitmaps:
+        result |= resize(bitmap, size)
+    return result
+
+def intersect(first: 'np.ndarray', second: 'np.ndarray') -> 'np.ndarray':
+    """Ids set in both bitmaps"""
+    size = max(len(first), len(second)) * 8
+    return resize(first, size) & resize(second, size)
+
+def to_ids(bitmap: 'np.ndarray') -> 'np.ndarray':
+    """Sorted ids set in the bitmap"""
+    return np.flatnonzero(np.unpackbits(bitmap, bitorder='little')).astype('int64')
+
+def contains(bitmap: 'np.ndarray', ids: 'np.ndarray') -> 'np.ndarray':
+    """Boolean mask of which ids are set; ids past the end of the bitmap are unset"""
+    ids = np.asarray(ids, dtype='int64')
+    mask = np.zeros(len(ids), dtype=bool)
+    inside = (ids >> 3) < len(bitmap)
+    mask[inside] = ((bitmap[ids[inside] >> 3] >> (ids[inside] & 7)) & 1).astype(bool)
+    return mask
@@ -0,0 +1,272 @@
+"""
+FAISS Index Factory
+Builds the approximate nearest neighbour index selected in settings and
+migrates existing indices into it once enough vectors exist for training
+"""
+import logging
+from typing import Optional, Tuple
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:
+    faiss = None
+    np = None
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ['flat', 'ivf_flat', 'hnsw', 'ivf_pq']
+STORAGE_MODES = ['float', 'sq8', 'pq']
+
+# Bits per PQ code; the factory strings below use FAISS's default of 8
+PQ_NBITS = 8
+
+def get_index_type() -> str:
+    """Return the index type configured in settings"""
+    index_type = getattr(settings, 'FAISS_INDEX_TYPE', 'flat')
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unsupported FAISS index type: {index_type}. "
+            f"Supported types: {', '.join(INDEX_TYPES)}"
+        )
+    return index_type
+
+def get_storage_mode(index_type: Optional[str] = None) -> str:
+    """Return the vector storage mode configured in settings"""
+    if (index_type or get_index_type()) == 'ivf_pq':
+        return 'pq'  # IVF-PQ always stores PQ codes
+
+    storage_mode = getattr(settings, 'FAISS_STORAGE_MODE', 'float')
+    if storage_mode not in STORAGE_MODES:
+        raise ValueError(
+            f"Unsupported FAISS storage mode: {storage_mode}. "
+            f"Supported modes: {', '.join(STORAGE_MODES)}"
+        )
+    return storage_mode
+
+def requires_training(index_type: str, storage_mode: str = 'float') -> bool:
+    """Whether an index type has to be trained before vectors can be added"""
+    return index_type in ('ivf_flat', 'ivf_pq') or storage_mode != 'float'
+
+def min_training_vectors(index_type: str, storage_mode: str = 'float') -> int:
+    """Number of vectors needed before an index of this type is trained"""
+    if not requires_training(index_type, storage_mode):
+        return 0
+
+    # Training fails below these: IVF needs a point per list, PQ a point per code (2^nbits per sub-quantizer)
+    minimum = 1
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        minimum = max(minimum, getattr(settings, 'FAISS_IVF_NLIST', 256))
+    if storage_mode == 'pq':
+        minimum = max(minimum, 1 << PQ_NBITS)
+
+    configured = getattr(settings, 'FAISS_MIN_TRAINING_VECTORS', None)
+    if configured:
+        return max(configured, minimum)
+
+    # FAISS k-means wants roughly 39 points per centroid; each PQ sub-quantizer trains 2^nbits centroids
+    centroids = getattr(settings, 'FAISS_IVF_NLIST', 256) if index_type in ('ivf_flat', 'ivf_pq') else 0
+    if storage_mode == 'pq':
+        centroids = max(centroids, 1 << PQ_NBITS)
+    if centroids == 0:
+        # SQ8 only learns per-dimension value ranges
+        return 1000
+    return max(centroids * 39, minimum)
+
+def factory_string(index_type: str, dimension: int, storage_mode: str = 'float') -> str:
+    """Build the faiss.index_factory description for an index type and storage mode"""
+    nlist = getattr(settings, 'FAISS_IVF_NLIST', 256)
+    hnsw_m = getattr(settings, 'FAISS_HNSW_M', 32)
+    pq_m = getattr(settings, 'FAISS_PQ_M', 96)
+
+    if storage_mode == 'pq' and dimension % pq_m != 0:
+        raise ValueError(f"FAISS_PQ_M ({pq_m}) must divide the embedding dimension ({dimension})")
+    codes = {'float': 'Flat', 'sq8': 'SQ8', 'pq': f'PQ{pq_m}'}[storage_mode]
+
+    if index_type == 'flat':
+        return codes
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        return f'IVF{nlist},{codes}'
+    elif index_type == 'hnsw':
+        return f'HNSW{hnsw_m}' if storage_mode == 'float' else f'HNSW{hnsw_m}_{codes}'
+    raise ValueError(f"Unsupported FAISS index type: {index_type}")
+
+def create_index(dimension: int, index_type: Optional[str] = None, metric: Optional[int] = None,
+                 storage_mode: Optional[str] = None):
+    """Create an empty index of the given type (defaults to the configured type)"""
+    index_type = index_type or get_index_type()
+    storage_mode = storage_mode or get_storage_mode(index_type)
+    metric = faiss.METRIC_INNER_PRODUCT if metric is None else metric
+
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, storage_mode), metric)
+    if index_type == 'hnsw':
+        faiss.downcast_index(index).hnsw.efConstruction = getattr(settings, 'FAISS_HNSW_EF_CONSTRUCTION', 80)
+    apply_search_params(index)
+    return index
+
+def create_initial_index(dimension: int, metric: Optional[int] = None):
+    """Create the index a new store starts with.
+
+    Types that need training start out as a flat index and are migrated by
+    migrate_index once enough vectors have been added.
+    """
+    index_type = get_index_type()
+    if requires_training(index_type, get_storage_mode(index_type)):
+        return create_index(dimension, 'flat', metric, 'float')
+    return create_index(dimension, index_type, metric)
+
+def _storage_mode_of_codes(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq8'
+    if isinstance(index, faiss.IndexPQ):
+        return 'pq'
+    return 'float'
+
+def index_type_of(index) -> str:
+    """Map a FAISS index instance back to one of INDEX_TYPES"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return 'ivf_flat'
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexScalarQuantizer, faiss.IndexPQ)):
+        return 'flat'
+    return type(index).__name__
+
+def storage_mode_of(index) -> str:
+    """Map a FAISS index instance back to one of STORAGE_MODES"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return _storage_mode_of_codes(index.storage)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'pq'
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return 'sq8'
+    return _storage_mode_of_codes(index)
+
+def code_size(index) -> int:
+    """Bytes stored per vector by an index (excluding graph / list overhead)"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return code_size(index.storage)
+    return index.code_size
+
+def memory_stats(index) -> dict:
+    """Compare the vector storage of an index against uncompressed float32"""
+    float_bytes = index.ntotal * index.d * 4
+    stored_bytes = index.ntotal * code_size(index)
+    return {
+        'storage_mode': storage_mode_of(index),
+        'vector_bytes': stored_bytes,
+        'float32_vector_bytes': float_bytes,
+        'memory_saved_bytes': float_bytes - stored_bytes,
+        'compression_ratio': round(float_bytes / stored_bytes, 2) if stored_bytes else 1.0
+    }
+
+def apply_search_params(index):
+    """Apply the configured query-time parameters (nprobe / efSearch)"""
+    index_type = index_type_of(index)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        faiss.extract_index_ivf(index).nprobe = getattr(settings, 'FAISS_IVF_NPROBE', 16)
+    elif index_type == 'hnsw':
+        faiss.downcast_index(index).hnsw.efSearch = getattr(settings, 'FAISS_HNSW_EF_SEARCH', 64)
+
+def search_parameters(index, id_selector):
+    """SearchParameters restricting a search to id_selector, keeping the index's nprobe / efSearch"""
+    index_type = index_type_of(index)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return faiss.SearchParametersIVF(sel=id_selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(sel=id_selector, efSearch=faiss.downcast_index(index).hnsw.efSearch)
+    return faiss.SearchParameters(sel=id_selector)
+
+def compact_index(index, removed_ids: 'np.ndarray', live_vectors: Optional['np.ndarray'] = None):
+    """Copy of index without removed_ids, the remaining vectors renumbered 0..n-1 in order.
+
+    Flat storage removes in place; IVF keeps the original ids and HNSW cannot
+    remove at all, so those are emptied (keeping their training) and refilled
+    with live_vectors.
+    """
+    compacted = faiss.clone_index(index)
+    if isinstance(faiss.downcast_index(compacted), faiss.IndexFlatCodes):
+        compacted.remove_ids(faiss.IDSelectorBatch(np.asarray(removed_ids, dtype='int64')))
+    else:
+        if live_vectors is None:
+            live_mask = np.ones(index.ntotal, dtype=bool)
+            live_mask[removed_ids] = False
+            live_vectors = reconstruct_vectors(index)[live_mask]
+        compacted.reset()
+        if len(live_vectors):
+            compacted.add(np.ascontiguousarray(live_vectors, dtype='float32'))
+    apply_search_params(compacted)
+    return compacted
+
+def reconstruct_vectors(index, start: int = 0, end: Optional[int] = None) -> 'np.ndarray':
+    """Read the stored vectors at positions start..end-1 (all of them by default) back out of an index"""
+    end = index.ntotal if end is None else end
+    if end <= start:
+        return np.zeros((0, index.d), dtype='float32')
+
+    if index_type_of(index) in ('ivf_flat', 'ivf_pq'):
+        faiss.extract_index_ivf(index).make_direct_map()
+    if storage_mode_of(index) != 'float':
+        logger.warning("Reconstructing vectors from a compressed index is lossy")
+    return index.reconstruct_n(start, end - start)
+
+def build_index(vectors: 'np.ndarray', dimension: int, index_type: Optional[str] = None,
+                metric: Optional[int] = None, storage_mode: Optional[str] = None):
+    """Create an index of the given type, train it if needed and add the vectors"""
+    index = create_index(dimension, index_type, metric, storage_mode)
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if not index.is_trained:
+        index.train(vectors)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+def migration_target(index, index_type: Optional[str] = None,
+                     storage_mode: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """The (index_type, storage_mode) to migrate an index to.
+
+    None when the index already has the target type or does not yet hold
+    enough vectors to train it.
+    """
+    index_type = index_type or get_index_type()
+    storage_mode = storage_mode or get_storage_mode(index_type)
+    current = (index_type_of(index), storage_mode_of(index))
+    if current == (index_type, storage_mode):
+        return None
+
+    needed = min_training_vectors(index_type, storage_mode)
+    if index.ntotal < needed:
+        logger.debug(
+            f"Keeping {current[0]}/{current[1]} index until {needed} vectors "
+            f"are available to train {index_type}/{storage_mode} ({index.ntotal} so far)"
+        )
+        return None
+    return index_type, storage_mode
+
+def migrate_index(index, index_type: Optional[str] = None, storage_mode: Optional[str] = None,
+                  vectors: Optional['np.ndarray'] = None):
+    """Rebuild an index as the configured type and storage mode.
+
+    Returns the new index, or None when migration_target has nothing to do.
+    Pass the original float32 vectors when available so compressed indices
+    are not rebuilt from lossy reconstructions.
+    """
+    target = migration_target(index, index_type, storage_mode)
+    if target is None:
+        return None
+
+    logger.info(
+        f"Migrating FAISS index from {index_type_of(index)}/{storage_mode_of(index)} to "
+        f"{target[0]}/{target[1]} ({index.ntotal} vectors)"
+    )
+    if vectors is None or len(vectors) != index.ntotal:
+        vectors = reconstruct_vectors(index)
+    return build_index(vectors, index.d, target[0], index.metric_type, target[1])
@@ -0,0 +1,311 @@
+"""
+Background Ingestion Queue
+Durable job queue for document processing, stored in the Django database so
+no external broker is needed. Uploads enqueue a job and return immediately;
+a pool of worker threads (in the web process or in the run_ingestion_worker
+command) claims jobs and moves the Document through its status choices.
+"""
+import os
+import sys
+import socket
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ACTIVE_STATUSES, Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+# Set in run_ingestion_worker processes, which use their own read-only setting
+_worker_process = False
+
+def run_as_worker_process():
+    """Mark this process as a dedicated ingestion worker (the run_ingestion_worker command)"""
+    global _worker_process
+    _worker_process = True
+
+def index_read_only() -> bool:
+    """Whether this process opens the index read-only.
+
+    Web processes follow FAISS_MMAP_READONLY; ingestion worker processes follow
+    INGESTION_WORKER_MMAP_READONLY, so read-only web workers can share a writable worker.
+    """
+    if _worker_process:
+        return getattr(settings, 'INGESTION_WORKER_MMAP_READONLY', False)
+    return getattr(settings, 'FAISS_MMAP_READONLY', False)
+
+# Held for the life of the process that writes the index
+_writer_lock_file = None
+
+def acquire_writer_lock() -> bool:
+    """Become the only process that ingests into the index; False if another process already is.
+
+    Concurrent writers would overwrite each other's upload log and raw vector file.
+    """
+    global _writer_lock_file
+    if _writer_lock_file is not None:
+        return True
+    if fcntl is None:
+        logger.warning("File locking is unavailable, assuming this is the only ingestion process")
+        _writer_lock_file = True
+        return True
+
+    lock_path = f"{settings.FAISS_INDEX_PATH}.writer.lock"
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    lock_file = open(lock_path, 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{socket.gethostname()}:{os.getpid()}\n")
+    lock_file.flush()
+    _writer_lock_file = lock_file
+    return True
+
+def release_writer_lock():
+    """Let another process become the writer"""
+    global _writer_lock_file
+    if _writer_lock_file not in (None, True):
+        _writer_lock_file.close()
+    _writer_lock_file = None
+
+@contextmanager
+def writer_lock_held():
+    """Hold the writer lock for one operation, yielding False if another process is the writer.
+
+    A process that already held it (it runs the worker pool) keeps it afterwards.
+    """
+    if index_read_only():
+        yield False
+        return
+    held = _writer_lock_file is not None
+    acquired = acquire_writer_lock()
+    try:
+        yield acquired
+    finally:
+        if acquired and not held:
+            release_writer_lock()
+
+def ingest_document(document: Document) -> Dict[str, Any]:
+    """Extract, chunk, embed and index one document, recording the outcome on it"""
+    from .faiss_rag import get_vector_store
+
+    full_path = os.path.join(settings.MEDIA_ROOT, document.file_path)
+    vector_store = get_vector_store()
+    result = vector_store.add_documents([full_path], metadata={full_path: document.chunk_metadata()})
+
+    document.status = 'completed' if result['processed_files'] else 'failed'
+    document.processing_error = '' if result['processed_files'] else str(result)
+    document.total_chunks = result['total_chunks']
+    document.embedding_model = vector_store.embedding_model.model_name
+    document.save(update_fields=['status', 'processing_error', 'total_chunks', 'embedding_model', 'updated_at'])
+    return result
+
+def enqueue(document: Document) -> IngestionJob:
+    """Queue a document for background processing"""
+    job = IngestionJob.objects.create(document=document)
+    pool = get_ingestion_pool()
+    if pool is not None:
+        pool.notify()
+    return job
+
+def claim_next_job(worker: str) -> Optional[IngestionJob]:
+    """Atomically take the oldest queued job; safe across threads and processes"""
+    for job in IngestionJob.objects.filter(status='queued').order_by('created_at')[:10]:
+        claimed = IngestionJob.objects.filter(pk=job.pk, status='queued').update(
+            status='running', worker=worker, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+def requeue_interrupted_jobs() -> int:
+    """Queue again the work of a writer that stopped: its running jobs, and documents left processing without a job.
+
+    Only called by IngestionWorkerPool.start() in the process holding the writer
+    lock, before its workers start, so nothing else can be running them.
+    """
+    requeued = IngestionJob.objects.filter(status='running').update(status='queued')
+    active_jobs = IngestionJob.objects.filter(status__in=['queued', 'running']).values('document_id')
+    orphans = Document.objects.filter(status='processing').exclude(pk__in=active_jobs)
+    for document in orphans:
+        IngestionJob.objects.create(document=document)
+        requeued += 1
+    if requeued:
+        logger.info(f"Requeued {requeued} interrupted ingestion jobs")
+    return requeued
+
+def run_job(job: IngestionJob):
+    """Process a claimed job and record its result"""
+    try:
+        result = ingest_document(job.document)
+        job.status = 'completed' if result['processed_files'] else 'failed'
+        job.error = '' if result['processed_files'] else str(result['failed_files'])
+    except Document.DoesNotExist:
+        job.status = 'failed'
+        job.error = 'Document was deleted'
+    except Exception as e:
+        logger.error(f"Ingestion job {job.pk} failed: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+        Document.objects.filter(pk=job.document_id).update(status='failed', processing_error=str(e))
+
+    job.finished_at = timezone.now()
+    # The job row is gone if the document was deleted while it was processed
+    IngestionJob.objects.filter(pk=job.pk).update(status=job.status, error=job.error, finished_at=job.finished_at)
+    logger.info(f"Ingestion job {job.pk} {job.status}")
+
+class IngestionWorkerPool:
+    """Worker threads that drain the ingestion queue"""
+
+    def __init__(self, concurrency: int = 2, poll_interval: float = 5.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        # Workers count themselves active around each job; paused() waits for them to finish
+        self._idle = threading.Condition()
+        self._active = 0
+        self._pauses = 0
+
+    def start(self):
+        """Start the workers; call with the writer lock held"""
+        # Queued work survives restarts; recover it before any worker takes a job
+        try:
+            requeue_interrupted_jobs()
+        except Exception as e:
+            logger.error(f"Could not recover interrupted ingestion jobs: {str(e)}")
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._work, args=(i,), name=f'ingestion-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.concurrency} ingestion workers")
+
+    def notify(self):
+        """Wake idle workers, a job was queued"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    @contextmanager
+    def paused(self):
+        """Hold off new jobs and wait for the running ones to finish"""
+        with self._idle:
+            self._pauses += 1
+            while self._active:
+                self._idle.wait()
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._pauses -= 1
+                self._idle.notify_all()
+            self.notify()
+
+    def _work(self, number: int):
+        worker = f"{socket.gethostname()}:{os.getpid()}:{number}"
+        while not self._stop.is_set():
+            close_old_connections()
+            with self._idle:
+                while self._pauses:
+                    self._idle.wait()
+                self._active += 1
+            try:
+                try:
+                    job = claim_next_job(worker)
+                except Exception as e:
+                    logger.error(f"Could not read the ingestion queue: {str(e)}")
+                    job = None
+                if job is not None:
+                    run_job(job)
+            finally:
+                with self._idle:
+                    self._active -= 1
+                    self._idle.notify_all()
+
+            if job is not None:
+                continue
+
+            # Queue is empty: sleep until a job is queued here, or poll for jobs queued by other processes
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+# Global instance (singleton pattern)
+_ingestion_pool = None
+_pool_lock = threading.Lock()
+
+def get_ingestion_pool() -> Optional[IngestionWorkerPool]:
+    """Get or start this process's worker pool, None if jobs are left to another process.
+
+    Read-only processes cannot write the index, and only the process holding the
+    writer lock ingests, so at most one web process starts a pool.
+    """
+    global _ingestion_pool
+    if not getattr(settings, 'INGESTION_AUTOSTART', False) or index_read_only():
+        return None
+    with _pool_lock:
+        if _ingestion_pool is None:
+            if not acquire_writer_lock():
+                return None
+            _ingestion_pool = IngestionWorkerPool(
+                concurrency=getattr(settings, 'INGESTION_WORKERS', 2),
+                poll_interval=getattr(settings, 'INGESTION_POLL_INTERVAL', 5.0)
+            )
+            _ingestion_pool.start()
+    return _ingestion_pool
+
+def clear_index() -> bool:
+    """Remove every document from the index; False if another process writes it.
+
+    Runs in the writer process: queued jobs and jobs a stopped writer left running
+    are cancelled, and this process's workers finish their current job first.
+    """
+    from .faiss_rag import get_vector_store
+
+    with writer_lock_held() as writer:
+        if not writer:
+            return False
+        with (_ingestion_pool.paused() if _ingestion_pool is not None else nullcontext()):
+            IngestionJob.objects.filter(status__in=['queued', 'running']).update(
+                status='failed', error='Vector store was cleared', finished_at=timezone.now()
+            )
+            get_vector_store().clear()
+            # Their chunks are gone, so uploading the same files again must index them again
+            Document.objects.filter(status__in=ACTIVE_STATUSES).update(status='cleared')
+    return True
+
+def is_server_process() -> bool:
+    """False for management commands other than runserver, and for the runserver autoreload parent"""
+    if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py':
+        return sys.argv[1] == 'runserver' and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv)
+    return True
+
+def start_ingestion_on_startup():
+    """Start the worker pool when a server process starts, so queued jobs do not wait for the next upload.
+
+    Only with INGESTION_AUTOSTART, which the process serving uploads opts into;
+    everything else that loads Django (tests, shells, celery, scripts) leaves the
+    queue to that process or to run_ingestion_worker.
+    """
+    if getattr(settings, 'INGESTION_AUTOSTART', False) and is_server_process():
+        get_ingestion_pool()
@@ -0,0 +1,66 @@
+"""
+Benchmark DocumentProcessor.chunk_text against the previous word chunker,
+which re-joined every word before a chunk to compute its offset
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag_service.document_processor import DocumentProcessor
+
+def legacy_chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
+    """The quadratic chunker chunk_text replaced, kept for comparison"""
+    words = text.split()
+    chunks = []
+    start_word = 0
+    while start_word < len(words):
+        end_word = min(start_word + chunk_size, len(words))
+        chunk_text = ' '.join(words[start_word:end_word])
+        start_char = len(' '.join(words[:start_word]))
+        if start_word > 0:
+            start_char += 1
+        chunks.append({'content': chunk_text, 'start_char': start_char, 'end_char': start_char + len(chunk_text)})
+        if end_word >= len(words):
+            break
+        start_word = max(start_word + chunk_size - chunk_overlap, start_word + 1)
+    return chunks
+
+class Command(BaseCommand):
+    help = 'Time the document chunker on synthetic texts of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000],
+                            help='Text sizes in words')
+        parser.add_argument('--skip-legacy-above', type=int, default=500000,
+                            help='Do not run the legacy chunker on texts with more words than this')
+
+    def handle(self, *args, **options):
+        processor = DocumentProcessor()
+        rng = random.Random(0)
+        vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                      for _ in range(5000)]
+        separators = [' '] * 20 + ['  ', '\n', '\n\n', '\t']
+
+        self.stdout.write(f"{'words':>10} {'chunks':>8} {'chunk_text':>12} {'legacy':>12} {'speedup':>8} {'exact':>6}")
+        for size in options['sizes']:
+            text = ''.join(rng.choice(vocabulary) + rng.choice(separators) for _ in range(size))
+
+            start = time.perf_counter()
+            chunks = processor.chunk_text(text)
+            elapsed = time.perf_counter() - start
+            exact = all(text[chunk['start_char']:chunk['end_char']] == chunk['content'] for chunk in chunks)
+
+            legacy_elapsed = None
+            if size <= options['skip_legacy_above']:
+                start = time.perf_counter()
+                legacy = legacy_chunk_text(text, processor.chunk_size, processor.chunk_overlap)
+                legacy_elapsed = time.perf_counter() - start
+                legacy_exact = all(text[chunk['start_char']:chunk['end_char']] == chunk['content'] for chunk in legacy)
+                exact = f"{'yes' if exact else 'no'}/{'yes' if legacy_exact else 'no'}"
+
+            self.stdout.write(
+                f"{size:>10} {len(chunks):>8} {elapsed:>11.3f}s "
+                f"{(f'{legacy_elapsed:.3f}s' if legacy_elapsed is not None else '-'):>12} "
+                f"{(f'{legacy_elapsed / elapsed:.1f}x' if legacy_elapsed is not None else '-'):>8} {exact!s:>6}"
+            )
@@ -0,0 +1,76 @@
+"""
+Benchmark writing the DocumentChunk rows of one large document: one INSERT
+per chunk in autocommit mode (the previous ingestion path) against
+bulk_create_chunks inside a single transaction
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from rag_service.models import Document, DocumentChunk, VectorStore as VectorStoreModel
+from rag_service.vector_store import bulk_create_chunks
+
+class Command(BaseCommand):
+    help = 'Measure DocumentChunk rows per second for row-by-row and bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=10000, help='Chunks in the synthetic document')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk INSERT')
+        parser.add_argument('--chunk-chars', type=int, default=1200, help='Characters of content per chunk')
+
+    def _chunks(self, count: int, chunk_chars: int):
+        content = ('lorem ipsum dolor sit amet ' * (chunk_chars // 27 + 1))[:chunk_chars]
+        for i in range(count):
+            yield {
+                'content': content,
+                'chunk_index': i,
+                'page_number': i // 10 + 1,
+                'start_char': i * chunk_chars,
+                'end_char': (i + 1) * chunk_chars,
+                'embedding_id': str(i)
+            }
+
+    def _document(self, label: str) -> Document:
+        return Document.objects.create(
+            filename=f'benchmark-{label}.txt', file_path='', file_size=0,
+            content_type='text/plain', status='completed'
+        )
+
+    def handle(self, *args, **options):
+        count = options['chunks']
+        vector_store, _ = VectorStoreModel.objects.get_or_create(
+            name='benchmark', defaults={'index_path': '', 'embedding_model': 'benchmark'}
+        )
+        documents = []
+        try:
+            # Previous path: autocommit INSERT per chunk, then read-modify-write of the counter
+            document = self._document('rows')
+            documents.append(document)
+            start = time.perf_counter()
+            for chunk in self._chunks(count, options['chunk_chars']):
+                DocumentChunk.objects.create(document=document, **chunk)
+            vector_store.refresh_from_db()
+            vector_store.total_vectors += count
+            vector_store.save()
+            row_elapsed = time.perf_counter() - start
+
+            # Current path: batched INSERTs and an atomic counter update in one transaction
+            start = time.perf_counter()
+            with transaction.atomic():
+                document = self._document('bulk')
+                documents.append(document)
+                bulk_create_chunks(document, self._chunks(count, options['chunk_chars']), options['batch_size'])
+                VectorStoreModel.objects.filter(pk=vector_store.pk).update(total_vectors=F('total_vectors') + count)
+            bulk_elapsed = time.perf_counter() - start
+        finally:
+            # Chunk rows go with their documents
+            for document in documents:
+                document.delete()
+            vector_store.delete()
+
+        self.stdout.write(f"{count} chunks, batch size {options['batch_size']}")
+        self.stdout.write(f"  row by row: {row_elapsed:8.2f}s  {count / row_elapsed:10.0f} rows/s")
+        self.stdout.write(f"  bulk:       {bulk_elapsed:8.2f}s  {count / bulk_elapsed:10.0f} rows/s")
+        self.stdout.write(f"  speedup:    {row_elapsed / bulk_elapsed:8.1f}x")
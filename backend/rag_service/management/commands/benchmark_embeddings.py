@@ -0,0 +1,66 @@
+"""
+Compare an ONNX embedding backend with the PyTorch model it was exported
+from: cosine similarity of their embeddings (parity) and encode throughput
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_service.embedding_models import get_embedding_model_registry
+from rag_service.models import DocumentChunk
+from rag_service.onnx_embeddings import parse_model_name
+
+class Command(BaseCommand):
+    help = 'Check ONNX embedding parity against PyTorch and measure encode throughput of both'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help="ONNX model name, e.g. 'onnx-int8:all-MiniLM-L6-v2' (default: EMBEDDING_MODEL)")
+        parser.add_argument('--texts', type=int, default=512, help='Number of texts to encode')
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--min-cosine', type=float, default=0.99,
+                            help='Fail if any embedding pair is less similar than this')
+
+    def _texts(self, count: int):
+        """Stored chunks when there are enough, synthetic sentences otherwise"""
+        texts = list(DocumentChunk.objects.values_list('content', flat=True)[:count])
+        rng = random.Random(0)
+        words = ['policy', 'vehicle', 'emission', 'report', 'quarter', 'revenue', 'customer', 'claim',
+                 'the', 'of', 'and', 'a', 'for', 'with', 'ZEV', 'compliance', 'deadline', 'meeting']
+        while len(texts) < count:
+            texts.append(' '.join(rng.choice(words) for _ in range(rng.randint(5, 200))))
+        return texts
+
+    def _throughput(self, model, texts, batch_size):
+        model.encode(texts[:batch_size], batch_size=batch_size)  # Warm up
+        start = time.perf_counter()
+        embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        return embeddings, len(texts) / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+        parsed = parse_model_name(model_name)
+        if parsed is None:
+            raise CommandError(f"{model_name} is not an ONNX model name (use an 'onnx:' or 'onnx-int8:' prefix)")
+        base_name = parsed[0]
+
+        registry = get_embedding_model_registry()
+        texts = self._texts(options['texts'])
+        reference, reference_rate = self._throughput(registry.get(base_name), texts, options['batch_size'])
+        candidate, candidate_rate = self._throughput(registry.get(model_name), texts, options['batch_size'])
+
+        cosine = (reference * candidate).sum(axis=1)
+        stats = registry.stats()
+        self.stdout.write(f"{len(texts)} texts, batch size {options['batch_size']}")
+        for name, rate in ((base_name, reference_rate), (model_name, candidate_rate)):
+            self.stdout.write(
+                f"  {name:<40} {rate:8.1f} texts/s  "
+                f"{stats[name]['parameter_bytes'] / (1024 * 1024):7.1f} MB  load {stats[name]['load_seconds']:.2f}s"
+            )
+        self.stdout.write(f"  speedup: {candidate_rate / reference_rate:.2f}x")
+        self.stdout.write(f"  cosine vs PyTorch: min {cosine.min():.4f}  mean {cosine.mean():.4f}")
+
+        if cosine.min() < options['min_cosine']:
+            raise CommandError(f"Parity check failed: min cosine {cosine.min():.4f} < {options['min_cosine']}")
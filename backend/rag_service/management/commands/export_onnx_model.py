@@ -0,0 +1,38 @@
+"""
+Export a sentence-transformers model to ONNX (and its int8 variant) in the
+model cache, so web and worker processes selecting it with an 'onnx:' or
+'onnx-int8:' EMBEDDING_MODEL only load the exported files. Run it once per
+model before deploying, e.g. in the image build.
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_service.embedding_models import get_embedding_model_registry
+from rag_service.onnx_embeddings import export_dir_for, export_model, parse_model_name, quantize_model
+
+class Command(BaseCommand):
+    help = 'Export the ONNX embedding model into the model cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help="ONNX model name, e.g. 'onnx-int8:all-MiniLM-L6-v2' (default: EMBEDDING_MODEL)")
+        parser.add_argument('--force', action='store_true', help='Export again even if an export exists')
+
+    def handle(self, *args, **options):
+        model_name = options['model'] or getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+        parsed = parse_model_name(model_name)
+        if parsed is None:
+            raise CommandError(f"{model_name} is not an ONNX model name (use an 'onnx:' or 'onnx-int8:' prefix)")
+        base_name, quantize = parsed
+
+        cache_folder = get_embedding_model_registry().cache_folder
+        export_dir = export_dir_for(base_name, cache_folder)
+        if options['force'] or not os.path.exists(os.path.join(export_dir, 'onnx_config.json')):
+            self.stdout.write(f"Exporting {base_name} to {export_dir}")
+            export_model(base_name, export_dir, cache_folder)
+        if quantize and (options['force'] or not os.path.exists(os.path.join(export_dir, 'model_int8.onnx'))):
+            self.stdout.write('Quantizing to int8')
+            quantize_model(export_dir)
+        self.stdout.write(f"{model_name} is ready in {export_dir}")
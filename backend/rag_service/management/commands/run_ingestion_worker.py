@@ -0,0 +1,39 @@
+"""
+Run the document ingestion workers in a dedicated process, for deployments
+whose web processes leave INGESTION_AUTOSTART off (e.g. several
+gunicorn/uvicorn workers with FAISS_MMAP_READONLY). This process opens the
+index writable unless INGESTION_WORKER_MMAP_READONLY is set, and waits for
+the writer lock so only one process ever ingests.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rag_service.ingestion import IngestionWorkerPool, acquire_writer_lock, run_as_worker_process
+
+class Command(BaseCommand):
+    help = 'Process queued document uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'INGESTION_WORKERS', 2),
+                            help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float, default=getattr(settings, 'INGESTION_POLL_INTERVAL', 5),
+                            help='Seconds between queue checks when idle')
+
+    def handle(self, *args, **options):
+        run_as_worker_process()
+        if not acquire_writer_lock():
+            self.stdout.write('Another process is ingesting into this index, waiting for it to stop')
+            while not acquire_writer_lock():
+                time.sleep(options['poll_interval'])
+
+        pool = IngestionWorkerPool(concurrency=options['workers'], poll_interval=options['poll_interval'])
+        pool.start()
+        self.stdout.write(f"Processing the ingestion queue with {options['workers']} workers")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the current jobs')
+            pool.stop()
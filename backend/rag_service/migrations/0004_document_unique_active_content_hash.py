@@ -0,0 +1,34 @@
+# Generated by Django 4.2.15 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+def forget_duplicate_hashes(apps, schema_editor):
+    # Duplicates indexed before the constraint keep their status; only the oldest keeps the hash
+    Document = apps.get_model('rag_service', 'Document')
+    seen = set()
+    active = Document.objects.filter(status__in=['processing', 'completed']).exclude(content_hash='')
+    for document in active.order_by('created_at'):
+        if document.content_hash in seen:
+            Document.objects.filter(pk=document.pk).update(content_hash='')
+        seen.add(document.content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_service', '0003_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('cleared', 'Cleared')], default='uploading', max_length=20),
+        ),
+        migrations.RunPython(forget_duplicate_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='document',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['processing', 'completed']), models.Q(('content_hash', ''), _negated=True)), fields=('content_hash',), name='unique_active_content_hash'),
+        ),
+    ]
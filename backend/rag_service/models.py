@@ -3,6 +3,9 @@ from django.contrib.auth.models import User
 import uuid
 import os
 
+# Statuses of a document whose chunks are (or are about to be) in the vector store
+ACTIVE_STATUSES = ['processing', 'completed']
+
 class Document(models.Model):
     """Model for uploaded documents"""
     
@@ -11,6 +14,7 @@ class Document(models.Model):
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('cleared', 'Cleared'),
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -19,6 +23,9 @@ class Document(models.Model):
     file_size = models.PositiveIntegerField()
     content_type = models.CharField(max_length=100)
     
+    # SHA-256 of the file bytes, used to skip re-processing identical uploads
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    
     # Processing status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
     processing_error = models.TextField(blank=True, null=True)
@@ -33,9 +40,26 @@ class Document(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # Concurrent uploads of the same bytes cannot both be indexed
+            models.UniqueConstraint(
+                fields=['content_hash'],
+                condition=models.Q(status__in=ACTIVE_STATUSES) & ~models.Q(content_hash=''),
+                name='unique_active_content_hash'
+            )
+        ]
     
     def __str__(self):
         return self.filename
+    
+    def chunk_metadata(self):
+        """Metadata stored with every vector store chunk of this document, used by search filters"""
+        return {
+            'document_id': str(self.id),
+            'filename': self.filename,
+            'content_type': self.content_type,
+            'uploaded_at': self.created_at.isoformat()
+        }
 
 class DocumentChunk(models.Model):
     """Model for document text chunks with embeddings"""
@@ -64,6 +88,32 @@ class DocumentChunk(models.Model):
     def __str__(self):
         return f"{self.document.filename} - Chunk {self.chunk_index}"
 
+class IngestionJob(models.Model):
+    """Queued background processing of an uploaded document"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+    
+    def __str__(self):
+        return f"IngestionJob {self.pk}: {self.document.filename} ({self.status})"
+
 class VectorStore(models.Model):
     """Model for tracking FAISS vector store indices"""
     
@@ -0,0 +1,166 @@
+"""
+ONNX Embedding Backend
+Runs a sentence-transformers model through ONNX Runtime on CPU, optionally
+with dynamic int8 quantization. The model is exported from PyTorch into the
+model cache by `manage.py export_onnx_model`; loads only need the tokenizer
+and the ONNX file. Selected with an 'onnx:' or 'onnx-int8:' prefix on
+EMBEDDING_MODEL.
+"""
+import os
+import re
+import json
+import inspect
+import logging
+from typing import List, Optional, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+try:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    QuantType = None
+    quantize_dynamic = None
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+logger = logging.getLogger(__name__)
+
+ONNX_PREFIXES = {'onnx:': False, 'onnx-int8:': True}
+
+def parse_model_name(model_name: str):
+    """(base model name, quantize) for an ONNX model name, None for a PyTorch one"""
+    for prefix, quantize in ONNX_PREFIXES.items():
+        if model_name.startswith(prefix):
+            return model_name[len(prefix):], quantize
+    return None
+
+def export_dir_for(model_name: str, cache_folder: Optional[str] = None) -> str:
+    """Directory in the model cache holding a model's ONNX export"""
+    return os.path.join(cache_folder or 'model_cache', 'onnx', re.sub(r'[^\w.-]+', '_', model_name))
+
+def export_model(model_name: str, export_dir: str, cache_folder: Optional[str] = None):
+    """Export a sentence-transformers model to ONNX with its tokenizer and pooling settings"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, trust_remote_code=True, cache_folder=cache_folder, device='cpu')
+    transformer = model[0].auto_model.eval()
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+
+    os.makedirs(export_dir, exist_ok=True)
+    sample = model.tokenizer(['export sample'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+    # Newer torch defaults to the dynamo exporter, which needs onnxscript and ignores dynamic_axes
+    exporter = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[name] for name in input_names), os.path.join(export_dir, 'model.onnx'),
+            input_names=input_names, output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes, opset_version=14, **exporter
+        )
+    model.tokenizer.save_pretrained(export_dir)
+
+    with open(os.path.join(export_dir, 'onnx_config.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_name': model_name,
+            'input_names': input_names,
+            'pooling_mode': pooling.get_pooling_mode_str() if pooling is not None else 'mean',
+            'normalize': any(isinstance(module, Normalize) for module in model),
+            'max_seq_length': model.max_seq_length,
+            'dimension': model.get_sentence_embedding_dimension()
+        }, f)
+    logger.info(f"Exported {model_name} to ONNX in {export_dir}")
+
+def quantize_model(export_dir: str):
+    """Write the int8 variant of an exported model next to it"""
+    if quantize_dynamic is None:
+        raise ImportError("onnxruntime.quantization is required for the int8 ONNX backend")
+    # Weights of MatMul/Gemm stored as int8, activations quantized at run time
+    quantize_dynamic(os.path.join(export_dir, 'model.onnx'), os.path.join(export_dir, 'model_int8.onnx'),
+                     weight_type=QuantType.QInt8)
+    logger.info(f"Quantized the ONNX model in {export_dir} to int8")
+
+class OnnxEmbeddingModel:
+    """Drop-in for the parts of SentenceTransformer the vector stores use: encode, tokenizer, dimensions"""
+
+    def __init__(self, model_name: str, cache_folder: Optional[str] = None, quantize: bool = True):
+        if onnxruntime is None or AutoTokenizer is None:
+            raise ImportError("onnxruntime and transformers are required for the ONNX embedding backend")
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.export_dir = export_dir_for(model_name, cache_folder)
+
+        # Exporting needs PyTorch and minutes of CPU, so it is never done while serving
+        self.model_path = os.path.join(self.export_dir, 'model_int8.onnx' if quantize else 'model.onnx')
+        config_path = os.path.join(self.export_dir, 'onnx_config.json')
+        if not (os.path.exists(config_path) and os.path.exists(self.model_path)):
+            prefix = 'onnx-int8:' if quantize else 'onnx:'
+            raise FileNotFoundError(
+                f"No ONNX export of {model_name} in {self.export_dir}; "
+                f"run `python manage.py export_onnx_model --model {prefix}{model_name}` first"
+            )
+        with open(config_path, encoding='utf-8') as f:
+            self.config = json.load(f)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.export_dir)
+        self.max_seq_length = self.config['max_seq_length']
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dimension']
+
+    @property
+    def model_bytes(self) -> int:
+        return os.path.getsize(self.model_path)
+
+    def _pool(self, hidden: 'np.ndarray', attention_mask: 'np.ndarray') -> 'np.ndarray':
+        mode = self.config['pooling_mode']
+        mask = attention_mask[..., None].astype('float32')
+        if mode == 'cls':
+            return hidden[:, 0]
+        if mode == 'max':
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        summed = (hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        if mode == 'mean_sqrt_len_tokens':
+            return summed / np.sqrt(counts)
+        return summed / counts
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, normalize_embeddings: bool = False,
+               show_progress_bar: Optional[bool] = None, convert_to_numpy: bool = True, **kwargs) -> 'np.ndarray':
+        """Embeddings as a float32 array, like SentenceTransformer.encode"""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+
+        # Sorting by length keeps padding per batch small
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        embeddings = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype='float32')
+        for start in range(0, len(sentences), batch_size):
+            batch_ids = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [sentences[i] for i in batch_ids], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np'
+            )
+            feed = {name: inputs[name].astype('int64') for name in self.config['input_names']}
+            hidden = self.session.run(['last_hidden_state'], feed)[0]
+            embeddings[batch_ids] = self._pool(hidden, inputs['attention_mask'])
+
+        if self.config['normalize'] or normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
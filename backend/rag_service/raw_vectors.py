@@ -0,0 +1,214 @@
+"""
+Raw Vector Storage
+Keeps the original float32 embeddings in an append-only file on disk so a
+compressed FAISS index can re-score its candidates exactly
+"""
+import os
+import logging
+from typing import Optional, Tuple
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:
+    faiss = None
+    np = None
+
+from . import id_bitmap
+from . import index_factory
+
+logger = logging.getLogger(__name__)
+
+class RawVectorStore:
+    """Append-only float32 vector file, read through a memory map"""
+
+    def __init__(self, path: str, dimension: int):
+        self.path = str(path)
+        self.dimension = dimension
+        self._mmap = None
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dimension * 4)
+
+    def _vectors(self) -> 'np.ndarray':
+        """Memory-mapped view of all stored vectors"""
+        count = len(self)
+        if count == 0:
+            return np.zeros((0, self.dimension), dtype='float32')
+        if self._mmap is None or len(self._mmap) != count:
+            self._mmap = np.memmap(self.path, dtype='float32', mode='r', shape=(count, self.dimension))
+        return self._mmap
+
+    def append(self, vectors: 'np.ndarray'):
+        """Append vectors to the end of the file"""
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(-1, self.dimension)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(vectors.tobytes())
+        self._mmap = None
+
+    def truncate(self, count: int):
+        """Drop every vector after the first count"""
+        if count < len(self):
+            with open(self.path, 'r+b') as f:
+                f.truncate(count * self.dimension * 4)
+            self._mmap = None
+
+    def rewrite(self, vectors: 'np.ndarray'):
+        """Replace the file contents with the given vectors"""
+        self.clear()
+        self.append(vectors)
+
+    def clear(self):
+        """Remove all stored vectors"""
+        self._mmap = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get(self, ids: 'np.ndarray') -> 'np.ndarray':
+        """Read the rows for the given ids"""
+        return np.asarray(self._vectors()[np.asarray(ids, dtype='int64')])
+
+    def all(self) -> 'np.ndarray':
+        """Read every stored vector"""
+        return np.asarray(self._vectors())
+
+def exact_scores(query: 'np.ndarray', vectors: 'np.ndarray', metric: int) -> 'np.ndarray':
+    """Score vectors against one query with the index metric"""
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return vectors @ query
+    return ((vectors - query) ** 2).sum(axis=1)  # squared L2, as returned by FAISS
+
+def exact_search(raw_vectors: RawVectorStore, queries: 'np.ndarray', k: int, metric: int,
+                 start: int = 0, block_size: int = 65536,
+                 allowed: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Brute-force search over the raw vectors from id start on, streaming them in blocks from disk.
+
+    allowed is an optional id bitmap; vectors whose bit is unset are skipped.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    vectors = raw_vectors._vectors()
+    allowed_mask = id_bitmap.to_mask(allowed, len(vectors)) if allowed is not None else None
+    best_scores = np.zeros((len(queries), 0), dtype='float32')
+    best_ids = np.zeros((len(queries), 0), dtype='int64')
+    ascending = metric != faiss.METRIC_INNER_PRODUCT
+
+    for offset in range(start, len(vectors), block_size):
+        block = np.asarray(vectors[offset:offset + block_size])
+        if ascending:
+            block_scores = faiss.pairwise_distances(queries, block)
+        else:
+            block_scores = queries @ block.T
+        block_ids = np.broadcast_to(np.arange(offset, offset + len(block), dtype='int64'), block_scores.shape)
+        if allowed_mask is not None:
+            block_mask = allowed_mask[offset:offset + len(block)]
+            block_scores, block_ids = block_scores[:, block_mask], block_ids[:, block_mask]
+
+        scores = np.hstack([best_scores, block_scores])
+        ids = np.hstack([best_ids, block_ids])
+        order = np.argsort(scores if ascending else -scores, axis=1, kind='stable')[:, :k]
+        best_scores = np.take_along_axis(scores, order, axis=1)
+        best_ids = np.take_along_axis(ids, order, axis=1)
+
+    return best_scores, best_ids
+
+def rescore(raw_vectors: RawVectorStore, query: 'np.ndarray', candidate_ids: 'np.ndarray',
+            k: int, metric: int) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Re-rank candidate ids by their exact score and keep the best k.
+
+    Returns (scores, ids) ordered best first, like a single row of index.search.
+    """
+    candidate_ids = np.asarray(candidate_ids, dtype='int64')
+    candidate_ids = candidate_ids[(candidate_ids >= 0) & (candidate_ids < len(raw_vectors))]
+    if len(candidate_ids) == 0:
+        return np.zeros(0, dtype='float32'), candidate_ids
+
+    scores = exact_scores(np.asarray(query, dtype='float32').ravel(), raw_vectors.get(candidate_ids), metric)
+    order = np.argsort(-scores if metric == faiss.METRIC_INNER_PRODUCT else scores, kind='stable')[:k]
+    return scores[order], candidate_ids[order]
+
+def search(index, raw_vectors: Optional[RawVectorStore], queries: 'np.ndarray', k: int,
+           rescore_factor: int, allowed: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+    """index.search, over-fetching and re-scoring exactly when raw vectors are available.
+
+    allowed is an optional id bitmap passed to FAISS as an IDSelector.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    params = None
+    if allowed is not None:
+        params = index_factory.search_parameters(index, id_bitmap.selector(allowed))
+    if raw_vectors is None or rescore_factor <= 1:
+        return index.search(queries, k, params=params)
+
+    candidate_scores, candidate_ids = index.search(queries, k * rescore_factor, params=params)
+    scores = np.full((len(queries), k), -1, dtype='float32')
+    ids = np.full((len(queries), k), -1, dtype='int64')
+    for row, query in enumerate(queries):
+        row_scores, row_ids = rescore(raw_vectors, query, candidate_ids[row], k, index.metric_type)
+        scores[row, :len(row_ids)] = row_scores
+        ids[row, :len(row_ids)] = row_ids
+    return scores, ids
+
+def merge_results(first: Tuple['np.ndarray', 'np.ndarray'], second: Tuple['np.ndarray', 'np.ndarray'],
+                  k: int, metric: int) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Merge two (scores, ids) search results row by row into the best k"""
+    scores = np.hstack([first[0], second[0]]).astype('float32')
+    ids = np.hstack([first[1], second[1]]).astype('int64')
+    ascending = metric != faiss.METRIC_INNER_PRODUCT
+    scores[ids < 0] = np.inf if ascending else -np.inf
+
+    order = np.argsort(scores if ascending else -scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+def search_with_tail(index, rescore_vectors: Optional[RawVectorStore], tail_vectors: Optional[RawVectorStore],
+                     queries: 'np.ndarray', k: int, rescore_factor: int,
+                     allowed: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Search the index plus, exactly, any raw vectors appended after it was loaded.
+
+    Read-only workers never add to their memory-mapped index, so vectors the
+    writer appended since the last snapshot are only on disk as raw vectors.
+    """
+    results = search(index, rescore_vectors, queries, k, rescore_factor, allowed)
+    if tail_vectors is None or len(tail_vectors) <= index.ntotal:
+        return results
+
+    tail = exact_search(tail_vectors, queries, k, index.metric_type, start=index.ntotal, allowed=allowed)
+    return merge_results(results, tail, k, index.metric_type)
+
+def estimate_recall(index, raw_vectors: RawVectorStore, k: int = 10, sample_size: int = 50,
+                    rescore_factor: int = 1) -> Optional[float]:
+    """Estimate recall@k of an index against exact search over the raw vectors.
+
+    Uses stored vectors as sample queries, so it needs no extra data.
+    """
+    total = len(raw_vectors)
+    if total == 0 or total != index.ntotal:
+        return None
+
+    k = min(k, total)
+    rng = np.random.default_rng(0)
+    sample_ids = rng.choice(total, size=min(sample_size, total), replace=False)
+    queries = raw_vectors.get(np.sort(sample_ids))
+
+    _, expected = exact_search(raw_vectors, queries, k, index.metric_type)
+    _, found = search(index, raw_vectors, queries, k, rescore_factor)
+
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / float(expected.size)
+
+def recall_stats(index, raw_vectors: RawVectorStore, rescore_factor: int, k: int = 10) -> dict:
+    """Recall@k of an index with and without exact re-scoring"""
+    rescored = estimate_recall(index, raw_vectors, k, rescore_factor=rescore_factor)
+    if rescored is None:
+        return {'recall_estimate': None}
+    unrescored = estimate_recall(index, raw_vectors, k, rescore_factor=1)
+    return {
+        'recall_estimate': {
+            'k': k,
+            'recall': round(rescored, 4),
+            'recall_without_rescoring': round(unrescored, 4),
+            'recall_loss': round(1.0 - rescored, 4)
+        }
+    }
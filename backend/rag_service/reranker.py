@@ -0,0 +1,143 @@
+"""
+Cross-Encoder Re-Ranking
+Re-orders retrieved chunks by scoring each (question, chunk) pair with a
+small local cross-encoder. The candidate depth is picked from the measured
+cost per pair so scoring fits the request's time budget; when a batch would
+overrun the budget anyway, the vector order is kept.
+"""
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """Scores (query, passage) pairs in batches within a time budget"""
+
+    def __init__(self, model_name: str, max_candidates: int = 20, batch_size: int = 8):
+        if CrossEncoder is None:
+            raise ImportError("sentence-transformers is required for re-ranking")
+
+        self.model_name = model_name
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+        start = time.perf_counter()
+        self.model = CrossEncoder(model_name)
+        logger.info(f"Loaded cross-encoder {model_name} in {time.perf_counter() - start:.2f}s")
+
+        # Moving average of the seconds one pair takes, seeded by warm-up batches of chunk-sized passages
+        self.pair_seconds = None
+        warm_up = [('warm up', ' '.join(['warm up'] * (getattr(settings, 'CHUNK_SIZE', 256) // 2)))] * batch_size
+        self._score(warm_up)
+        self.pair_seconds = None  # The first batch pays one-time setup costs
+        self._score(warm_up)
+
+    def _score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        start = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        seconds = (time.perf_counter() - start) / len(pairs)
+        self.pair_seconds = seconds if self.pair_seconds is None else 0.5 * self.pair_seconds + 0.5 * seconds
+        return [float(score) for score in scores]
+
+    def candidate_depth(self, k: int, budget_seconds: float) -> int:
+        """How many candidates to fetch: as many as fit in the budget, at least k, at most max_candidates"""
+        affordable = int(budget_seconds / self.pair_seconds) if self.pair_seconds else self.max_candidates
+        return max(k, min(self.max_candidates, affordable))
+
+    def rerank(self, query: str, documents: List[Any], k: int,
+               budget_seconds: float) -> Tuple[List[Any], Dict[str, Any]]:
+        """Best k documents by cross-encoder score, or the first k if scoring would exceed the budget"""
+        deadline = time.perf_counter() + budget_seconds
+        scores = []
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            if time.perf_counter() + self.pair_seconds * len(batch) > deadline:
+                logger.info(f"Re-ranking budget of {budget_seconds * 1000:.0f}ms exceeded, keeping vector order")
+                return documents[:k], {'reranked': False, 'pairs_scored': len(scores), 'budget_exceeded': True}
+            scores.extend(self._score([(query, document.page_content) for document in batch]))
+
+        # Stable sort keeps the vector order between equal scores
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])
+        return [documents[i] for i in order[:k]], {'reranked': True, 'pairs_scored': len(scores), 'budget_exceeded': False}
+
+# Global instance (singleton pattern)
+_reranker = None
+_reranker_lock = threading.Lock()
+_load_thread = None
+_load_failed_at = None  # time.monotonic() of the last failed load
+_load_error = None
+
+def _load(model_name: str):
+    global _reranker, _load_failed_at, _load_error
+    try:
+        reranker = CrossEncoderReranker(
+            model_name,
+            max_candidates=getattr(settings, 'RERANK_MAX_CANDIDATES', 20),
+            batch_size=getattr(settings, 'RERANK_BATCH_SIZE', 8)
+        )
+    except Exception as e:
+        logger.error(f"Could not load cross-encoder {model_name}: {str(e)}")
+        with _reranker_lock:
+            _load_failed_at = time.monotonic()
+            _load_error = str(e)
+        return
+    with _reranker_lock:
+        _reranker = reranker
+        _load_failed_at = None
+        _load_error = None
+
+def start_reranker_loading() -> Optional[threading.Thread]:
+    """Load and warm up the cross-encoder on a background thread.
+
+    Returns the loading thread, or None when RERANKER_MODEL is not set, the model is
+    loaded, or the last load failed less than RERANKER_RETRY_INTERVAL seconds ago.
+    """
+    global _load_thread
+    model_name = getattr(settings, 'RERANKER_MODEL', '')
+    if not model_name:
+        return None
+    with _reranker_lock:
+        if _reranker is not None:
+            return None
+        if _load_thread is not None and _load_thread.is_alive():
+            return _load_thread
+        if _load_failed_at is not None and time.monotonic() - _load_failed_at < getattr(settings, 'RERANKER_RETRY_INTERVAL', 300):
+            return None
+        _load_thread = threading.Thread(target=_load, args=(model_name,), name='reranker-load', daemon=True)
+        _load_thread.start()
+        return _load_thread
+
+def get_reranker(wait: bool = False) -> Optional[CrossEncoderReranker]:
+    """The cross-encoder re-ranker, None if RERANKER_MODEL is not set, it failed to load or is still loading.
+
+    Requests do not wait for the model unless wait is set; loading starts in the background if needed.
+    """
+    thread = start_reranker_loading()
+    if wait and thread is not None:
+        thread.join()
+    return _reranker
+
+def reranker_unavailable_reason() -> Optional[str]:
+    """Why get_reranker() returns None, None when it does not"""
+    if _reranker is not None:
+        return None
+    if not getattr(settings, 'RERANKER_MODEL', ''):
+        return 'RERANKER_MODEL is not set'
+    if _load_error is not None:
+        return f"Cross-encoder failed to load: {_load_error}"
+    return 'Cross-encoder is still loading'
+
+def start_reranker_on_startup():
+    """Load the cross-encoder when a server process starts, so the first re-ranked request does not pay for it"""
+    from .ingestion import is_server_process
+
+    if getattr(settings, 'RERANKER_PRELOAD', False) and is_server_process():
+        start_reranker_loading()
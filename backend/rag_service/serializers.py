@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.conf import settings
 from .models import Document, DocumentChunk, VectorStore
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -7,13 +8,13 @@ class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = [
-            'id', 'filename', 'file_size', 'content_type',
+            'id', 'filename', 'file_size', 'content_type', 'content_hash',
             'status', 'processing_error', 'created_at', 'updated_at',
             'total_chunks', 'embedding_model'
         ]
         read_only_fields = [
             'id', 'created_at', 'updated_at', 'total_chunks', 
-            'embedding_model', 'status', 'processing_error'
+            'embedding_model', 'status', 'processing_error', 'content_hash'
         ]
 
 class DocumentChunkSerializer(serializers.ModelSerializer):
@@ -45,9 +46,10 @@ class DocumentUploadSerializer(serializers.Serializer):
     
     def validate_file(self, value):
         """Validate uploaded file"""
-        # Check file size (max 10MB)
-        if value.size > 10 * 1024 * 1024:
-            raise serializers.ValidationError("File size must be less than 10MB")
+        # Check file size; extraction and chunking are streamed, so this only bounds disk use
+        max_size = getattr(settings, 'MAX_UPLOAD_SIZE', 200 * 1024 * 1024)
+        if value.size > max_size:
+            raise serializers.ValidationError(f"File size must be less than {max_size // (1024 * 1024)}MB")
         
         # Check file extension
         allowed_extensions = ['.pdf', '.txt', '.md', '.docx']
@@ -59,15 +61,50 @@ class DocumentUploadSerializer(serializers.Serializer):
         
         return value
 
-class RAGSearchSerializer(serializers.Serializer):
+class SearchFilterSerializer(serializers.Serializer):
+    """Optional metadata filters shared by the search and chat requests"""
+    
+    document_ids = serializers.ListField(child=serializers.UUIDField(), required=False)
+    filenames = serializers.ListField(child=serializers.CharField(max_length=255), required=False)
+    content_types = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+    uploaded_from = serializers.DateField(required=False)
+    uploaded_to = serializers.DateField(required=False)
+    
+    def get_search_filters(self):
+        """Filters in the form the vector store expects, or None if none were given"""
+        data = self.validated_data
+        filters = {
+            'document_id': [str(document_id) for document_id in data.get('document_ids', [])],
+            'filename': data.get('filenames', []),
+            'content_type': data.get('content_types', []),
+            'uploaded_from': data['uploaded_from'].isoformat() if data.get('uploaded_from') else None,
+            'uploaded_to': data['uploaded_to'].isoformat() if data.get('uploaded_to') else None
+        }
+        filters = {key: value for key, value in filters.items() if value}
+        return filters or None
+
+class RAGSearchSerializer(SearchFilterSerializer):
     """Serializer for RAG search requests"""
     
     query = serializers.CharField(max_length=1000)
     num_results = serializers.IntegerField(default=5, min_value=1, max_value=20)
+    # 'keyword' ranks by BM25 over the chunk text, 'hybrid' fuses it with the vector ranking
+    mode = serializers.ChoiceField(choices=['vector', 'keyword', 'hybrid'], default='vector')
+
+class RAGBatchSearchSerializer(SearchFilterSerializer):
+    """Serializer for batched RAG search requests"""
+    
+    queries = serializers.ListField(
+        child=serializers.CharField(max_length=1000), min_length=1, max_length=100
+    )
+    num_results = serializers.IntegerField(default=5, min_value=1, max_value=20)
 
-class RAGChatSerializer(serializers.Serializer):
+class RAGChatSerializer(SearchFilterSerializer):
     """Serializer for RAG chat requests"""
     
     message = serializers.CharField(max_length=2000)
     conversation_id = serializers.CharField(max_length=100, required=False)
     num_context_docs = serializers.IntegerField(default=4, min_value=1, max_value=10)
+    # Cross-encoder re-ranking of over-fetched candidates (default: RERANK_BY_DEFAULT) and its time budget
+    rerank = serializers.BooleanField(required=False, allow_null=True, default=None)
+    rerank_budget_ms = serializers.IntegerField(required=False, min_value=0, max_value=10000)
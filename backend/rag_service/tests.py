@@ -1,3 +1,918 @@
-from django.test import TestCase
+import os
+import math
+import shutil
+import json
+import hashlib
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.embeddings import Embeddings
+from rest_framework.test import APIClient
+
+from . import document_processor, faiss_rag, id_bitmap
+from .bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+from .answer_cache import SemanticAnswerCache
+from .chunk_text import ChunkTextDocstore
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import ChunkEmbeddingCache, QueryEmbeddingCache
+from .embedding_models import EmbeddingModelRegistry
+from .faiss_rag import FAISSShard, FAISSVectorStore
+from .reranker import CrossEncoderReranker
+from .models import Document, DocumentChunk, IngestionJob
+from .vector_store import bulk_create_chunks
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings, so tests need no model download"""
+
+    model_name = 'test-hashing-embeddings'
+    dimension = 64
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dimension, dtype='float32')
+        for token in tokenize(text):
+            vector[int(hashlib.md5(token.encode('utf-8')).hexdigest(), 16) % self.dimension] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+class VectorStoreTestCase(SimpleTestCase):
+    """Stores in a temporary directory, with background snapshots and purges held off"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        self.index_path = os.path.join(self.tmp_dir, 'index')
+        overrides = override_settings(
+            FAISS_INDEX_PATH=self.index_path,
+            FAISS_INDEX_TYPE='flat',
+            FAISS_STORAGE_MODE='float',
+            FAISS_MMAP_READONLY=False,
+            FAISS_SNAPSHOT_INTERVAL=1000000,
+            FAISS_TOMBSTONE_COMPACTION_RATIO=2.0,
+            CHUNK_EMBEDDING_CACHE_PATH=None,
+            EMBEDDING_BATCHER_ENABLED=False,
+            INGESTION_AUTOSTART=False
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.embeddings = HashingEmbeddings()
+
+    def write_file(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def open_shard(self) -> FAISSShard:
+        return FAISSShard(self.index_path, self.embeddings)
+
+    def open_store(self) -> FAISSVectorStore:
+        with mock.patch('rag_service.faiss_rag.get_langchain_embeddings', return_value=self.embeddings):
+            return FAISSVectorStore(self.index_path)
+
+    def sources(self, documents) -> list:
+        return [document.metadata.get('source') for document in documents]
+
+class UploadLogReplayTests(VectorStoreTestCase):
+
+    def test_uploads_since_the_snapshot_are_replayed_after_a_crash(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        shard.add_documents([alpha])
+        self.assertGreater(shard.upload_log.size(), 0)
+        # Raw vectors of a batch whose log record was never written
+        shard.raw_vectors.append(np.ones((3, HashingEmbeddings.dimension), dtype='float32'))
+
+        # No snapshot since the upload: the index on disk only has the sample document
+        reopened = self.open_shard()
+        self.assertEqual(reopened.vector_store.index.ntotal, shard.vector_store.index.ntotal)
+        self.assertEqual(len(reopened.raw_vectors), reopened.vector_store.index.ntotal)
+        self.assertEqual(self.sources(reopened.similarity_search('alpha particles', k=1)), [alpha])
+
+    def test_deletes_since_the_snapshot_are_replayed_after_a_crash(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        beta = self.write_file('beta.txt', 'beta decay ' * 40)
+        shard.add_documents([alpha, beta])
+        shard.save_index()
+        shard.delete_documents([alpha])
+
+        reopened = self.open_shard()
+        self.assertNotIn(alpha, self.sources(reopened.similarity_search('alpha particles', k=10)))
+        self.assertEqual(reopened._deleted_count, shard._deleted_count)
+
+    def test_log_is_replayed_when_the_snapshot_files_are_missing(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        shard.add_documents([alpha])
+        ntotal = shard.vector_store.index.ntotal
+        os.remove(os.path.join(self.index_path, 'index.faiss'))
+        os.remove(os.path.join(self.index_path, 'index.pkl'))
+
+        reopened = self.open_shard()
+        self.assertEqual(reopened.vector_store.index.ntotal, ntotal)
+        self.assertEqual(self.sources(reopened.similarity_search('alpha particles', k=1)), [alpha])
+
+    def test_unreadable_snapshot_is_left_for_recovery(self):
+        shard = self.open_shard()
+        shard.add_documents([self.write_file('alpha.txt', 'alpha particles ' * 40)])
+        log_size = shard.upload_log.size()
+        index_pkl_path = os.path.join(self.index_path, 'index.pkl')
+        with open(index_pkl_path, 'wb') as f:
+            f.write(b'not a pickle')
+
+        with self.assertRaises(Exception):
+            self.open_shard()
+        self.assertEqual(shard.upload_log.size(), log_size)
+        with open(index_pkl_path, 'rb') as f:
+            self.assertEqual(f.read(), b'not a pickle')
+
+class ChunkTextTests(VectorStoreTestCase):
+
+    def test_snapshot_keeps_chunk_text_out_of_the_pickle(self):
+        shard = self.open_shard()
+        shard.add_documents([self.write_file('alpha.txt', 'zyzzyva ' * 40)])
+        shard.save_index()
+        with open(os.path.join(self.index_path, 'index.pkl'), 'rb') as f:
+            self.assertNotIn(b'zyzzyva', f.read())
+        with open(os.path.join(self.index_path, 'chunks.text'), 'rb') as f:
+            self.assertIn(b'zyzzyva', f.read())
+
+    def test_read_only_shard_reads_text_written_after_its_snapshot(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        shard.add_documents([alpha])
+        shard.save_index()
+        with override_settings(FAISS_MMAP_READONLY=True):
+            reader = self.open_shard()
+        beta = self.write_file('beta.txt', 'beta decay ' * 40)
+        shard.add_documents([beta])
+
+        reader._reload_if_stale()
+        [(document, _)] = reader.keyword_search('decay', k=1)
+        self.assertEqual(document.metadata['source'], beta)
+        self.assertIn('beta decay', document.page_content)
+
+    def test_snapshot_with_an_in_memory_docstore_is_converted(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        shard.add_documents([alpha])
+        # Layout written before the chunk text file existed: documents pickled with their text
+        documents = {doc_id: shard.vector_store.docstore.search(doc_id) for doc_id in shard.vector_store.docstore._dict}
+        shard.vector_store.docstore = InMemoryDocstore(documents)
+        with shard._lock:
+            shard._write_snapshot(*shard._serialize_snapshot())
+        os.remove(os.path.join(self.index_path, 'chunks.text'))
+
+        reopened = self.open_shard()
+        self.assertIsInstance(reopened.vector_store.docstore, ChunkTextDocstore)
+        self.assertEqual(self.sources(reopened.similarity_search('alpha particles', k=1)), [alpha])
+        with open(os.path.join(self.index_path, 'index.pkl'), 'rb') as f:
+            self.assertNotIn(b'alpha particles', f.read())
+
+class TombstonePurgeTests(VectorStoreTestCase):
+
+    def test_purge_removes_deleted_vectors_and_renumbers_the_rest(self):
+        shard = self.open_shard()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        beta = self.write_file('beta.txt', 'beta decay ' * 40)
+        shard.add_documents([alpha, beta])
+        deleted = shard.delete_documents([alpha])['deleted_chunks']
+        ntotal = shard.vector_store.index.ntotal
+
+        shard._purge_tombstones()
+        self.assertEqual(shard.vector_store.index.ntotal, ntotal - deleted)
+        self.assertEqual(shard._deleted_count, 0)
+        self.assertEqual(len(shard.raw_vectors), shard.vector_store.index.ntotal)
+        self.assertEqual(sorted(shard.vector_store.index_to_docstore_id), list(range(ntotal - deleted)))
+
+        self.assertNotIn(alpha, self.sources(shard.similarity_search('alpha particles', k=10)))
+        self.assertEqual(self.sources(shard.similarity_search('beta decay', k=1)), [beta])
+        self.assertEqual([self.sources([document])[0] for document, _ in shard.keyword_search('decay', k=1)], [beta])
+        with open(shard.vector_store.docstore.path, 'rb') as f:
+            self.assertNotIn(b'alpha particles', f.read())
+
+        # The purge wrote a snapshot of the compacted index
+        reopened = self.open_shard()
+        self.assertEqual(reopened.vector_store.index.ntotal, ntotal - deleted)
+        self.assertEqual(self.sources(reopened.similarity_search('beta decay', k=1)), [beta])
+
+class IndexMigrationTests(VectorStoreTestCase):
+
+    @override_settings(FAISS_INDEX_TYPE='ivf_flat', FAISS_IVF_NLIST=4, FAISS_MIN_TRAINING_VECTORS=40)
+    def test_uploads_during_training_are_added_to_the_migrated_index(self):
+        shard = self.open_shard()
+        gamma = self.write_file('gamma.txt', 'gamma rays ' * 40)
+        build_index = faiss_rag.index_factory.build_index
+        uploaded = []
+
+        def build_during_upload(*args, **kwargs):
+            # Training must not hold the shard lock, or this upload would wait for it
+            upload = threading.Thread(target=lambda: uploaded.append(shard.add_documents([gamma])))
+            upload.start()
+            upload.join(timeout=30)
+            return build_index(*args, **kwargs)
+
+        words = self.write_file('words.txt', ' '.join(f'word{i}' for i in range(6000)))
+        with mock.patch.object(faiss_rag.index_factory, 'build_index', side_effect=build_during_upload):
+            shard.add_documents([words])
+
+        self.assertEqual(len(uploaded), 1)
+        faiss_index = shard.vector_store.index
+        self.assertEqual(faiss_rag.index_factory.index_type_of(faiss_index), 'ivf_flat')
+        self.assertEqual(faiss_index.ntotal, len(shard.vector_store.index_to_docstore_id))
+        self.assertEqual(self.sources(shard.similarity_search('gamma rays', k=1)), [gamma])
+
+class ShardedSearchTests(VectorStoreTestCase):
+
+    TOPICS = ['alpha particles', 'beta decay', 'gamma rays', 'delta waves', 'alpha decay', 'beta particles']
+
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(FAISS_NUM_SHARDS=3)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.store = self.open_store()
+        self.paths = [self.write_file(f'topic_{i}.txt', f'{topic} ' * (10 + 5 * i)) for i, topic in enumerate(self.TOPICS)]
+        self.store.add_documents(self.paths)
+        self.assertGreater(len({id(self.store.shard_for(path)) for path in self.paths}), 1)
+
+    def assert_merged(self, merged, shard_results, k, higher_is_better=True):
+        scores = [score for _, score in merged]
+        self.assertEqual(scores, sorted(scores, reverse=higher_is_better))
+        expected = sorted((score for results in shard_results for _, score in results), reverse=higher_is_better)[:k]
+        self.assertEqual(scores, expected)
+
+    def test_vector_results_are_merged_best_first(self):
+        query_embedding = np.array([self.embeddings.embed_query('alpha decay particles')], dtype='float32')
+        metrics = {shard.vector_store.index.metric_type for shard in self.store.shards}
+        self.assertEqual(len(metrics), 1)
+
+        merged = self.store.search_by_vector(query_embedding, k=5)
+        shard_results = [shard.search_by_vector(query_embedding, 5) for shard in self.store.shards]
+        self.assert_merged(merged, shard_results, 5, higher_is_better=metrics == {faiss.METRIC_INNER_PRODUCT})
+        self.assertEqual(len(merged), 5)
+
+    def test_keyword_results_are_merged_best_first(self):
+        merged = self.store.keyword_search('alpha decay particles', k=4)
+        self.assert_merged(merged, [shard.keyword_search('alpha decay particles', 4) for shard in self.store.shards], 4)
+        self.assertEqual(len(merged), 4)
+
+class BM25IndexTests(SimpleTestCase):
+
+    TEXTS = [
+        'the cat sat on the mat',
+        'the dog chased the cat cat',
+        'dogs and birds in the park',
+        'policy POL-2231 covers remote work'
+    ]
+
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add(range(len(self.TEXTS)), self.TEXTS)
+
+    def test_scores_follow_okapi_bm25(self):
+        scores, positions = self.index.search('cat', k=10)
+        self.assertEqual(positions.tolist(), [1, 0])
+
+        lengths = [len(tokenize(text)) for text in self.TEXTS]
+        average_length = sum(lengths) / len(lengths)
+        idf = math.log(1 + (4 - 2 + 0.5) / (2 + 0.5))
+        expected = [
+            idf * frequency * 2.5 / (frequency + 1.5 * (0.25 + 0.75 * lengths[position] / average_length))
+            for position, frequency in [(1, 2), (0, 1)]
+        ]
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+    def test_identifiers_match_by_their_parts(self):
+        _, positions = self.index.search('POL-2231', k=10)
+        self.assertEqual(positions.tolist(), [3])
+
+    def test_removed_and_disallowed_positions_are_skipped(self):
+        self.index.remove([1])
+        _, positions = self.index.search('cat', k=10)
+        self.assertEqual(positions.tolist(), [0])
+
+        _, positions = self.index.search('the', k=10, allowed=id_bitmap.set_ids(id_bitmap.empty(0), [2]))
+        self.assertEqual(positions.tolist(), [2])
+
+    def test_round_trip_keeps_scores(self):
+        restored = BM25Index.from_bytes(self.index.to_bytes())
+        for query in ('cat', 'the dog', 'remote policy'):
+            expected, expected_positions = self.index.search(query, k=10)
+            scores, positions = restored.search(query, k=10)
+            self.assertEqual(positions.tolist(), expected_positions.tolist())
+            np.testing.assert_allclose(scores, expected)
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_items_ranked_well_in_both_lists_come_first(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], k=60)
+        self.assertEqual([item for item, _ in fused], ['a', 'c', 'b'])
+        self.assertAlmostEqual(dict(fused)['a'], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(dict(fused)['b'], 1 / 62)
+
+class HybridSearchTests(VectorStoreTestCase):
+
+    DOCUMENTS = {
+        'a.txt': 'policy POL-2231 covers remote work',
+        'b.txt': 'remote work guidelines for staff',
+        'c.txt': 'POL-2231 appendix on travel',
+        'd.txt': 'quarterly sales figures'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.open_store()
+        self.paths = {name: self.write_file(name, text) for name, text in self.DOCUMENTS.items()}
+        self.store.add_documents(
+            list(self.paths.values()), metadata={path: {'filename': name} for name, path in self.paths.items()}
+        )
+
+    def filenames(self, documents) -> list:
+        return [document.metadata.get('filename') for document in documents]
+
+    def test_chunks_matching_both_rankings_come_first(self):
+        results = self.store.similarity_search('POL-2231 remote work', k=3, mode='hybrid')
+        self.assertEqual(self.filenames(results)[0], 'a.txt')
+        self.assertEqual(set(self.filenames(results)), {'a.txt', 'b.txt', 'c.txt'})
+
+    def test_keyword_mode_finds_exact_identifiers(self):
+        results = self.store.similarity_search('POL-2231', k=2, mode='keyword')
+        self.assertEqual(set(self.filenames(results)), {'a.txt', 'c.txt'})
+
+    def test_filters_apply_to_both_rankings(self):
+        filters = {'filename': ['b.txt', 'c.txt']}
+        results = self.store.similarity_search('POL-2231 remote work', k=4, filters=filters, mode='hybrid')
+        self.assertEqual(set(self.filenames(results)), {'b.txt', 'c.txt'})
+
+        results = self.store.similarity_search('POL-2231', k=4, filters={'filename': ['c.txt']}, mode='keyword')
+        self.assertEqual(self.filenames(results), ['c.txt'])
+
+    def test_deleted_documents_are_not_returned(self):
+        self.store.delete_documents([self.paths['a.txt']])
+        results = self.store.similarity_search('POL-2231 remote work', k=4, mode='hybrid')
+        self.assertNotIn('a.txt', self.filenames(results))
+
+class TokenChunkerTests(SimpleTestCase):
+
+    VOCABULARY = ['the', 'token', '##izer', '##s', 'split', 'text', 'into', 'chunks', 'of', 'size', '.', ',']
+    TEXT = ' '.join(
+        f'the tokenizers split text into chunks, of size {i}.' for i in range(40)
+    )
+
+    def setUp(self):
+        from transformers import BertTokenizerFast
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        vocab_path = os.path.join(tmp_dir, 'vocab.txt')
+        with open(vocab_path, 'w') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + self.VOCABULARY))
+        self.tokenizer = BertTokenizerFast(vocab_file=vocab_path)
+        self.model = SimpleNamespace(tokenizer=self.tokenizer, max_seq_length=64)
+
+    def token_count(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def chunk(self, chunker, text: str, cuts=()):
+        bounds = [0, *cuts, len(text)]
+        segments = [(text[start:end], None) for start, end in zip(bounds, bounds[1:])]
+        return list(chunker.iter_chunks(segments))
+
+    @override_settings(CHUNK_SIZE=20, CHUNK_OVERLAP=6)
+    def test_chunks_respect_chunk_size_and_overlap_in_tokens(self):
+        processor = faiss_rag.DocumentProcessor(embedding_model=SimpleNamespace(client=self.model))
+        chunker = processor.token_chunker
+        self.assertIsNotNone(chunker)
+        self.assertEqual((chunker.chunk_size, chunker.chunk_overlap), (20, 6))
+
+        chunks = self.chunk(chunker, self.TEXT)
+        self.assertGreater(len(chunks), 5)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertLessEqual(self.token_count(previous['content']), 20)
+            self.assertLess(chunk['start_char'], previous['end_char'])
+            overlap = self.TEXT[chunk['start_char']:previous['end_char']]
+            self.assertTrue(0 < self.token_count(overlap) <= 6)
+        self.assertLessEqual(self.token_count(chunks[-1]['content']), 20)
+        self.assertEqual(chunks[-1]['end_char'], len(self.TEXT.rstrip()))
+
+    def test_offsets_slice_back_to_the_chunk_text(self):
+        chunker = document_processor.DocumentProcessor.for_model(self.model, chunk_size=16, chunk_overlap=4)
+        # Segment boundaries inside words, e.g. 'tokeni|zers', must not change the chunks
+        cuts = [7, 100, 101, 333, 800]
+        chunks = self.chunk(chunker, self.TEXT, cuts)
+        self.assertEqual(
+            [(c['start_char'], c['end_char']) for c in chunks],
+            [(c['start_char'], c['end_char']) for c in self.chunk(chunker, self.TEXT)]
+        )
+        # Chunks start and end on the words the tokenizer pre-splits, never inside one
+        words = [span for _, span in self.tokenizer.backend_tokenizer.pre_tokenizer.pre_tokenize_str(self.TEXT)]
+        starts, ends = {start for start, _ in words}, {end for _, end in words}
+        for chunk in chunks:
+            self.assertEqual(self.TEXT[chunk['start_char']:chunk['end_char']], chunk['content'])
+            self.assertIn(chunk['start_char'], starts)
+            self.assertIn(chunk['end_char'], ends)
+
+    def test_chunk_size_is_capped_at_the_model_input(self):
+        chunker = document_processor.DocumentProcessor.for_model(self.model, chunk_size=1000, chunk_overlap=32)
+        self.assertEqual(chunker.chunk_size, 64 - self.tokenizer.num_special_tokens_to_add(pair=False))
+        for chunk in self.chunk(chunker, self.TEXT):
+            self.assertLessEqual(self.token_count(chunk['content']) + 2, self.model.max_seq_length)
+
+    @override_settings(CHUNK_SIZE=12, CHUNK_OVERLAP=3)
+    def test_file_chunks_record_their_offsets(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        path = os.path.join(tmp_dir, 'doc.txt')
+        with open(path, 'w') as f:
+            f.write(self.TEXT)
+
+        processor = faiss_rag.DocumentProcessor(embedding_model=SimpleNamespace(client=self.model))
+        documents = list(processor.iter_chunks(path))
+        self.assertGreater(len(documents), 1)
+        for document in documents:
+            start = document.metadata['start_index']
+            self.assertEqual(self.TEXT[start:start + len(document.page_content)], document.page_content)
+            self.assertLessEqual(self.token_count(document.page_content), 12)
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.append(list(texts))
+        return np.array(HashingEmbeddings().embed_documents(texts), dtype='float32')
+
+    def test_repeated_queries_hit_after_normalization(self):
+        cache = QueryEmbeddingCache(max_size=10)
+        first = cache.embed('model', ['alpha  particles', 'beta decay'], self.encode)
+        again = cache.embed('model', ['alpha particles ', 'beta decay', 'Beta decay'], self.encode)
+
+        # Whitespace is collapsed, case is kept
+        self.assertEqual(self.encoded, [['alpha  particles', 'beta decay'], ['Beta decay']])
+        np.testing.assert_array_equal(again[:2], first)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+        # Another namespace (model) does not share entries
+        cache.embed('other-model', ['beta decay'], self.encode)
+        self.assertEqual(self.encoded[-1], ['beta decay'])
+
+    def test_least_recently_used_query_is_evicted(self):
+        cache = QueryEmbeddingCache(max_size=2)
+        cache.embed('model', ['alpha'], self.encode)
+        cache.embed('model', ['beta'], self.encode)
+        cache.embed('model', ['alpha'], self.encode)  # alpha is now the most recently used
+        cache.embed('model', ['gamma'], self.encode)
+
+        calls = len(self.encoded)
+        cache.embed('model', ['alpha', 'gamma'], self.encode)
+        self.assertEqual(len(self.encoded), calls)
+        cache.embed('model', ['beta'], self.encode)
+        self.assertEqual(self.encoded[-1], ['beta'])
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_shared_tier_serves_other_processes(self):
+        shared_cache = {}
+        shared = mock.Mock(
+            get_many=lambda keys: {key: shared_cache[key] for key in keys if key in shared_cache},
+            set_many=shared_cache.update
+        )
+        with mock.patch('rag_service.embedding_cache.caches', {'shared': shared}):
+            vector = QueryEmbeddingCache(shared_alias='shared').embed('model', ['alpha'], self.encode)
+            other_process = QueryEmbeddingCache(shared_alias='shared')
+            np.testing.assert_array_equal(other_process.embed('model', ['alpha'], self.encode), vector)
+
+        self.assertEqual(len(self.encoded), 1)
+        self.assertEqual(other_process.stats()['shared_hits'], 1)
+
+class ChunkEmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        self.cache = ChunkEmbeddingCache(os.path.join(tmp_dir, 'chunks.sqlite3'), max_entries=10)
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.append(list(texts))
+        return np.array(HashingEmbeddings().embed_documents(texts), dtype='float32')
+
+    def rows(self) -> int:
+        return self.cache._connect().execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def test_hits_return_the_cached_vectors_without_encoding(self):
+        first = self.cache.embed('model', ['alpha decay', 'beta decay'], self.encode)
+        again = self.cache.embed('model', ['beta decay', 'alpha decay', 'beta decay'], self.encode)
+        self.assertEqual(self.encoded, [['alpha decay', 'beta decay']])
+        np.testing.assert_array_equal(again, first[[1, 0, 1]])
+        self.assertEqual(self.cache.stats()['hits'], 3)
+
+        # Another model embeds the same text again
+        self.cache.embed('other-model', ['alpha decay'], self.encode)
+        self.assertEqual(self.encoded[-1], ['alpha decay'])
+
+    def test_hits_refresh_last_used_so_eviction_keeps_them(self):
+        self.cache.embed('model', [f'text {i}' for i in range(10)], self.encode)
+        connection = self.cache._connect()
+        with connection:
+            connection.execute('UPDATE embeddings SET last_used = 0')
+        self.cache.embed('model', ['text 0'], self.encode)
+
+        # 12 rows is over the 10% margin: the 2 least recently used go
+        self.cache.embed('model', ['new 0', 'new 1'], self.encode)
+        self.assertEqual(self.rows(), 10)
+        self.assertEqual(self.cache._count, 10)
+        calls = len(self.encoded)
+        self.cache.embed('model', ['text 0', 'new 0', 'new 1'], self.encode)
+        self.assertEqual(len(self.encoded), calls)
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = SemanticAnswerCache(max_size=2, similarity_threshold=0.99)
+        self.cache.get(self.question(0), 'scope', 1)  # Ties the cache to version 1
+
+    def question(self, axis: int) -> 'np.ndarray':
+        vector = np.zeros(8, dtype='float32')
+        vector[axis] = 1.0
+        return vector
+
+    def test_least_recently_used_answer_is_evicted(self):
+        self.cache.put(self.question(0), 'scope', 1, {'answer': 'first'})
+        self.cache.put(self.question(1), 'scope', 1, {'answer': 'second'})
+        # A hit makes the first answer the most recently used, so the second one goes
+        self.assertEqual(self.cache.get(self.question(0), 'scope', 1)[0], {'answer': 'first'})
+        self.cache.put(self.question(2), 'scope', 1, {'answer': 'third'})
+
+        self.assertIsNone(self.cache.get(self.question(1), 'scope', 1))
+        self.assertEqual(self.cache.get(self.question(0), 'scope', 1)[0], {'answer': 'first'})
+        self.assertEqual(self.cache.get(self.question(2), 'scope', 1)[0], {'answer': 'third'})
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+class BatchSearchEndpointTests(VectorStoreTestCase):
+
+    def test_each_query_gets_its_own_results_from_one_encode_pass(self):
+        store = self.open_store()
+        alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        beta = self.write_file('beta.txt', 'beta decay ' * 40)
+        store.add_documents([alpha, beta])
+
+        # A fresh query embedding cache, so queries searched by other tests are encoded again
+        with mock.patch('rag_service.views.get_vector_store', return_value=store), \
+                mock.patch('rag_service.embedding_cache._query_embedding_cache', None), \
+                mock.patch.object(self.embeddings, 'embed_documents', wraps=self.embeddings.embed_documents) as encode:
+            response = APIClient().post(
+                reverse('batch_search_documents'),
+                {'queries': ['beta decay', 'alpha particles'], 'num_results': 1},
+                format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_queries'], 2)
+        self.assertEqual([result['query'] for result in response.data['results']], ['beta decay', 'alpha particles'])
+        self.assertEqual(
+            [[hit['metadata']['source'] for hit in result['results']] for result in response.data['results']],
+            [[beta], [alpha]]
+        )
+        encode.assert_called_once_with(['beta decay', 'alpha particles'])
+
+    def test_empty_query_list_is_rejected(self):
+        response = APIClient().post(reverse('batch_search_documents'), {'queries': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+class AnswerCacheEndpointTests(VectorStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.open_store()
+        self.alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        self.store.add_documents([self.alpha])
+        self.rag_chain = mock.Mock()
+        self.rag_chain.query.return_value = {
+            'answer': 'Helium nuclei.',
+            'source_documents': [{'content': 'alpha particles', 'metadata': {'source': self.alpha}}],
+            'retrieval': {}
+        }
+        for patcher in (
+            mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}),
+            mock.patch('rag_service.views.get_vector_store', return_value=self.store),
+            mock.patch('rag_service.views.get_rag_chain', return_value=self.rag_chain),
+            mock.patch('rag_service.views.get_answer_cache', return_value=SemanticAnswerCache())
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ask(self, message: str = 'What are alpha particles?') -> dict:
+        response = APIClient().post(reverse('rag_chat'), {'message': message}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['response'], 'Helium nuclei.')
+        return response.data
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        self.assertNotIn('cached', self.ask())
+        cached = self.ask()
+        self.assertTrue(cached['cached'])
+        self.assertEqual(cached['context_documents'], self.rag_chain.query.return_value['source_documents'])
+        self.assertEqual(self.rag_chain.query.call_count, 1)
+
+        # A differently worded question is answered by the chain
+        self.ask('How long is the beta decay half-life?')
+        self.assertEqual(self.rag_chain.query.call_count, 2)
+
+    def test_upload_and_delete_invalidate_cached_answers(self):
+        self.ask()
+        self.store.add_documents([self.write_file('beta.txt', 'beta decay ' * 40)])
+        self.assertNotIn('cached', self.ask())
+        self.assertEqual(self.rag_chain.query.call_count, 2)
+
+        self.store.delete_documents([self.alpha])
+        self.assertNotIn('cached', self.ask())
+        self.assertEqual(self.rag_chain.query.call_count, 3)
+        self.assertTrue(self.ask()['cached'])
+
+class UploadDedupeTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, INGESTION_ASYNC=True, INGESTION_AUTOSTART=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def upload(self, name: str, content: bytes):
+        return APIClient().post(
+            reverse('upload_document'),
+            {'file': SimpleUploadedFile(name, content, content_type='text/plain')},
+            format='multipart'
+        )
+
+    def stored_files(self) -> list:
+        return os.listdir(os.path.join(self.media_root, 'documents'))
+
+    def test_identical_bytes_return_the_existing_document(self):
+        first = self.upload('alpha.txt', b'alpha particles ' * 40)
+        self.assertEqual(first.status_code, 202)
+
+        duplicate = self.upload('alpha copy.txt', b'alpha particles ' * 40)
+        self.assertEqual(duplicate.status_code, 200)
+        self.assertTrue(duplicate.data['duplicate'])
+        self.assertEqual(duplicate.data['document']['id'], first.data['document']['id'])
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertEqual(IngestionJob.objects.count(), 1)
+        self.assertEqual(self.stored_files(), ['alpha.txt'])
+
+        self.assertEqual(self.upload('beta.txt', b'beta decay ' * 40).status_code, 202)
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_bytes_of_a_failed_document_are_accepted_again(self):
+        first = self.upload('alpha.txt', b'alpha particles ' * 40)
+        Document.objects.filter(pk=first.data['document']['id']).update(status='failed')
+
+        retry = self.upload('alpha.txt', b'alpha particles ' * 40)
+        self.assertEqual(retry.status_code, 202)
+        self.assertNotEqual(retry.data['document']['id'], first.data['document']['id'])
+
+class BulkCreateChunksTests(TestCase):
+
+    def setUp(self):
+        self.document = Document.objects.create(
+            filename='alpha.txt', file_path='documents/alpha.txt', file_size=1, content_type='text/plain'
+        )
+
+    def chunks(self, count: int):
+        for i in range(count):
+            yield {'content': f'chunk {i}', 'chunk_index': i, 'start_char': 10 * i, 'end_char': 10 * i + 7,
+                   'page_number': i // 50 + 1, 'embedding_id': str(i)}
+
+    def test_one_insert_per_batch(self):
+        with self.assertNumQueries(3):
+            created = bulk_create_chunks(self.document, self.chunks(120), batch_size=50)
+        self.assertEqual(created, 120)
+
+        rows = DocumentChunk.objects.filter(document=self.document)
+        self.assertEqual(rows.count(), 120)
+        self.assertEqual(list(rows.values_list('chunk_index', flat=True)), list(range(120)))
+        last = rows.last()
+        self.assertEqual((last.content, last.page_number, last.end_char, last.embedding_id), ('chunk 119', 3, 1197, '119'))
+
+    def test_no_chunks_inserts_nothing(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(bulk_create_chunks(self.document, iter([])), 0)
+
+class EmbeddingModelRegistryTests(SimpleTestCase):
+
+    class FakeModel:
+        max_seq_length = 128
+
+        def __init__(self, model_name, **kwargs):
+            self.model_name = model_name
+
+        def parameters(self):
+            return [SimpleNamespace(numel=lambda: 10, element_size=lambda: 4)]
+
+        def get_sentence_embedding_dimension(self):
+            return 64
+
+    def setUp(self):
+        patcher = mock.patch('rag_service.embedding_models.SentenceTransformer', side_effect=self.FakeModel)
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = EmbeddingModelRegistry()
+
+    def test_each_model_is_loaded_once_and_shared(self):
+        model = self.registry.get('model-a')
+        self.assertIs(self.registry.get('model-a'), model)
+        self.assertIs(self.registry.langchain_embeddings('model-a').client, model)
+        self.assertIsNot(self.registry.get('model-b'), model)
+        self.assertEqual([call.args[0] for call in self.load.call_args_list], ['model-a', 'model-b'])
+        self.assertEqual(self.registry.stats()['model-a']['parameter_bytes'], 40)
+
+    def test_concurrent_first_use_loads_one_instance(self):
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(self.registry.get('model-a'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(models), 8)
+        self.assertTrue(all(model is models[0] for model in models))
+        self.assertEqual(self.load.call_count, 1)
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    """The first batch is held in encode until the other callers have queued up behind it"""
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.batcher = EmbeddingBatcher(self.encode, max_batch_size=32, max_wait_ms=50)
+        self.results = {}
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        if len(self.batches) == 1:
+            self.release.wait(10)
+        if 'fail' in texts:
+            raise ValueError('model crashed')
+        return np.array([[float(text)] for text in texts], dtype='float32')
+
+    def call(self, texts):
+        try:
+            self.results[tuple(texts)] = self.batcher.encode(texts)
+        except ValueError as e:
+            self.results[tuple(texts)] = e
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def run_callers(self, first, others):
+        threads = [threading.Thread(target=self.call, args=(first,))]
+        threads[0].start()
+        self.wait_for(lambda: len(self.batches) == 1)
+        threads += [threading.Thread(target=self.call, args=(texts,)) for texts in others]
+        for thread in threads[1:]:
+            thread.start()
+        self.wait_for(lambda: self.batcher._queue.qsize() == len(others))
+        self.release.set()
+        for thread in threads:
+            thread.join(10)
+
+    def test_concurrent_callers_share_one_batch_and_get_their_own_rows(self):
+        others = [[str(10 * i), str(10 * i + 1)] for i in range(1, 5)]
+        self.run_callers(['1'], others)
+
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual(sorted(self.batches[1], key=float), [text for texts in others for text in texts])
+        for texts in [['1']] + others:
+            np.testing.assert_array_equal(self.results[tuple(texts)], [[float(text)] for text in texts])
+        self.assertEqual(self.batcher.stats()['requests'], 5)
+
+    def test_encode_errors_reach_every_caller_in_the_batch(self):
+        self.run_callers(['1'], [['2'], ['fail']])
+
+        np.testing.assert_array_equal(self.results[('1',)], [[1.0]])
+        self.assertIsInstance(self.results[('2',)], ValueError)
+        self.assertIsInstance(self.results[('fail',)], ValueError)
+        # The worker thread keeps serving later calls
+        np.testing.assert_array_equal(self.batcher.encode(['3']), [[3.0]])
+
+class StreamingChatTests(VectorStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self.open_store()
+        self.alpha = self.write_file('alpha.txt', 'alpha particles ' * 40)
+        self.store.add_documents([self.alpha])
+
+        async def astream_answer(question, source_documents):
+            for token in ['Helium', ' nuclei', '.']:
+                yield token
+
+        self.rag_chain = mock.Mock(astream_answer=astream_answer)
+        self.rag_chain.retrieve.side_effect = lambda question, k, **kwargs: (
+            self.store.similarity_search(question, k=k), {'reranked': False}
+        )
+        for patcher in (
+            mock.patch.dict(os.environ, {'OPENAI_API_KEY': 'test-key'}),
+            mock.patch('rag_service.views.get_vector_store', return_value=self.store),
+            mock.patch('rag_service.views.get_rag_chain', return_value=self.rag_chain),
+            mock.patch('rag_service.views.get_answer_cache', return_value=SemanticAnswerCache())
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    async def read(streaming_content) -> list:
+        # The events are an async generator, as served through ai_chat_backend.asgi
+        return [chunk async for chunk in streaming_content]
+
+    def stream(self) -> list:
+        response = APIClient().post(
+            reverse('rag_chat_stream'), {'message': 'What are alpha particles?', 'num_context_docs': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(async_to_sync(self.read)(response.streaming_content)).decode('utf-8')
+        events = [event[len('data: '):] for event in body.split('\n\n') if event]
+        self.assertEqual(events[-1], '[DONE]')
+        return [json.loads(event) for event in events[:-1]]
+
+    def test_sources_are_sent_before_the_answer_tokens(self):
+        events = self.stream()
+        self.assertEqual([source['metadata']['source'] for source in events[0]['sources']], [self.alpha])
+        self.assertFalse(events[0]['cached'])
+        self.assertEqual([event['content'] for event in events[1:]], ['Helium', ' nuclei', '.'])
+
+    def test_cached_answer_follows_the_sources_in_one_event(self):
+        self.stream()
+        events = self.stream()
+        self.assertTrue(events[0]['cached'])
+        self.assertEqual([source['metadata']['source'] for source in events[0]['sources']], [self.alpha])
+        self.assertEqual([event['content'] for event in events[1:]], ['Helium nuclei.'])
+        self.assertEqual(self.rag_chain.retrieve.call_count, 1)
+
+class CrossEncoderRerankerTests(SimpleTestCase):
+    """A fake cross-encoder on a fake clock: 10ms per pair, scoring passages by how often they contain the query"""
+
+    def setUp(self):
+        self.clock = 0.0
+        test = self
+
+        class FakeCrossEncoder:
+            def __init__(self, model_name):
+                self.model_name = model_name
+
+            def predict(self, pairs, batch_size, show_progress_bar):
+                test.clock += 0.01 * len(pairs)
+                return [passage.count(query) for query, passage in pairs]
+
+        for patcher in (
+            mock.patch('rag_service.reranker.CrossEncoder', FakeCrossEncoder),
+            mock.patch('rag_service.reranker.time', SimpleNamespace(perf_counter=lambda: self.clock))
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.reranker = CrossEncoderReranker('fake-cross-encoder', max_candidates=20, batch_size=2)
+        self.documents = [
+            SimpleNamespace(page_content=text)
+            for text in ['beta decay', 'alpha alpha alpha', 'alpha beta', 'gamma rays', 'alpha alpha']
+        ]
+
+    def test_documents_are_ordered_by_cross_encoder_score(self):
+        documents, info = self.reranker.rerank('alpha', self.documents, 3, budget_seconds=1.0)
+        self.assertEqual([document.page_content for document in documents],
+                         ['alpha alpha alpha', 'alpha alpha', 'alpha beta'])
+        self.assertEqual(info, {'reranked': True, 'pairs_scored': 5, 'budget_exceeded': False})
+
+    def test_vector_order_is_kept_when_scoring_would_overrun_the_budget(self):
+        # The first batch of 2 pairs fits in 30ms, the second would not
+        documents, info = self.reranker.rerank('alpha', self.documents, 3, budget_seconds=0.03)
+        self.assertEqual(documents, self.documents[:3])
+        self.assertEqual(info, {'reranked': False, 'pairs_scored': 2, 'budget_exceeded': True})
+
+    def test_candidate_depth_fits_the_budget(self):
+        self.assertAlmostEqual(self.reranker.pair_seconds, 0.01)
+        self.assertEqual(self.reranker.candidate_depth(4, budget_seconds=0.105), 10)
+        self.assertEqual(self.reranker.candidate_depth(4, budget_seconds=1.0), 20)
+        self.assertEqual(self.reranker.candidate_depth(4, budget_seconds=0.01), 4)
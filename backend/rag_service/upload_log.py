@@ -0,0 +1,70 @@
+"""
+Upload Log
+Append-only log of pickled upload records, used to persist new chunks
+without rewriting the whole docstore on every upload
+"""
+import os
+import pickle
+import struct
+import logging
+from typing import Any, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<Q')  # Length prefix of each record
+
+class UploadLog:
+    """Length-prefixed pickle records appended to a single file"""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def identity(self) -> int:
+        """Inode of the log file; it changes whenever the log is compacted"""
+        return os.stat(self.path).st_ino if os.path.exists(self.path) else 0
+
+    def append(self, record: Any):
+        """Append one record and flush it to disk"""
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(_HEADER.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, offset: int = 0) -> Iterator[Tuple[int, Any]]:
+        """Yield (end offset, record) for every complete record after offset"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                (length,) = _HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    logger.warning(f"Ignoring incomplete record at the end of {self.path}")
+                    return
+                # Safe in controlled environment, the log is only written by this service
+                yield f.tell(), pickle.loads(data)
+
+    def drop_prefix(self, offset: int):
+        """Remove every record before offset, keeping anything appended after it"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            remainder = f.read()
+        with open(f"{self.path}.tmp", 'wb') as f:
+            f.write(remainder)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def clear(self):
+        """Remove the log"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -12,9 +12,12 @@ urlpatterns = [
     
     # Custom endpoints
     path('upload/', views.upload_document, name='upload_document'),
+    path('upload/<uuid:pk>/status/', views.upload_status, name='upload_status'),
     path('status/', views.rag_status, name='rag_status'),
     path('search/', views.search_documents, name='search_documents'),
+    path('search/batch/', views.batch_search_documents, name='batch_search_documents'),
     path('chat/', views.rag_chat, name='rag_chat'),
+    path('chat/stream/', views.rag_chat_stream, name='rag_chat_stream'),
     path('clear/', views.clear_vector_store, name='clear_vector_store'),
     path('file/<uuid:pk>/', views.get_document_file, name='get_document_file'),
     path('csrf/', views.get_csrf_token, name='get_csrf_token'),
@@ -0,0 +1,618 @@
+"""
+FAISS Vector Store Service
+Handles document embeddings and similarity search
+"""
+import os
+import json
+import pickle
+import logging
+import threading
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from pathlib import Path
+
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
+    np = None
+    SentenceTransformer = None
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Document, DocumentChunk, VectorStore as VectorStoreModel
+from .document_processor import DocumentProcessor
+from . import index_factory
+from . import raw_vectors
+from . import chunk_store
+from .embedding_cache import embed_chunks, get_chunk_embedding_cache, get_query_embedding_cache
+from .embedding_batcher import batched_encoder, batcher_stats
+from .ingestion import index_read_only
+from .embedding_models import get_embedding_model, get_embedding_model_registry
+
+logger = logging.getLogger(__name__)
+
+def bulk_create_chunks(document: Document, chunks: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+    """Insert DocumentChunk rows for a document, batch_size rows per INSERT.
+    
+    Chunks are consumed lazily, so only one batch of model instances exists at a
+    time. Call inside transaction.atomic() to commit them together.
+    """
+    chunks = iter(chunks)
+    created = 0
+    while True:
+        rows = [
+            DocumentChunk(
+                document=document,
+                content=chunk['content'],
+                chunk_index=chunk['chunk_index'],
+                page_number=chunk.get('page_number'),
+                start_char=chunk['start_char'],
+                end_char=chunk['end_char'],
+                embedding_id=chunk.get('embedding_id', '')
+            )
+            for chunk in islice(chunks, batch_size)
+        ]
+        if not rows:
+            return created
+        DocumentChunk.objects.bulk_create(rows, batch_size=batch_size)
+        created += len(rows)
+
+class VectorStoreService:
+    """FAISS vector store for document embeddings and similarity search"""
+    
+    def __init__(self, embedding_model_name: Optional[str] = None):
+        if SentenceTransformer is None:
+            raise ImportError("sentence-transformers is required for embeddings")
+        if faiss is None:
+            raise ImportError("faiss-cpu is required for vector storage")
+        if np is None:
+            raise ImportError("numpy is required for vector operations")
+        
+        self.embedding_model_name = embedding_model_name or getattr(settings, 'EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+        
+        # The model is shared with the FAISS vector store through the registry
+        try:
+            self.embedding_model = get_embedding_model(self.embedding_model_name)
+        except Exception as e:
+            logger.warning(f"Failed to load {self.embedding_model_name}, falling back to simple model")
+            # Fallback to a simpler approach if the model loading fails
+            self.embedding_model_name = 'all-MiniLM-L6-v2'
+            self.embedding_model = get_embedding_model(self.embedding_model_name)
+        
+        self.dimension = self.embedding_model.get_sentence_embedding_dimension()
+        
+        self.index = None
+        self.documents = []  # Store document metadata
+        
+        self.index_path = getattr(settings, 'FAISS_INDEX_PATH', 'vector_store/faiss_index')
+        self.documents_path = f"{self.index_path}_documents.json"
+        self.metadata_path = f"{self.index_path}_metadata.pkl"  # Legacy pickle, converted on load
+        self.read_only = index_read_only()
+        self._loaded_mtime = None
+        
+        # Chunk data lives on disk keyed by FAISS id; searches only read the hits they return
+        self.chunks = chunk_store.ChunkStore(self.index_path, read_only=self.read_only)
+        
+        # Full-precision copies of the vectors, used to re-score compressed search results
+        self.raw_vectors = raw_vectors.RawVectorStore(f"{self.index_path}_vectors.f32", self.dimension)
+        self.rescore_factor = getattr(settings, 'FAISS_RESCORE_FACTOR', 4)
+        self._recall_cache = None
+        
+        # Uploads append to the raw vector / chunk files; the index is only rewritten by snapshots
+        self.snapshot_interval = getattr(settings, 'FAISS_SNAPSHOT_INTERVAL', 10000)
+        self._snapshot_ntotal = 0
+        self._snapshot_stale = False
+        self._index_mtime = None
+        self._lock = threading.RLock()
+        self._upload_lock = threading.Lock()
+        self._compaction_thread = None
+        
+        # Initialize or load existing index
+        self._initialize_index()
+    
+    def _initialize_index(self):
+        """Initialize or load existing FAISS index"""
+        try:
+            has_metadata = os.path.exists(self.documents_path) or os.path.exists(self.metadata_path)
+            if os.path.exists(f"{self.index_path}.faiss") and has_metadata:
+                self._load_index()
+                logger.info(f"Loaded existing FAISS index with {self.index.ntotal} vectors")
+            else:
+                self._create_new_index()
+                logger.info("Created new FAISS index")
+        except Exception as e:
+            logger.error(f"Error initializing FAISS index: {str(e)}")
+            self._create_new_index()
+    
+    def _create_new_index(self):
+        """Create a new FAISS index"""
+        # Inner product for cosine similarity; trained index types start flat until enough vectors exist
+        self.index = index_factory.create_initial_index(self.dimension, faiss.METRIC_INNER_PRODUCT)
+        self.documents = []
+        if self.read_only:
+            # Never touch the files owned by the writer process
+            return
+        self.chunks.clear()
+        self.raw_vectors.clear()
+        self._save_index()
+    
+    def _load_index(self):
+        """Load existing FAISS index from disk"""
+        try:
+            if self.read_only:
+                self._load_index_mmap()
+                return
+            
+            self.index = faiss.read_index(f"{self.index_path}.faiss")
+            index_factory.apply_search_params(self.index)
+            self._snapshot_ntotal = self.index.ntotal
+            self._sync_raw_vectors()
+            self._load_metadata()
+            self._replay_log()
+            
+            # Move an existing index (e.g. flat) to the configured type
+            if self._maybe_migrate_index():
+                self._save_index()
+        except Exception as e:
+            logger.error(f"Error loading FAISS index: {str(e)}")
+            self._create_new_index()
+    
+    def _load_metadata(self):
+        """Load document metadata, converting a legacy pickle into the chunk store"""
+        if os.path.exists(self.documents_path):
+            with open(self.documents_path, 'r', encoding='utf-8') as f:
+                self.documents = json.load(f)['documents']
+            return
+        
+        with open(self.metadata_path, 'rb') as f:
+            # Enable dangerous deserialization in controlled environment
+            # This is safe since we control the source of the pickle files
+            metadata = pickle.load(f)
+        self.documents = metadata.get('documents', [])
+        
+        if self.read_only:
+            logger.warning("Chunk store not written yet, serving chunk metadata from the legacy pickle")
+            self.chunks = metadata.get('chunks', [])
+            return
+        
+        self.chunks.clear()
+        self.chunks.append(metadata.get('chunks', []))
+        self._save_documents()
+        logger.info(f"Converted {len(self.chunks)} pickled chunks to the chunk store")
+    
+    def _load_index_mmap(self):
+        """Load the index and chunk metadata read-only through mmap.
+        
+        Every worker maps the same files, so they share one copy in the page
+        cache instead of each holding the index and all chunk text on its heap.
+        """
+        # The documents file is rewritten last by every upload, so its mtime marks a complete save
+        self._loaded_mtime = os.path.getmtime(self.documents_path) if os.path.exists(self.documents_path) else None
+        self._index_mtime = os.path.getmtime(f"{self.index_path}.faiss")
+        
+        # Vectors appended after this snapshot are searched exactly from the raw vector file
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+        self.index = faiss.read_index(f"{self.index_path}.faiss", flags)
+        index_factory.apply_search_params(self.index)
+        
+        self.chunks = chunk_store.ChunkStore(self.index_path, read_only=True)
+        self._load_metadata()
+        
+        logger.info(f"Opened FAISS index read-only with {self.index.ntotal} vectors")
+    
+    def _reload_if_stale(self):
+        """Pick up uploads and snapshots written by the writer process"""
+        try:
+            index_mtime = os.path.getmtime(f"{self.index_path}.faiss")
+            mtime = os.path.getmtime(self.documents_path)
+        except OSError:
+            return
+        
+        if index_mtime != self._index_mtime:
+            logger.info("FAISS snapshot changed on disk, reopening read-only copy")
+            self._load_index()
+        elif mtime != self._loaded_mtime:
+            # New uploads only appended to the logs; just refresh document metadata
+            self._loaded_mtime = mtime
+            self._load_metadata()
+    
+    def _replay_log(self):
+        """Bring the loaded snapshot up to date with uploads appended since it was written.
+        
+        Every upload appends raw vectors, then chunk rows, then rewrites the documents
+        file; anything past the last committed document is from an interrupted upload
+        and is dropped.
+        """
+        committed = int(np.searchsorted(self.chunks.column('document_id'), len(self.documents)))
+        if len(self.raw_vectors) >= self.index.ntotal:
+            committed = min(committed, len(self.raw_vectors))
+            self.raw_vectors.truncate(committed)
+        self.chunks.truncate(committed)
+        
+        if len(self.raw_vectors) > self.index.ntotal:
+            replayed = len(self.raw_vectors) - self.index.ntotal
+            self.index.add(self.raw_vectors.get(np.arange(self.index.ntotal, len(self.raw_vectors))))
+            logger.info(f"Replayed {replayed} vectors appended since the last snapshot")
+    
+    def _sync_raw_vectors(self):
+        """Rebuild the raw vector file for indices saved before it existed"""
+        if len(self.raw_vectors) >= self.index.ntotal:
+            return
+        if index_factory.storage_mode_of(self.index) == 'float':
+            self.raw_vectors.rewrite(index_factory.reconstruct_vectors(self.index))
+        else:
+            logger.warning("Raw vectors do not match the compressed index, exact re-scoring disabled")
+    
+    def _rescore_vectors(self) -> Optional[raw_vectors.RawVectorStore]:
+        """Raw vectors to re-score with, if the index is compressed and they are in sync"""
+        if index_factory.storage_mode_of(self.index) == 'float':
+            return None
+        if len(self.raw_vectors) < self.index.ntotal:
+            return None
+        return self.raw_vectors
+    
+    def _index_vectors(self, start: int, end: int) -> 'np.ndarray':
+        """Vectors at positions start..end-1, from the raw vector file when it matches the index"""
+        if len(self.raw_vectors) == self.index.ntotal:
+            return self.raw_vectors.all()[start:end]
+        return index_factory.reconstruct_vectors(self.index, start, end)
+    
+    def _maybe_migrate_index(self) -> bool:
+        """Swap in the configured index type once it can be trained.
+        
+        Training runs without the lock so compaction and the next upload are
+        not held up; vectors added in the meantime are added to the new index
+        before it is swapped in.
+        """
+        with self._lock:
+            index = self.index
+            ntotal = index.ntotal
+            target = index_factory.migration_target(index)
+            if target is None:
+                return False
+            vectors = self._index_vectors(0, ntotal)
+        
+        logger.info(f"Migrating FAISS index from {index_factory.index_type_of(index)} to {target[0]}/{target[1]} ({ntotal} vectors)")
+        migrated = index_factory.build_index(vectors, index.d, target[0], index.metric_type, target[1])
+        
+        with self._lock:
+            if self.index is not index:
+                # Cleared or reloaded while training, so the positions no longer match
+                return False
+            if index.ntotal > ntotal:
+                migrated.add(np.ascontiguousarray(self._index_vectors(ntotal, index.ntotal), dtype='float32'))
+            self.index = migrated
+            self._recall_cache = None
+            self._snapshot_stale = True
+        logger.info(f"Migrated FAISS index to {index_factory.index_type_of(migrated)}")
+        return True
+    
+    def _save_index(self):
+        """Save a full snapshot of the FAISS index and the document metadata"""
+        try:
+            with self._lock:
+                self._write_snapshot(faiss.serialize_index(self.index), self.index.ntotal)
+                self._snapshot_stale = False
+                self._save_documents()
+        except Exception as e:
+            logger.error(f"Error saving FAISS index: {str(e)}")
+            raise
+    
+    def _write_snapshot(self, data: 'np.ndarray', ntotal: int):
+        """Write a serialized index; write then rename so read-only workers never map a partial file"""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        data.tofile(f"{self.index_path}.faiss.tmp")
+        os.replace(f"{self.index_path}.faiss.tmp", f"{self.index_path}.faiss")
+        self._snapshot_ntotal = ntotal
+        logger.info(f"Saved FAISS index snapshot with {ntotal} vectors")
+    
+    def _maybe_compact(self):
+        """Snapshot the index in the background once enough vectors were appended since the last one"""
+        pending = self.index.ntotal - self._snapshot_ntotal
+        if pending < self.snapshot_interval and not self._snapshot_stale:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        
+        self._compaction_thread = threading.Thread(target=self._compact, name='faiss-compaction', daemon=True)
+        self._compaction_thread.start()
+    
+    def _compact(self):
+        """Fold the appended vectors into a new index snapshot"""
+        try:
+            # Serializing is a memory copy; only that part has to exclude concurrent uploads
+            with self._lock:
+                index = self.index
+                data = faiss.serialize_index(index)
+                ntotal = index.ntotal
+            self._write_snapshot(data, ntotal)
+            with self._lock:
+                if self.index is index:
+                    self._snapshot_stale = False
+        except Exception as e:
+            logger.error(f"Error compacting FAISS index: {str(e)}")
+    
+    def _save_documents(self):
+        """Write document metadata; written last, its mtime marks a complete save"""
+        metadata = {
+            'documents': self.documents,
+            'embedding_model': self.embedding_model_name,
+            'dimension': self.dimension
+        }
+        with open(f"{self.documents_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        os.replace(f"{self.documents_path}.tmp", self.documents_path)
+    
+    def add_document(self, file_path: str) -> Dict[str, Any]:
+        """Process and add a document to the vector store"""
+        if self.read_only:
+            return {
+                'status': 'failed',
+                'error': 'Vector store is opened read-only (FAISS_MMAP_READONLY / INGESTION_WORKER_MMAP_READONLY)'
+            }
+        
+        # Chunks are cut by the model's own tokenizer so none is truncated by the encoder
+        processor = DocumentProcessor.for_model(
+            self.embedding_model,
+            chunk_size=getattr(settings, 'CHUNK_SIZE', 256),
+            chunk_overlap=getattr(settings, 'CHUNK_OVERLAP', 32),
+            pdf_workers=getattr(settings, 'PDF_EXTRACTION_WORKERS', None),
+            pdf_pages_per_task=getattr(settings, 'PDF_EXTRACTION_PAGES_PER_TASK', 20)
+        )
+        batch_size = getattr(settings, 'EMBEDDING_BATCH_SIZE', 64)
+        
+        try:
+            # One streamed upload at a time, so its chunk rows and vectors stay contiguous
+            with self._upload_lock:
+                document_info, page_numbers = self._append_document(
+                    file_path, processor.iter_chunk_batches(file_path, batch_size)
+                )
+            doc_id = document_info['id']
+            self._maybe_migrate_index()
+            self._maybe_compact()
+            
+            # Update database models
+            self._update_database_models(document_info, page_numbers)
+            
+            return {
+                'status': 'completed',
+                'document_id': doc_id,
+                'filename': document_info['filename'],
+                'total_chunks': document_info['total_chunks'],
+                'total_vectors': self.index.ntotal
+            }
+            
+        except Exception as e:
+            logger.error(f"Error adding document to vector store: {str(e)}")
+            return {
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    def _append_document(self, file_path: str, batches) -> Tuple[Dict[str, Any], List[Optional[int]]]:
+        """Embed a streamed document batch by batch and append it to the on-disk log.
+        
+        Each batch appends its raw vectors and chunk rows; adding the vectors to the
+        index and rewriting the documents file then commits the upload. Replay drops
+        rows of an upload that never committed. The FAISS index itself is only
+        written by snapshots, so this costs O(new chunks), not O(corpus).
+        """
+        doc_id = len(self.documents)
+        first_chunk = len(self.chunks)
+        first_vector = len(self.raw_vectors)
+        embeddings = []
+        page_numbers = []
+        text_length = 0
+        
+        try:
+            for batch in batches:
+                # Chunks whose text was embedded before (e.g. re-uploads, revisions) come from the cache
+                vectors = embed_chunks(
+                    f"{self.embedding_model_name}/normalized", [chunk['content'] for chunk in batch],
+                    lambda texts: self.embedding_model.encode(texts, normalize_embeddings=True)
+                )
+                with self._lock:
+                    self.raw_vectors.append(vectors)
+                    # The chunk store assigns ids in FAISS order
+                    self.chunks.append([
+                        {
+                            'document_id': doc_id,
+                            'chunk_index': chunk['chunk_index'],
+                            'content': chunk['content'],
+                            'start_char': chunk['start_char'],
+                            'end_char': chunk['end_char']
+                        }
+                        for chunk in batch
+                    ])
+                embeddings.append(np.asarray(vectors, dtype='float32'))
+                page_numbers.extend(chunk['page_number'] for chunk in batch)
+                text_length = batch[-1]['end_char']
+        except Exception:
+            with self._lock:
+                self.raw_vectors.truncate(first_vector)
+                self.chunks.truncate(first_chunk)
+            raise
+        
+        document_info = {
+            'id': doc_id,
+            'filename': os.path.basename(file_path),
+            'file_path': file_path,
+            'file_size': os.path.getsize(file_path),
+            'text_length': text_length,
+            'total_chunks': len(page_numbers),
+            'first_chunk': first_chunk,
+            'embedding_model': self.embedding_model_name
+        }
+        
+        with self._lock:
+            if embeddings:
+                self.index.add(np.vstack(embeddings))
+            self.documents.append(document_info)
+            self._save_documents()
+        return document_info, page_numbers
+    
+    def _update_database_models(self, document_info: Dict, page_numbers: List[Optional[int]]):
+        """Update Django models with document and chunk information.
+        
+        One transaction: on SQLite that is one commit (and fsync) per document
+        instead of one per chunk.
+        """
+        try:
+            with transaction.atomic():
+                # Create or update Document model
+                document = Document.objects.create(
+                    filename=document_info['filename'],
+                    file_path=document_info['file_path'],
+                    file_size=document_info['file_size'],
+                    content_type='application/octet-stream',  # Will be improved later
+                    status='completed',
+                    total_chunks=document_info['total_chunks'],
+                    embedding_model=document_info['embedding_model']
+                )
+                
+                # Create DocumentChunk models, reading the chunks back from the chunk store
+                first_chunk = document_info['first_chunk']
+                chunks = (
+                    dict(self.chunks[chunk_id], page_number=page_number, embedding_id=str(chunk_id))
+                    for chunk_id, page_number in enumerate(page_numbers, first_chunk)
+                )
+                bulk_create_chunks(document, chunks, batch_size=getattr(settings, 'DB_BULK_BATCH_SIZE', 1000))
+                
+                # Update or create VectorStore model; the counter is incremented in SQL, not read-modify-write
+                vector_store, created = VectorStoreModel.objects.get_or_create(
+                    name='default',
+                    defaults={
+                        'index_path': self.index_path,
+                        'embedding_model': self.embedding_model_name,
+                        'dimension': self.dimension
+                    }
+                )
+                VectorStoreModel.objects.filter(pk=vector_store.pk).update(
+                    total_vectors=F('total_vectors') + len(page_numbers), updated_at=timezone.now()
+                )
+            
+        except Exception as e:
+            logger.error(f"Error updating database models: {str(e)}")
+    
+    def similarity_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Perform similarity search"""
+        return self.batch_similarity_search([query], k)[0]
+    
+    def batch_similarity_search(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Perform similarity search for many queries with one encode pass and one index search"""
+        try:
+            if self.read_only:
+                self._reload_if_stale()
+            
+            if len(self.chunks) == 0:
+                return [[] for _ in queries]
+            
+            # Generate embeddings for all queries in one batch, skipping cached ones and
+            # sharing the forward pass with concurrent requests
+            namespace = f"{self.embedding_model_name}/normalized"
+            query_embeddings = get_query_embedding_cache().embed(
+                namespace, queries,
+                batched_encoder(namespace, lambda texts: self.embedding_model.encode(texts, normalize_embeddings=True))
+            )
+            
+            # Search in FAISS index
+            scores, indices = raw_vectors.search_with_tail(
+                self.index, self._rescore_vectors(), self.raw_vectors if self.read_only else None,
+                query_embeddings, k, self.rescore_factor
+            )
+            
+            # Prepare results
+            return [self._format_results(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
+        
+        except Exception as e:
+            logger.error(f"Error in similarity search: {str(e)}")
+            raise
+    
+    def _format_results(self, scores, indices) -> List[Dict[str, Any]]:
+        """Turn one row of index search results into chunk dicts"""
+        results = []
+        for score, idx in zip(scores, indices):
+            if idx >= 0 and idx < len(self.chunks):
+                chunk = self.chunks[idx]
+                if chunk['document_id'] >= len(self.documents):
+                    continue  # Upload still being written
+                document = self.documents[chunk['document_id']]
+                
+                results.append({
+                    'chunk_id': chunk['id'],
+                    'document_id': chunk['document_id'],
+                    'document_filename': document['filename'],
+                    'content': chunk['content'],
+                    'similarity_score': float(score),
+                    'chunk_index': chunk['chunk_index'],
+                    'start_char': chunk['start_char'],
+                    'end_char': chunk['end_char']
+                })
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get vector store statistics"""
+        try:
+            chunk_cache = get_chunk_embedding_cache()
+            return {
+                'total_vectors': self.index.ntotal if self.index else 0,
+                'total_documents': len(self.documents),
+                'total_chunks': len(self.chunks),
+                'dimension': self.dimension,
+                'embedding_model': self.embedding_model_name,
+                'index_path': self.index_path,
+                'read_only': self.read_only,
+                'index_type': index_factory.index_type_of(self.index) if self.index else None,
+                'configured_index_type': index_factory.get_index_type(),
+                'is_trained': self.index.is_trained if self.index else False,
+                'rescore_factor': self.rescore_factor if self._rescore_vectors() is not None else None,
+                **index_factory.memory_stats(self.index),
+                **self._recall_stats(),
+                'query_embedding_cache': get_query_embedding_cache().stats(),
+                'chunk_embedding_cache': chunk_cache.stats() if chunk_cache is not None else None,
+                'embedding_models': get_embedding_model_registry().stats(),
+                'query_embedding_batcher': batcher_stats()
+            }
+        except Exception as e:
+            logger.error(f"Error getting stats: {str(e)}")
+            return {'error': str(e)}
+    
+    def _recall_stats(self) -> Dict[str, Any]:
+        """Sampled recall of the current index, cached until the index changes"""
+        if self._recall_cache is None or self._recall_cache[0] != self.index.ntotal:
+            stats = raw_vectors.recall_stats(self.index, self.raw_vectors, self.rescore_factor)
+            self._recall_cache = (self.index.ntotal, stats)
+        return self._recall_cache[1]
+    
+    def clear_index(self):
+        """Clear the vector store"""
+        if self.read_only:
+            raise RuntimeError("Vector store is opened read-only (FAISS_MMAP_READONLY / INGESTION_WORKER_MMAP_READONLY)")
+        
+        try:
+            self._create_new_index()
+            
+            # Clear database models
+            DocumentChunk.objects.all().delete()
+            Document.objects.all().delete()
+            VectorStoreModel.objects.all().delete()
+            
+            logger.info("Cleared vector store and database")
+        except Exception as e:
+            logger.error(f"Error clearing vector store: {str(e)}")
+            raise
+
+# Global instance
+_vector_store_service = None
+
+def get_vector_store_service() -> VectorStoreService:
+    """Get or create the global vector store service instance"""
+    global _vector_store_service
+    if _vector_store_service is None:
+        _vector_store_service = VectorStoreService()
+    return _vector_store_service
@@ -35,7 +35,7 @@ def get_csrf_token(request):
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 
 from django.views.decorators.csrf import csrf_exempt
 
@@ -69,12 +69,17 @@ def get_document_file(request, pk):
                             deleted_files.append(fname)
                     except Exception as file_err:
                         errors.append(f"{fname}: {str(file_err)}")
+            # Remove the chunks of the deleted files from the vector store
+            try:
+                deleted_sources = [file_path] + [os.path.join(documents_dir, fname) for fname in deleted_files]
+                get_vector_store().delete_documents(deleted_sources)
+            except Exception as vs_err:
+                errors.append(f"Vector store error: {str(vs_err)}")
             # Delete Document object
             try:
                 doc.delete()
             except Exception as db_err:
                 errors.append(f"DB error: {str(db_err)}")
-            # Optionally: remove document chunks and update vector store here
             if errors:
                 return Response({'detail': f'File(s) deleted: {deleted_files}', 'errors': errors}, status=500)
             else:
@@ -89,16 +94,21 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.core.files.storage import default_storage
 from django.conf import settings
+from django.db import IntegrityError, transaction
 import os
+import json
+import hashlib
 import logging
 
-from .models import Document, DocumentChunk, VectorStore
+from .models import ACTIVE_STATUSES, Document, DocumentChunk, VectorStore, IngestionJob
 from .serializers import (
     DocumentSerializer, DocumentUploadSerializer, 
-    RAGSearchSerializer, RAGChatSerializer
+    RAGSearchSerializer, RAGBatchSearchSerializer, RAGChatSerializer
 )
 from .vector_store import get_vector_store_service
-from .faiss_rag import get_rag_chain, get_vector_store
+from .faiss_rag import get_rag_chain, get_vector_store, embed_queries
+from .answer_cache import get_answer_cache
+from .ingestion import clear_index, enqueue, ingest_document
 
 logger = logging.getLogger(__name__)
 
@@ -109,6 +119,21 @@ class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [AllowAny]
 
+def _content_hash(uploaded_file) -> str:
+    """SHA-256 of an uploaded file, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+def _duplicate_response(duplicate: Document) -> Response:
+    return Response({
+        'message': 'Document already uploaded',
+        'duplicate': True,
+        'document': DocumentSerializer(duplicate).data
+    }, status=status.HTTP_200_OK)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def upload_document(request):
@@ -120,27 +145,50 @@ def upload_document(request):
     
     try:
         uploaded_file = serializer.validated_data['file']
+        content_hash = _content_hash(uploaded_file)
+        
+        # Identical bytes are already indexed (or being indexed): skip storage and processing
+        duplicate = Document.objects.filter(content_hash=content_hash, status__in=ACTIVE_STATUSES).first()
+        if duplicate is not None:
+            return _duplicate_response(duplicate)
         
         # Save file to media directory
         file_path = default_storage.save(
             f"documents/{uploaded_file.name}",
             uploaded_file
         )
-        full_path = os.path.join(settings.MEDIA_ROOT, file_path)
+        
+        # Create the Document first so its id can be stored with the chunks for search filters
+        try:
+            with transaction.atomic():
+                doc = Document.objects.create(
+                    filename=uploaded_file.name,
+                    file_path=file_path,
+                    file_size=uploaded_file.size,
+                    content_type=uploaded_file.content_type,
+                    content_hash=content_hash,
+                    status='processing'
+                )
+        except IntegrityError:
+            # A concurrent upload of the same bytes was created first (unique_active_content_hash)
+            default_storage.delete(file_path)
+            duplicate = Document.objects.filter(content_hash=content_hash, status__in=ACTIVE_STATUSES).first()
+            if duplicate is None:
+                raise
+            return _duplicate_response(duplicate)
+        
+        # Hand the document to the ingestion workers; the client polls upload/<id>/status/
+        if getattr(settings, 'INGESTION_ASYNC', True):
+            job = enqueue(doc)
+            return Response({
+                'message': 'Document queued for processing',
+                'job_id': job.pk,
+                'status_url': f"{request.path.rstrip('/')}/{doc.pk}/status/",
+                'document': DocumentSerializer(doc).data
+            }, status=status.HTTP_202_ACCEPTED)
         
         # Process with the new FAISS vector store
-        vector_store = get_vector_store()
-        result = vector_store.add_documents([full_path])
-
-        # Create and save Document model instance
-        doc = Document.objects.create(
-            filename=uploaded_file.name,
-            file_path=file_path,
-            file_size=uploaded_file.size,
-            content_type=uploaded_file.content_type,
-            status='completed' if result['processed_files'] else 'failed',
-            processing_error='' if result['processed_files'] else str(result)
-        )
+        result = ingest_document(doc)
 
         if result['processed_files']:
             return Response({
@@ -161,6 +209,34 @@ def upload_document(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def upload_status(request, pk):
+    """Get the processing status of an uploaded document"""
+    
+    try:
+        doc = Document.objects.get(pk=pk)
+    except Document.DoesNotExist:
+        return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    job = doc.ingestion_jobs.order_by('-created_at').first()
+    return Response({
+        'document_id': str(doc.pk),
+        'status': doc.status,
+        'processing_error': doc.processing_error,
+        'total_chunks': doc.total_chunks,
+        'job': {
+            'id': job.pk,
+            'status': job.status,
+            'attempts': job.attempts,
+            'error': job.error,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at
+        } if job is not None else None,
+        'queued_jobs': IngestionJob.objects.filter(status='queued').count()
+    })
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def rag_status(request):
@@ -182,6 +258,7 @@ def rag_status(request):
         
         # Check LLM configuration
         openai_configured = bool(os.getenv('OPENAI_API_KEY'))
+        answer_cache = get_answer_cache()
         
         return Response({
             'status': 'operational',
@@ -192,6 +269,7 @@ def rag_status(request):
                 'vector_stores': vector_stores
             },
             'vector_store_statistics': vector_stats,
+            'answer_cache': answer_cache.stats() if answer_cache is not None else {'enabled': False},
             'llm_configuration': {
                 'openai_api_key_configured': openai_configured,
                 'available_providers': ['openai'] if openai_configured else []
@@ -224,10 +302,12 @@ def search_documents(request):
     try:
         query = serializer.validated_data['query']
         num_results = serializer.validated_data['num_results']
+        mode = serializer.validated_data['mode']
+        filters = serializer.get_search_filters()
         
-        # Perform vector search using new FAISS implementation
+        # Perform vector, keyword (BM25) or hybrid search using new FAISS implementation
         vector_store = get_vector_store()
-        results = vector_store.similarity_search(query, k=num_results)
+        results = vector_store.similarity_search(query, k=num_results, filters=filters, mode=mode)
         
         # Format results
         formatted_results = [
@@ -241,6 +321,8 @@ def search_documents(request):
         
         return Response({
             'query': query,
+            'mode': mode,
+            'filters': filters,
             'results': formatted_results,
             'total_results': len(formatted_results)
         })
@@ -252,6 +334,50 @@ def search_documents(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def batch_search_documents(request):
+    """Search documents for many queries at once, encoding and searching them as one batch"""
+    
+    serializer = RAGBatchSearchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        queries = serializer.validated_data['queries']
+        num_results = serializer.validated_data['num_results']
+        filters = serializer.get_search_filters()
+        
+        vector_store = get_vector_store()
+        batch_results = vector_store.batch_similarity_search(queries, k=num_results, filters=filters)
+        
+        return Response({
+            'filters': filters,
+            'results': [
+                {
+                    'query': query,
+                    'results': [
+                        {
+                            'content': doc.page_content,
+                            'metadata': doc.metadata,
+                            'similarity_score': score
+                        }
+                        for doc, score in results
+                    ],
+                    'total_results': len(results)
+                }
+                for query, results in zip(queries, batch_results)
+            ],
+            'total_queries': len(queries)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in batch search: {str(e)}")
+        return Response(
+            {'error': 'Batch search failed', 'details': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def rag_chat(request):
@@ -266,12 +392,17 @@ def rag_chat(request):
         conversation_id = serializer.validated_data.get('conversation_id')
         num_context_docs = serializer.validated_data['num_context_docs']
         similarity_threshold = serializer.validated_data.get('similarity_threshold', 0.0)
+        filters = serializer.get_search_filters()
+        rerank = serializer.validated_data.get('rerank')
+        if rerank is None:
+            rerank = getattr(settings, 'RERANK_BY_DEFAULT', False)
+        rerank_budget_ms = serializer.validated_data.get('rerank_budget_ms')
         
         # Check if OpenAI API key is configured
         if not os.getenv('OPENAI_API_KEY'):
             # Fallback to context-only response if no LLM configured
             vector_store = get_vector_store()
-            context_docs = vector_store.similarity_search(message, k=num_context_docs)
+            context_docs = vector_store.similarity_search(message, k=num_context_docs, filters=filters)
             
             # Filter by similarity threshold if provided
             if similarity_threshold > 0:
@@ -318,8 +449,35 @@ Note: OpenAI API key not configured. Configure OpenAI API key for full LLM-power
         
         # Use full RAG chain with LLM
         try:
+            # Reuse the answer to a near-identical question asked against the same index version
+            answer_cache = get_answer_cache()
+            if answer_cache is not None:
+                vector_store = get_vector_store()
+                query_embedding = embed_queries(vector_store.embedding_model, [message])[0]
+                cache_scope = answer_cache.scope_key(filters=filters, num_context_docs=num_context_docs, rerank=rerank)
+                index_version = vector_store.index_version()
+                cached = answer_cache.get(query_embedding, cache_scope, index_version)
+                if cached is not None:
+                    result, cache_similarity = cached
+                    return Response({
+                        'message': message,
+                        'response': result['answer'],
+                        'conversation_id': conversation_id or 'new_conversation',
+                        'context_documents': result['source_documents'],
+                        'num_context_docs_found': len(result['source_documents']),
+                        'similarity_threshold_used': similarity_threshold,
+                        'llm_used': True,
+                        'llm_provider': 'openai',
+                        'cached': True,
+                        'cache_similarity': cache_similarity
+                    })
+            
             rag_chain = get_rag_chain(llm_provider="openai")
-            result = rag_chain.query(message)
+            result = rag_chain.query(
+                message, k=num_context_docs, filters=filters, rerank=rerank, time_budget_ms=rerank_budget_ms
+            )
+            if answer_cache is not None:
+                answer_cache.put(query_embedding, cache_scope, index_version, result)
             
             return Response({
                 'message': message,
@@ -329,7 +487,8 @@ Note: OpenAI API key not configured. Configure OpenAI API key for full LLM-power
                 'num_context_docs_found': len(result['source_documents']),
                 'similarity_threshold_used': similarity_threshold,
                 'llm_used': True,
-                'llm_provider': 'openai'
+                'llm_provider': 'openai',
+                'retrieval': result['retrieval']
             })
             
         except Exception as llm_error:
@@ -337,7 +496,7 @@ Note: OpenAI API key not configured. Configure OpenAI API key for full LLM-power
             
             # Fallback to context-only response
             vector_store = get_vector_store()
-            context_docs = vector_store.similarity_search(message, k=num_context_docs)
+            context_docs = vector_store.similarity_search(message, k=num_context_docs, filters=filters)
             
             return Response({
                 'message': message,
@@ -364,22 +523,121 @@ Note: OpenAI API key not configured. Configure OpenAI API key for full LLM-power
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _sse(payload) -> str:
+    """One Server-Sent Events message with a JSON payload, the format pages/api/chat-stream.ts uses"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def rag_chat_stream(request):
+    """Streaming rag_chat over Server-Sent Events.
+    
+    Sends {"sources": [...]} as soon as retrieval is done, then {"content": ...} for each LLM
+    token as the provider produces it, and a final [DONE]. Tokens are forwarded as they arrive
+    when served through ai_chat_backend.asgi; a WSGI server delivers the stream in one piece.
+    """
+    
+    serializer = RAGChatSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        message = serializer.validated_data['message']
+        conversation_id = serializer.validated_data.get('conversation_id')
+        num_context_docs = serializer.validated_data['num_context_docs']
+        filters = serializer.get_search_filters()
+        rerank = serializer.validated_data.get('rerank')
+        if rerank is None:
+            rerank = getattr(settings, 'RERANK_BY_DEFAULT', False)
+        llm_configured = bool(os.getenv('OPENAI_API_KEY'))
+        vector_store = get_vector_store()
+        
+        # Reuse the answer to a near-identical question asked against the same index version
+        answer_cache = get_answer_cache() if llm_configured else None
+        cached = None
+        if answer_cache is not None:
+            query_embedding = embed_queries(vector_store.embedding_model, [message])[0]
+            cache_scope = answer_cache.scope_key(filters=filters, num_context_docs=num_context_docs, rerank=rerank)
+            index_version = vector_store.index_version()
+            cached = answer_cache.get(query_embedding, cache_scope, index_version)
+        
+        rag_chain = get_rag_chain(llm_provider="openai") if llm_configured and cached is None else None
+        retrieval = None
+        if cached is not None:
+            sources = cached[0]['source_documents']
+        else:
+            if rag_chain is not None:
+                context_docs, retrieval = rag_chain.retrieve(
+                    message, k=num_context_docs, filters=filters, rerank=rerank,
+                    time_budget_ms=serializer.validated_data.get('rerank_budget_ms')
+                )
+            else:
+                context_docs = vector_store.similarity_search(message, k=num_context_docs, filters=filters)
+            sources = [{'content': doc.page_content, 'metadata': doc.metadata} for doc in context_docs]
+        
+    except Exception as e:
+        logger.error(f"Error in RAG chat stream: {str(e)}")
+        return Response(
+            {'error': 'Chat failed', 'details': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    async def events():
+        yield _sse({
+            'sources': sources,
+            'message': message,
+            'conversation_id': conversation_id or 'new_conversation',
+            'num_context_docs_found': len(sources),
+            'llm_used': llm_configured,
+            'llm_provider': 'openai' if llm_configured else None,
+            'cached': cached is not None,
+            'retrieval': retrieval
+        })
+        
+        if cached is not None:
+            yield _sse({'content': cached[0]['answer'], 'cache_similarity': cached[1]})
+        elif rag_chain is None:
+            yield _sse({'error': 'OpenAI API key not configured. Configure OpenAI API key for full LLM-powered responses.'})
+        else:
+            tokens = []
+            try:
+                async for token in rag_chain.astream_answer(message, context_docs):
+                    tokens.append(token)
+                    yield _sse({'content': token})
+            except Exception as e:
+                logger.error(f"Error streaming LLM answer: {str(e)}")
+                yield _sse({'error': f"LLM processing failed: {str(e)}"})
+            else:
+                if answer_cache is not None:
+                    answer_cache.put(query_embedding, cache_scope, index_version, {
+                        'answer': ''.join(tokens),
+                        'source_documents': sources,
+                        'question': message,
+                        'retrieval': retrieval
+                    })
+        yield 'data: [DONE]\n\n'
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep reverse proxies from buffering the stream
+    return response
+
 @api_view(['DELETE'])
 @permission_classes([AllowAny])
 def clear_vector_store(request):
     """Clear the vector store (for development/testing)"""
     try:
-        vector_store = get_vector_store()
-        
-        # Clear the FAISS index
-        if os.path.exists(settings.FAISS_INDEX_PATH):
-            import shutil
-            shutil.rmtree(settings.FAISS_INDEX_PATH)
+        # Only the process that writes the index may wipe it
+        if not clear_index():
+            return Response(
+                {'error': 'The index is written by another process (run_ingestion_worker); clear it while that process is stopped'},
+                status=status.HTTP_409_CONFLICT
+            )
         
-        # Reset global instances
-        from . import faiss_rag
-        faiss_rag._vector_store = None
-        faiss_rag._rag_chain = None
+        # Answers were built from the deleted documents
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.clear()
         
         return Response({
             'message': 'Vector store cleared successfully'
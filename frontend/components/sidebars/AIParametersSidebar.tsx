@@ -48,6 +48,10 @@ import {
   type LLMModel
 } from '../../lib/store/aiParamsSlice';
 
+// Status polling for queued uploads: every 2 seconds, for up to 10 minutes
+const UPLOAD_POLL_INTERVAL_MS = 2000;
+const UPLOAD_POLL_MAX_ATTEMPTS = 300;
+
 const AIParametersSidebar = () => {
   // ...existing code...
   // Modal state for file preview
@@ -156,7 +160,7 @@ const AIParametersSidebar = () => {
     ragSimilarityThreshold
   } = useAppSelector(state => state.aiParams);
 
-  const [uploadStatus, setUploadStatus] = useState<'idle' | 'uploading' | 'success' | 'error'>('idle');
+  const [uploadStatus, setUploadStatus] = useState<'idle' | 'uploading' | 'processing' | 'success' | 'error'>('idle');
   const [uploadMessage, setUploadMessage] = useState<string>('');
 
   const handleTemperatureChange = (value: number) => {
@@ -183,6 +187,35 @@ const AIParametersSidebar = () => {
     dispatch(setRagSimilarityThreshold(value));
   };
 
+  // Queued uploads are indexed in the background; poll their status URL until the job finishes
+  const waitForProcessing = async (statusUrl: string, filename: string) => {
+    const url = statusUrl.startsWith('http') ? statusUrl : `http://127.0.0.1:8000${statusUrl}`;
+    for (let attempt = 0; attempt < UPLOAD_POLL_MAX_ATTEMPTS; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, UPLOAD_POLL_INTERVAL_MS));
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error(`Status check failed (${response.status})`);
+      }
+      const result = await response.json();
+      if (result.status !== 'processing') {
+        return result;
+      }
+      setUploadMessage(
+        result.job?.status === 'queued'
+          ? `"${filename}" is queued for processing...`
+          : `Processing "${filename}"...`
+      );
+    }
+    return null;
+  };
+
+  const clearUploadStatusAfter = (delay: number) => {
+    setTimeout(() => {
+      setUploadStatus('idle');
+      setUploadMessage('');
+    }, delay);
+  };
+
   const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
     if (!file) return;
@@ -200,42 +233,60 @@ const AIParametersSidebar = () => {
       });
 
       if (response.ok) {
-        const result = await response.json();
+        let result = await response.json();
+        console.log('File uploaded:', result);
+
+        if (response.status === 202 && result.status_url) {
+          setUploadStatus('processing');
+          setUploadMessage(`"${file.name}" is queued for processing...`);
+          result = await waitForProcessing(result.status_url, file.name);
+          if (result === null) {
+            setUploadMessage(`"${file.name}" is still processing; check the Knowledge Base tab later.`);
+            clearUploadStatusAfter(8000);
+            return;
+          }
+          if (result.status !== 'completed') {
+            throw new Error(result.processing_error || result.job?.error || `Document ${result.status}`);
+          }
+        }
+
         setUploadStatus('success');
-        setUploadMessage(`Successfully uploaded "${file.name}" to knowledge base!`);
-        console.log('File uploaded successfully:', result);
-        
+        setUploadMessage(
+          result.duplicate
+            ? `"${file.name}" is already in the knowledge base.`
+            : `Successfully added "${file.name}" to the knowledge base` +
+              (result.total_chunks ? ` (${result.total_chunks} chunks).` : '!')
+        );
+        if (tabIndex === 1) {
+          fetchKbFiles();
+        }
+
         // Clear success message after 5 seconds
-        setTimeout(() => {
-          setUploadStatus('idle');
-          setUploadMessage('');
-        }, 5000);
+        clearUploadStatusAfter(5000);
       } else {
         const error = await response.json();
         setUploadStatus('error');
-        setUploadMessage(`Upload failed: ${error.message || 'Unknown error occurred'}`);
+        setUploadMessage(`Upload failed: ${error.message || error.error || 'Unknown error occurred'}`);
         console.error('Upload failed:', error);
-        
+
         // Clear error message after 8 seconds
-        setTimeout(() => {
-          setUploadStatus('idle');
-          setUploadMessage('');
-        }, 8000);
+        clearUploadStatusAfter(8000);
       }
     } catch (error) {
       setUploadStatus('error');
-      setUploadMessage('Upload failed: Network error or server unavailable');
+      setUploadMessage(
+        error instanceof TypeError
+          ? 'Upload failed: Network error or server unavailable'
+          : `Processing failed: ${error instanceof Error ? error.message : 'Unknown error occurred'}`
+      );
       console.error('Upload error:', error);
-      
+
       // Clear error message after 8 seconds
-      setTimeout(() => {
-        setUploadStatus('idle');
-        setUploadMessage('');
-      }, 8000);
+      clearUploadStatusAfter(8000);
+    } finally {
+      // Reset the input
+      event.target.value = '';
     }
-
-    // Reset the input
-    event.target.value = '';
   };
 
   const getProviderColor = (provider: string) => {
@@ -467,7 +518,7 @@ const AIParametersSidebar = () => {
                   variant="outlined"
                   startIcon={<CloudUpload />}
                   fullWidth
-                  disabled={uploadStatus === 'uploading'}
+                  disabled={uploadStatus === 'uploading' || uploadStatus === 'processing'}
                   sx={{ 
                     mb: 1,
                     textTransform: 'none',
@@ -483,13 +534,13 @@ const AIParametersSidebar = () => {
                     }
                   }}
                 >
-                  {uploadStatus === 'uploading' ? 'Uploading...' : 'Upload PDF'}
+                  {uploadStatus === 'uploading' ? 'Uploading...' : uploadStatus === 'processing' ? 'Processing...' : 'Upload PDF'}
                   <input
                     type="file"
                     accept=".pdf,.docx,.txt,.md"
                     onChange={handleFileUpload}
                     style={{ display: 'none' }}
-                    disabled={uploadStatus === 'uploading'}
+                    disabled={uploadStatus === 'uploading' || uploadStatus === 'processing'}
                   />
                 </Button>
                 {/* Upload Status Message */}
@@ -38,14 +38,18 @@ export const sendStreamingMessage = createAsyncThunk(
     });
     
     try {
-      // Check if this is a RAG query - RAG doesn't support streaming, fall back to regular message
-      if (payload.selectedModel.id === 'rag-faiss') {
-        console.log('🧠 RAG model detected, falling back to non-streaming');
-        // For RAG, we'll fall back to the regular sendMessage thunk
-        return await dispatch(sendMessage(payload)).unwrap();
+      // RAG queries stream from the Django RAG endpoint, with the sources sent before the answer
+      const isRag = payload.selectedModel.id === 'rag-faiss';
+      const userMessage = payload.messages[payload.messages.length - 1];
+      if (isRag && (!userMessage || userMessage.role !== 'user')) {
+        throw new Error('No user message found for RAG query');
       }
 
-      const input = {
+      const input = isRag ? {
+        message: userMessage.text,
+        num_context_docs: payload.ragNumContextDocs || 4,
+        similarity_threshold: payload.ragSimilarityThreshold || 0.0
+      } : {
         messages: payload.messages.map(msg => ({
           role: msg.role === 'ai' ? 'assistant' : msg.role,
           content: msg.text
@@ -57,15 +61,16 @@ export const sendStreamingMessage = createAsyncThunk(
         provider: payload.selectedModel.provider
       };
 
+      const streamUrl = isRag ? 'http://127.0.0.1:8000/api/rag/chat/stream/' : '/api/chat-stream';
       console.log('🌊 Starting streaming request to:', payload.selectedModel.provider);
-      console.log('📡 Sending to /api/chat-stream with input:', input);
+      console.log(`📡 Sending to ${streamUrl} with input:`, input);
 
       // Create initial AI message placeholder
       const messageId = Date.now().toString();
       console.log('📝 Created message ID:', messageId);
       dispatch(startStreamingMessage(messageId));
 
-      const response = await fetch('/api/chat-stream', {
+      const response = await fetch(streamUrl, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -86,6 +91,8 @@ export const sendStreamingMessage = createAsyncThunk(
 
       console.log('📖 Starting to read stream...');
       const decoder = new TextDecoder();
+      // Events can span network chunks (e.g. the RAG sources event), so keep the trailing partial line
+      let buffered = '';
 
       try {
         while (true) {
@@ -97,9 +104,10 @@ export const sendStreamingMessage = createAsyncThunk(
             break;
           }
 
-          const chunk = decoder.decode(value);
+          const chunk = decoder.decode(value, { stream: true });
           console.log('📖 Decoded chunk:', chunk);
-          const lines = chunk.split('\n');
+          const lines = (buffered + chunk).split('\n');
+          buffered = lines.pop() ?? '';
 
           for (const line of lines) {
             if (line.startsWith('data: ')) {
@@ -115,6 +123,16 @@ export const sendStreamingMessage = createAsyncThunk(
               try {
                 const parsed = JSON.parse(data);
                 console.log('📊 Parsed data:', parsed);
+                if (parsed.sources) {
+                  console.log('📚 RAG sources received:', parsed.sources.length);
+                }
+                if (parsed.error) {
+                  console.log('❌ Stream error event:', parsed.error);
+                  dispatch(appendToStreamingMessage({ 
+                    messageId, 
+                    content: `\n\n⚠️ ${parsed.error}` 
+                  }));
+                }
                 if (parsed.content) {
                   console.log('✏️ Appending content:', parsed.content);
                   dispatch(appendToStreamingMessage({ 